@@ -0,0 +1,158 @@
+"""
+personal, un sistema de gestión de personas
+
+    Copyright (C) 2023 Ángel Luis García García
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Comprueba que las consultas frecuentes no degeneran en N+1: cargar la ficha
+# de una persona, una página del listado y la exportación completa se
+# ejecutan con el modo raiseload activado (una carga perezosa que necesite SQL
+# hace fallar la operación) y dentro de limitar_sentencias, con un número
+# máximo de sentencias SQL que no depende del número de personas ni de sus
+# contactos (ver deteccion_n1.py).
+#
+# La base de datos se crea en un directorio temporal (configurándola como la
+# de la aplicación), con personas relacionadas entre sí y con varios
+# contactos cada una. Devuelve 0 si todas las comprobaciones se cumplen, y 1
+# en caso contrario. Uso:
+#
+#   python benchmarks/comprobar_n1.py [--personas 1200] [--contactos 3]
+
+import argparse
+import io
+import math
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+
+DIRECTORIO = tempfile.TemporaryDirectory()
+with open(os.path.join(DIRECTORIO.name, "personal.ini"), "w") as f:
+    f.write(f"[bd]\nfichero = {os.path.join(DIRECTORIO.name, 'n1.db')}\n\n"
+            f"[sql]\ndetectar_n1 = true\nraiseload = true\n")
+os.environ["PERSONAL_CONFIG"] = os.path.join(DIRECTORIO.name, "personal.ini")
+
+from sqlalchemy import insert, update
+
+from personal.model.model import DBManager, Persona, Telefono, Mail, \
+     Direccion, CodigoPostal
+from personal.model.exportacion import exportar, TAM_LOTE_EXPORTACION
+from personal.model.deteccion_n1 import limitar_sentencias
+
+# Sentencias SQL máximas de cada comprobación. La ficha se lee con una sola
+# consulta (con JOIN), y una página del listado también. La exportación lee
+# las personas por lotes, con una consulta para las personas y otra por
+# relación cargada con selectinload (tipo de relación, persona relacionada,
+# teléfonos, correos y direcciones con su código postal) en cada lote.
+
+SENTENCIAS_FICHA = 1
+SENTENCIAS_PAGINA = 1
+SENTENCIAS_LOTE_EXPORTACION = 6
+
+def crear_personas(bd, personas, contactos):
+    """Da de alta las personas, cada una con contactos teléfonos, correos y
+    direcciones, y relacionada con la anterior.
+    """
+
+    ret = bd.alta_tipo_relacion("Familiar")
+    assert ret[0], ret[1]
+    tipo_id = ret[1]
+
+    ret = bd.alta_personas_lote([{'nif': f"{i:08d}N", 'nombre': "Ana",
+                                  'ap1': "García", 'ap2': None,
+                                  'fnac': "1980-01-01", 'sexo': "Mujer",
+                                  'observ': None}
+                                 for i in range(personas)])
+    assert ret[0] and not ret[1], ret[1]
+
+    ids = [i for i, _, _, _ in bd.obtener_nombres_personas()[1]]
+
+    with bd.engine.begin() as conexion:
+        cp_id = conexion.execute(insert(CodigoPostal.__table__).values(
+            cp="28001", localidad="Madrid", provincia="Madrid")).\
+            inserted_primary_key[0]
+        conexion.execute(insert(Telefono.__table__),
+                         [{'persona_id': id_, 'numero': f"6{id_:04d}{j:04d}",
+                           'preferencia': int(j == 0)}
+                          for id_ in ids for j in range(contactos)])
+        conexion.execute(insert(Mail.__table__),
+                         [{'persona_id': id_, 'mail': f"p{id_}.{j}@correo.es",
+                           'preferencia': int(j == 0)}
+                          for id_ in ids for j in range(contactos)])
+        conexion.execute(insert(Direccion.__table__),
+                         [{'persona_id': id_, 'direccion': f"Calle {j}",
+                           'cp_id': cp_id, 'preferencia': int(j == 0)}
+                          for id_ in ids for j in range(contactos)])
+        for anterior, id_ in zip(ids, ids[1:]):
+            conexion.execute(update(Persona.__table__).
+                             where(Persona.id_ == id_).
+                             values(relacionado_con=anterior,
+                                    tipo_relacion_id=tipo_id))
+
+    return ids
+
+def comprobar(nombre, maximo, operacion):
+    """Ejecuta operacion, que devuelve (True, ...) o (False, error), dentro
+    de limitar_sentencias(maximo). Muestra el resultado y devuelve True si
+    la operación termina bien sin superar el máximo ni repetir cargas
+    perezosas.
+    """
+
+    try:
+        with limitar_sentencias(maximo, nombre) as ejecucion:
+            ret = operacion()
+        correcto = ret[0]
+        detalle = f"{ejecucion.sentencias} sentencias (máximo {maximo})"
+        if not correcto: detalle += f": {ret[1]}"
+    except AssertionError as e:
+        correcto, detalle = False, str(e)
+
+    print(f"[{'OK' if correcto else 'FALLO'}] {nombre}: {detalle}")
+
+    return correcto
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description="Comprueba que las consultas "
+                                     "frecuentes no hacen N+1")
+    parser.add_argument("--personas", type=int, default=1200)
+    parser.add_argument("--contactos", type=int, default=3,
+                        help="teléfonos, correos y direcciones por persona")
+    args = parser.parse_args(argv)
+
+    bd = DBManager()
+    assert bd.detector_n1.activo and bd.detector_n1.raiseload
+
+    ids = crear_personas(bd, args.personas, args.contactos)
+
+    lotes = math.ceil(args.personas / TAM_LOTE_EXPORTACION) + 1
+    comprobaciones = [
+        ("ficha de una persona", SENTENCIAS_FICHA,
+         lambda: bd.obtener_ficha_persona(ids[-1])),
+        ("página del listado", SENTENCIAS_PAGINA,
+         lambda: bd.obtener_pagina_personas('apellidos')),
+        ("exportación completa", lotes * SENTENCIAS_LOTE_EXPORTACION,
+         lambda: exportar(io.StringIO(), 'jsonl', bd)),
+    ]
+
+    correctas = [comprobar(*c) for c in comprobaciones]
+
+    return 0 if all(correctas) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""
+personal, un sistema de gestión de personas
+
+    Copyright (C) 2023 Ángel Luis García García
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Mide el tiempo de guardar una persona modificada (con
+# modificar_campos_persona, como OnGuardarPersona) y reflejarlo en el listado
+# de la ventana principal, según el número de personas de la base de datos:
+#
+#   - recarga: el listado se vacía y se vuelven a leer todas sus filas, página
+#     a página hasta que canFetchMore() es False (como cuando poblar_personas
+#     cargaba todas las personas en cada guardado).
+#   - incremental: solo se recoloca la fila de la persona modificada.
+#
+# La base de datos se crea en un directorio temporal (configurándola como la
+# de la aplicación) y se le van añadiendo personas hasta cada tamaño. Uso:
+#
+#   python benchmarks/guardar_persona.py [--tamanyos 1000 10000 50000]
+#                                        [--repeticiones 50]
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+
+DIRECTORIO = tempfile.TemporaryDirectory()
+with open(os.path.join(DIRECTORIO.name, "personal.ini"), "w") as f:
+    f.write(f"[bd]\nfichero = {os.path.join(DIRECTORIO.name, 'bench.db')}\n")
+os.environ["PERSONAL_CONFIG"] = os.path.join(DIRECTORIO.name, "personal.ini")
+
+from PyQt6.QtGui import QGuiApplication
+
+from personal.model.model import DBManager
+from personal.model.indice_busqueda import IndiceBusqueda
+from personal.controller.controller_lista_personas import ModeloPersonas, \
+     FiltroPersonas
+
+NOMBRES = ("Ana", "Luis", "Carmen", "José", "Lucía", "Íñigo", "María",
+           "Óscar", "Pilar", "Raúl")
+APELLIDOS = ("García", "Pérez", "Núñez", "López", "Martín", "Sánchez",
+             "Gómez", "Díaz", "Ruiz", "Álvarez")
+
+def anyadir_personas(bd, desde, hasta):
+    """Da de alta personas aleatorias, con NIF desde..hasta-1"""
+
+    for i in range(desde, hasta, 5000):
+        personas = [{'nif': f"{j:08d}P", 'nombre': random.choice(NOMBRES),
+                     'ap1': random.choice(APELLIDOS),
+                     'ap2': random.choice(APELLIDOS), 'fnac': "1980-01-01",
+                     'sexo': random.choice(("Hombre", "Mujer")),
+                     'observ': None}
+                    for j in range(i, min(i + 5000, hasta))]
+        ret = bd.alta_personas_lote(personas)
+        assert ret[0], ret[1]
+
+def medir(bd, incremental, repeticiones):
+    """Devuelve la lista de tiempos (ms) de modificar una persona y reflejarlo
+    en el listado.
+    """
+
+    indice = IndiceBusqueda()
+    indice.cargar(bd.obtener_nombres_personas()[1])
+    modelo = ModeloPersonas()
+    filtro = FiltroPersonas(indice, modelo)
+    filtro.aplicar("")
+
+    ids = [i for i, _, _, _ in bd.obtener_nombres_personas()[1]]
+    tiempos = []
+
+    for _ in range(repeticiones):
+
+        id_ = random.choice(ids)
+        persona = bd.obtener_persona_por_id(id_, con_foto=False)[1]
+        nombre, ap1 = random.choice(NOMBRES), random.choice(APELLIDOS)
+
+        inicio = time.perf_counter()
+
+        ret = bd.modificar_campos_persona(id_, {'nombre': nombre, 'ap1': ap1})
+        assert ret[0], ret[1]
+        indice.actualizar(id_, nombre, ap1, persona.ap2)
+        if incremental:
+            filtro.actualizar_persona(id_)
+        else:
+            filtro.aplicar()
+            while modelo.canFetchMore():
+                modelo.fetchMore()
+
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+
+    return tiempos
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description="Latencia de guardar una "
+                                     "persona según el tamaño del directorio")
+    parser.add_argument("--tamanyos", type=int, nargs="+",
+                        default=[1000, 10000, 50000])
+    parser.add_argument("--repeticiones", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    random.seed(1)
+    app = QGuiApplication(sys.argv)
+
+    bd = DBManager()
+
+    print(f"{'personas':>10} {'recarga (ms)':>14} {'incremental (ms)':>18}")
+
+    total = 0
+    for tamanyo in sorted(args.tamanyos):
+
+        anyadir_personas(bd, total, tamanyo)
+        total = tamanyo
+
+        recarga = statistics.median(medir(bd, False, args.repeticiones))
+        incremental = statistics.median(medir(bd, True, args.repeticiones))
+        print(f"{tamanyo:>10} {recarga:>14.2f} {incremental:>18.2f}")
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,406 @@
+"""
+personal, un sistema de gestión de personas
+
+    Copyright (C) 2023 Ángel Luis García García
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Interfaz de línea de órdenes (personal-cli), para tareas programadas y
+# scripts. Solo utiliza el modelo: nunca importa PyQt6, y cada orden importa
+# lo que necesita al ejecutarse, de forma que Pillow solo se carga si hay que
+# tratar fotos y ReportLab solo para generar un informe.
+#
+#   personal-cli [--bd fichero.db] list [--orden apellidos] [--todas]
+#   personal-cli show 12 [--json]
+#   personal-cli search "garcía madrid"
+#   personal-cli import personas.csv [--lote 1000]
+#   personal-cli export salida.jsonl [--fotos carpeta]
+#   personal-cli report 12 [--salida ficha.pdf]
+#   personal-cli stats [--json]
+#
+# Los listados se escriben en la salida estándar con una persona por línea,
+# con los campos separados por tabuladores o, con --json, como JSON Lines.
+# Los avisos y errores se escriben en la salida de error.
+
+import argparse
+import json
+import os
+import sys
+
+# Órdenes que se delegan en la línea de órdenes de su módulo, con todos sus
+# argumentos.
+
+_ORDENES_DELEGADAS = ('import', 'export')
+
+# Órdenes que pueden crear la base de datos indicada con --bd si no existe.
+# Con el resto, que solo leen, una ruta errónea es un error, y no una base de
+# datos nueva y vacía.
+
+_ORDENES_CREAN_BD = ('import', )
+
+def _dbmanager(args):
+    """Devuelve el DBManager de la base de datos indicada con --bd o, si no
+    se indica, el de la aplicación.
+    """
+
+    from personal.model.model import DBManager
+
+    return DBManager(f"sqlite:///{args.bd}") if args.bd else DBManager()
+
+def _error(texto):
+    """Escribe el error en la salida de error. Devuelve 1"""
+
+    print(texto, file=sys.stderr)
+
+    return 1
+
+def _entero_positivo(texto):
+    """Tipo de argparse para un número entero mayor que cero"""
+
+    try:
+        n = int(texto)
+    except ValueError:
+        n = 0
+
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"debe ser un número entero "
+                                         f"positivo: {texto}")
+
+    return n
+
+def _escribir_filas(filas, como_json):
+    """Escribe las filas del listado ligero de personas"""
+
+    for f in filas:
+        if como_json:
+            print(json.dumps({'id_': f.id_, 'nif': f.nif,
+                              'nombre': f.nombre, 'ap1': f.ap1,
+                              'ap2': f.ap2, 'fnac': f.fnac, 'sexo': f.sexo,
+                              'tiene_foto': bool(f.tiene_foto)},
+                             ensure_ascii=False))
+        else:
+            print(f"{f.id_}\t{f.nif}\t{f.nombre_completo}\t{f.fnac}\t"
+                  f"{f.sexo}")
+
+# #####
+# LISTA
+# #####
+
+def _listar(args):
+
+    bd = _dbmanager(args)
+    cursor = args.cursor
+
+    while True:
+
+        ret = bd.obtener_pagina_personas(args.orden, args.descendente,
+                                         args.filtro, cursor, args.limite)
+        if not ret[0]: return _error(f"Error al listar las personas: "
+                                     f"{ret[1]}")
+
+        _escribir_filas(ret[1].filas, args.json)
+
+        cursor = ret[1].cursor
+        if cursor is None: break
+        if not args.todas:
+            print(f"Hay más personas: --cursor {cursor}", file=sys.stderr)
+            break
+
+    return 0
+
+# #####
+# FICHA
+# #####
+
+def _mostrar(args):
+
+    ret = _dbmanager(args).obtener_ficha_persona(args.id_)
+    if not ret[0]: return _error(f"Error al leer la persona: {ret[1]}")
+
+    ficha = ret[1]
+    if ficha is None: return _error(f"No existe la persona {args.id_}")
+
+    if args.json:
+        from personal.model.exportacion import ficha_a_diccionario
+        print(json.dumps(ficha_a_diccionario(ficha), ensure_ascii=False))
+        return 0
+
+    pref = lambda c: " (preferente)" if c.preferencia else ""
+    obs = lambda c: f" - {c.observ}" if c.observ else ""
+
+    print(f"Persona {ficha.id_}: {ficha.nombre} {ficha.ap1} "
+          f"{ficha.ap2 or ''}".rstrip())
+    print(f"DNI: {ficha.nif}")
+    print(f"Sexo: {ficha.sexo}")
+    print(f"Fecha nacimiento: {ficha.fnac}")
+    if ficha.relacionado is not None:
+        r = ficha.relacionado
+        print(f"Relación: {ficha.tipo_relacion or ''} de {r.nombre} {r.ap1} "
+              f"{r.ap2 or ''}".rstrip() + f" ({r.id_})")
+    print(f"Foto: {'sí' if ficha.foto_hash else 'no'}")
+    if ficha.observ: print(f"Información: {ficha.observ}")
+
+    print("Teléfonos:")
+    for t in ficha.telefonos: print(f"  {t.numero}{pref(t)}{obs(t)}")
+    print("Correos electrónicos:")
+    for m in ficha.mails: print(f"  {m.mail}{pref(m)}{obs(m)}")
+    print("Direcciones:")
+    for d in ficha.direcciones:
+        print(f"  {d.direccion}, {d.cp} {d.localidad} ({d.provincia})"
+              f"{pref(d)}{obs(d)}")
+
+    return 0
+
+# ########
+# BÚSQUEDA
+# ########
+
+def _buscar(args):
+
+    bd = _dbmanager(args)
+
+    ret = bd.buscar_personas(args.texto, args.desplazamiento, args.limite)
+    if not ret[0]: return _error(f"Error en la búsqueda: {ret[1]}")
+
+    ret = bd.obtener_personas_por_ids(ret[1])
+    if not ret[0]: return _error(f"Error en la búsqueda: {ret[1]}")
+
+    _escribir_filas(ret[1], args.json)
+
+    return 0
+
+# #######
+# INFORME
+# #######
+
+def _informe(args):
+
+    bd = _dbmanager(args)
+
+    ret = bd.obtener_ficha_persona(args.id_)
+    if not ret[0]: return _error(f"Error al leer la persona: {ret[1]}")
+
+    ficha = ret[1]
+    if ficha is None: return _error(f"No existe la persona {args.id_}")
+
+    ret = bd.abrir_foto_persona(ficha.id_)
+    if not ret[0]: return _error(f"Error al leer la foto: {ret[1]}")
+    lector = ret[1]
+
+    # Como en el informe de la ventana principal, se muestran el contacto
+    # preferente de cada tipo y la fecha de nacimiento en formato dd/mm/aaaa.
+
+    preferente = lambda contactos: next((c for c in contactos
+                                         if c.preferencia), None)
+    d = preferente(ficha.direcciones)
+    m = preferente(ficha.mails)
+    t = preferente(ficha.telefonos)
+
+    datos = {'nombre': ficha.nombre,
+             'apellidos': f"{ficha.ap1} {ficha.ap2 or ''}",
+             'dni': ficha.nif,
+             'fnac': "/".join(reversed(ficha.fnac.split("-"))),
+             'sexo': ficha.sexo,
+             'observ': ficha.observ or "",
+             'direccion': "" if d is None else
+                 f"{d.direccion}, {d.cp} {d.localidad} ({d.provincia})",
+             'obs_direccion': "" if d is None else d.observ,
+             'mail': "" if m is None else m.mail,
+             'obs_mail': "" if m is None else m.observ,
+             'tlfno': "" if t is None else t.numero,
+             'obs_tlfno': "" if t is None else t.observ,
+             'foto': lector}
+
+    # El informe se genera con ReportLab, que solo se importa aquí.
+
+    from personal.controller.controller_informes import InformeReportLab
+    from personal.view.view import ICO_ACERCADE
+
+    salida = args.salida or f"informe_{ficha.id_}.pdf"
+
+    try:
+        InformeReportLab(ICO_ACERCADE, salida).crear_informe(
+            datos, args.cabecera, args.orientacion)
+    except OSError as e:
+        return _error(f"Error al generar el informe: {e}")
+    finally:
+        if lector is not None: lector.close()
+
+    print(f"Informe generado: {salida}", file=sys.stderr)
+
+    return 0
+
+# ############
+# ESTADÍSTICAS
+# ############
+
+def _estadisticas(args):
+
+    bd = _dbmanager(args)
+
+    ret = bd.obtener_estadisticas()
+    if not ret[0]: return _error(f"Error al leer las estadísticas: {ret[1]}")
+    recuentos = ret[1]
+
+    ret = bd.obtener_informe_fotos()
+    if not ret[0]: return _error(f"Error al leer las estadísticas: {ret[1]}")
+    fotos = ret[1]
+
+    fichero = bd.engine.url.database
+    tamanyo = os.path.getsize(fichero) if fichero and \
+        os.path.exists(fichero) else None
+
+    if args.json:
+        print(json.dumps({'base_de_datos': fichero, 'bytes': tamanyo,
+                          'perfil': bd.perfil,
+                          'busqueda_texto': bool(bd.fts),
+                          'tablas': recuentos,
+                          'fotos': fotos._asdict()}, ensure_ascii=False))
+        return 0
+
+    print(f"Base de datos: {fichero}" +
+          ("" if tamanyo is None else f" ({tamanyo} bytes)"))
+    print(f"Perfil de SQLite: {bd.perfil}")
+    print(f"Búsqueda de texto completo: {'sí' if bd.fts else 'no'}")
+    print("Filas por tabla:")
+    for tabla, filas in recuentos.items(): print(f"  {tabla}: {filas}")
+    print(f"Almacén de fotos: {fotos.personas} personas con foto, "
+          f"{fotos.fotos} fotos distintas, {fotos.bytes_almacenados} bytes "
+          f"guardados de {fotos.bytes_referenciados}")
+
+    return 0
+
+# #################
+# LÍNEA DE ÓRDENES
+# #################
+
+def _importar(args, resto):
+
+    from personal.model.importacion import main as importar
+
+    return importar(resto + (["--bd", args.bd] if args.bd else []),
+                    "personal-cli import")
+
+def _exportar(args, resto):
+
+    from personal.model.exportacion import main as exportar
+
+    return exportar(resto + (["--bd", args.bd] if args.bd else []),
+                    "personal-cli export")
+
+def _crear_parser():
+    """Crea el analizador de argumentos de personal-cli"""
+
+    # Los órdenes del listado (ORDENES_PERSONA) se repiten aquí para no
+    # importar el modelo, y con él SQLAlchemy, solo para mostrar la ayuda.
+    ordenes_persona = ('apellidos', 'nombre', 'fnac', 'nif', 'id_')
+
+    parser = argparse.ArgumentParser(
+        prog="personal-cli",
+        description="Gestión de personas desde la línea de órdenes.")
+    parser.add_argument("--bd", help="base de datos (por defecto, la de la "
+                        "aplicación)")
+    ordenes = parser.add_subparsers(dest="orden_cli", required=True,
+                                    metavar="orden")
+
+    p = ordenes.add_parser("list", help="lista las personas")
+    p.add_argument("--orden", choices=ordenes_persona, default='nombre',
+                   help="orden del listado (por defecto, nombre)")
+    p.add_argument("--descendente", action="store_true",
+                   help="en orden descendente")
+    p.add_argument("--filtro", help="solo las personas cuyo nombre completo "
+                   "contiene FILTRO")
+    p.add_argument("--limite", type=_entero_positivo, default=200,
+                   help="personas por página (por defecto, 200)")
+    p.add_argument("--cursor", help="continúa el listado desde la página "
+                   "indicada por un listado anterior")
+    p.add_argument("--todas", action="store_true",
+                   help="lista todas las páginas")
+    p.add_argument("--json", action="store_true",
+                   help="una persona por línea en JSON")
+    p.set_defaults(funcion=_listar)
+
+    p = ordenes.add_parser("show", help="muestra la ficha de una persona")
+    p.add_argument("id_", type=int, metavar="id", help="número de persona")
+    p.add_argument("--json", action="store_true", help="en JSON")
+    p.set_defaults(funcion=_mostrar)
+
+    p = ordenes.add_parser("search", help="busca en las fichas de las "
+                           "personas (texto completo)")
+    p.add_argument("texto", help="palabras que se buscan (como prefijo)")
+    p.add_argument("--limite", type=_entero_positivo, default=50,
+                   help="número máximo de resultados (por defecto, 50)")
+    p.add_argument("--desplazamiento", type=int, default=0,
+                   help="resultados que se saltan")
+    p.add_argument("--json", action="store_true",
+                   help="una persona por línea en JSON")
+    p.set_defaults(funcion=_buscar)
+
+    # La importación y la exportación tienen sus propios argumentos (ver
+    # personal-cli import --help).
+    p = ordenes.add_parser("import", add_help=False,
+                           help="importa personas desde un CSV")
+    p.set_defaults(funcion=_importar)
+    p = ordenes.add_parser("export", add_help=False,
+                           help="exporta las personas a CSV, JSON Lines o "
+                           "vCard")
+    p.set_defaults(funcion=_exportar)
+
+    p = ordenes.add_parser("report", help="genera el informe PDF de una "
+                           "persona")
+    p.add_argument("id_", type=int, metavar="id", help="número de persona")
+    p.add_argument("--salida", "-o", help="fichero PDF (por defecto, "
+                   "informe_<id>.pdf)")
+    p.add_argument("--cabecera", default="Informe Personal",
+                   help="título del informe")
+    p.add_argument("--orientacion", choices=("v", "h"), default="v",
+                   help="vertical (v) u horizontal (h)")
+    p.set_defaults(funcion=_informe)
+
+    p = ordenes.add_parser("stats", help="muestra el tamaño de la base de "
+                           "datos y el número de filas de cada tabla")
+    p.add_argument("--json", action="store_true", help="en JSON")
+    p.set_defaults(funcion=_estadisticas)
+
+    return parser
+
+def main(argv = None):
+    """Ejecuta personal-cli. Devuelve 0 si la orden termina bien, y 1 en
+    caso contrario.
+    """
+
+    parser = _crear_parser()
+    args, resto = parser.parse_known_args(argv)
+
+    if args.bd and args.orden_cli not in _ORDENES_CREAN_BD and \
+       not os.path.exists(args.bd):
+        return _error(f"No existe la base de datos {args.bd}")
+
+    if args.orden_cli in _ORDENES_DELEGADAS:
+        return args.funcion(args, resto)
+
+    if resto:
+        parser.error(f"argumentos no reconocidos: {' '.join(resto)}")
+
+    try:
+        return args.funcion(args)
+    except BrokenPipeError:
+        # La salida se ha cerrado antes de terminar (p.ej. con | head). Se
+        # redirige a /dev/null para que Python no falle al vaciarla al salir.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
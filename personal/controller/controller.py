@@ -17,14 +17,15 @@ personal, un sistema de gestión de personas
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import os
 from datetime import datetime
-from io import BytesIO
+from functools import partial
 from PIL import Image
 
 from PyQt6 import QtWidgets, QtGui
 from PyQt6.QtGui import QIcon, QPixmap
-from PyQt6.QtWidgets import QMessageBox, QFileDialog, QLabel
-from PyQt6.QtCore import Qt, QSize, QDate, QBuffer, QByteArray, QIODeviceBase
+from PyQt6.QtWidgets import QMessageBox, QFileDialog
+from PyQt6.QtCore import Qt, QDate, QBuffer, QByteArray, QIODeviceBase
 
 from personal.view.view_personal import Ui_MainWindow
 from personal.view.view import ICO_ALTA, ICO_BAJA, ICO_GUARDAR, ICO_CANCELAR, \
@@ -32,6 +33,10 @@ from personal.view.view import ICO_ALTA, ICO_BAJA, ICO_GUARDAR, ICO_CANCELAR, \
      ICO_INFO
 
 from personal.model.model import DBManager
+from personal.model.deteccion_n1 import instrumentar_slots
+from personal.model.importacion import importar_csv, leer_progreso, \
+     EXT_RECHAZOS
+from personal.model.exportacion import exportar_fichero, formato_de_fichero
 
 from personal.controller.controller_direcciones import \
      Dialog_DireccionesPostales
@@ -39,6 +44,28 @@ from personal.controller.controller_mails import Dialog_Correos
 from personal.controller.controller_telefonos import Dialog_Telefonos
 from personal.controller.controller_informes import CrearInforme
 from personal.controller.controller_acercade import Dialog_Acercade
+from personal.controller.controller_lista_personas import ModeloPersonas, \
+     DelegadoMiniatura, FiltroPersonas
+from personal.controller.controller_tareas import GestorTareas
+from personal.controller.controller_cache_fotos import CacheFotos
+from personal.model.indice_busqueda import IndiceBusqueda
+
+def _alta_persona_completa(t, valores, foto):
+    """Da de alta la persona con todos los datos del formulario, incluidas
+    las observaciones (que alta_persona no recibe), en la transacción t (ver
+    DBManager.transaccion), con un solo commit. Devuelve el id_ de la
+    persona.
+    """
+    
+    id_ = t.alta_persona(valores['nif'], valores['nombre'], valores['ap1'],
+                         valores['ap2'], valores['fnac'], foto,
+                         valores['sexo'])[1]
+    
+    resto = {c: valores[c] for c in
+             ('observ', 'tipo_relacion_id', 'relacionado_con') if valores[c]}
+    t.modificar_campos_persona(id_, resto)
+    
+    return id_
 
 class VentanaPrincipal(QtWidgets.QMainWindow):
     def __init__(self, parent=None):
@@ -46,6 +73,11 @@ class VentanaPrincipal(QtWidgets.QMainWindow):
         
         super(VentanaPrincipal, self).__init__()
         
+        # En modo depuración de consultas N+1, cada invocación de un slot es
+        # una acción cuyas sentencias SQL se cuentan. Los slots se envuelven
+        # antes de conectarlos.
+        if DBManager().detector_n1.activo: instrumentar_slots(self)
+        
         self.ui = Ui_MainWindow()
         self.ui.setupUi(self)
         
@@ -95,6 +127,13 @@ class VentanaPrincipal(QtWidgets.QMainWindow):
         
         self.__foto = None
         
+        # Valores guardados de la persona en edición, para enviar a la base
+        # de datos solo los campos cambiados, e indicador de si se ha elegido
+        # o quitado la foto.
+        
+        self.__originales = {}
+        self.__foto_modificada = False
+        
         # Por defecto, solo está activada la búsqueda y los botones de
         # operaciones.
         
@@ -102,7 +141,47 @@ class VentanaPrincipal(QtWidgets.QMainWindow):
         for i in ["contacto", "otros",  "personal"]:
             self.activar_elementos(i, False)
             
+        # Acceso a la base de datos en segundo plano, con un indicador de
+        # actividad en la barra de estado.
+        self.gestor_tareas = GestorTareas(self)
+        self.indicador_ocupado = QtWidgets.QProgressBar(self)
+        self.indicador_ocupado.setRange(0, 0)
+        self.indicador_ocupado.setMaximumWidth(120)
+        self.indicador_ocupado.setVisible(False)
+        self.ui.statusbar.addPermanentWidget(self.indicador_ocupado)
+        self.gestor_tareas.ocupado.connect(self.indicador_ocupado.setVisible)
+        
+        # Listado de personas (modelo / vista, cargado por páginas).
+        self.modelo_personas = ModeloPersonas(self, self.gestor_tareas)
+        self.modelo_personas.error_carga.connect(self.OnErrorCargaPersonas)
+        self.ui.tableView_per.setModel(self.modelo_personas)
+        self.ui.tableView_per.setItemDelegateForColumn(ModeloPersonas.COL_FOTO,
+                                                       DelegadoMiniatura(self))
+        self.ui.tableView_per.setColumnHidden(ModeloPersonas.COL_ID, True)
+        self.ui.tableView_per.setColumnWidth(ModeloPersonas.COL_NOMBRE, 235)
+        self.ui.tableView_per.setColumnWidth(ModeloPersonas.COL_FOTO, 64)
+        self.ui.tableView_per.verticalHeader().setDefaultSectionSize(64)
+        
+        # Caché de las fotos de la ficha ya decodificadas. Sus estadísticas se
+        # muestran en el informe de consultas SQL (OnInformeSQL).
+        self.cache_fotos = CacheFotos()
+        
+        # Índice de búsqueda de personas, y filtro con retardo del listado.
+        self.indice_busqueda = IndiceBusqueda()
+        self.filtro_personas = FiltroPersonas(self.indice_busqueda,
+                                              self.modelo_personas, self)
+        
+        # Se generan las miniaturas de las fotos que aún no las tengan (fotos
+        # guardadas antes de existir las miniaturas).
+        self.gestor_tareas.ejecutar("miniaturas",
+                                    "generar_miniaturas_pendientes",
+                                    al_terminar = self.OnMiniaturasGeneradas)
+        
+        # Se informa del perfil de rendimiento de SQLite en uso.
+        self.informar_perfil_bd()
+        
         # Se recuperan por defecto todas las personas.
+        self.poblar_indice_busqueda()
         self.poblar_personas()
         
         # Se cargan los tipos de relaciones entre personas.
@@ -115,6 +194,26 @@ class VentanaPrincipal(QtWidgets.QMainWindow):
         
         # Connect de Acerca de
         self.ui.pushButton_acerca_de.clicked.connect(self.acerca_de)
+        
+        # Menú de operaciones sobre todos los datos.
+        menu_datos = self.menuBar().addMenu("&Datos")
+        self.action_importar_csv = QtGui.QAction("&Importar personas desde "
+                                                 "CSV...", self)
+        self.action_importar_csv.triggered.connect(self.OnImportarCSV)
+        menu_datos.addAction(self.action_importar_csv)
+        self.action_exportar = QtGui.QAction("&Exportar personas...", self)
+        self.action_exportar.triggered.connect(self.OnExportar)
+        menu_datos.addAction(self.action_exportar)
+        menu_datos.addSeparator()
+        self.action_medir_sql = QtGui.QAction("&Medir consultas SQL", self)
+        self.action_medir_sql.setCheckable(True)
+        self.action_medir_sql.setChecked(DBManager().instrumentacion.activa)
+        self.action_medir_sql.toggled.connect(self.OnMedirSQL)
+        menu_datos.addAction(self.action_medir_sql)
+        self.action_informe_sql = QtGui.QAction("Informe de consultas S&QL...",
+                                                self)
+        self.action_informe_sql.triggered.connect(self.OnInformeSQL)
+        menu_datos.addAction(self.action_informe_sql)
        
         # Connects de botones de operaciones.
         self.ui.pushButton_alta_per.clicked.connect(self.OnAltaPersona)
@@ -126,7 +225,7 @@ class VentanaPrincipal(QtWidgets.QMainWindow):
         self.ui.pushButton_borrar_foto.clicked.connect(self.OnBorrarFoto)
         
         # Connects de búsqueda de personal.
-        self.ui.tableWidget_per.clicked.connect(self.OnClickPersona)
+        self.ui.tableView_per.clicked.connect(self.OnClickPersona)
         self.ui.lineEdit_buscar_per.textChanged.connect(self.OnBuscar)
         
         # Connects de edición de contactos.
@@ -152,12 +251,130 @@ class VentanaPrincipal(QtWidgets.QMainWindow):
         self.ui.pushButton_borrar_relacion.clicked.connect(self.OnBorrarRel)
         self.ui.pushButton_rel_per.clicked.connect(self.OnCrearRelacion)
         
+    def closeEvent(self, evento):
+        """Espera a que terminen las operaciones en segundo plano antes de
+        cerrar la ventana.
+        """
+        
+        self.gestor_tareas.esperar()
+        super(VentanaPrincipal, self).closeEvent(evento)
+        
     def acerca_de(self):
         """Muestra un diálogo sobre la autoría de la aplicación"""
         
         dialog = Dialog_Acercade(ICO_ACERCADE)
         dialog.exec()
         
+    def OnImportarCSV(self):
+        """Importa personas de forma masiva desde un fichero CSV"""
+        
+        nfich, _ = QFileDialog.getOpenFileName(self, "Importar personas", "",
+                                               "Ficheros CSV (*.csv)")
+        if not nfich: return
+        
+        # Si una importación anterior del fichero se interrumpió, se puede
+        # reanudar o empezar de nuevo (descartando su progreso y sus filas
+        # rechazadas).
+        reanudar = True
+        filas = leer_progreso(nfich)
+        if filas > 0:
+            msg = QMessageBox(text = f"La importación de este fichero se " + \
+                              f"interrumpió tras {filas} filas.", parent=self)
+            msg.setWindowTitle("personal")
+            msg.setIcon(QMessageBox.Icon.Question)
+            msg.setInformativeText("Se puede reanudar desde la última fila "
+                                   "guardada, o empezar de nuevo desde el "
+                                   "principio.")
+            boton_reanudar = msg.addButton("Reanudar",
+                                           QMessageBox.ButtonRole.AcceptRole)
+            boton_empezar = msg.addButton("Empezar de nuevo",
+                                          QMessageBox.ButtonRole.ResetRole)
+            msg.addButton(QMessageBox.StandardButton.Cancel)
+            msg.setDefaultButton(boton_reanudar)
+            msg.exec()
+            
+            if msg.clickedButton() is boton_empezar: reanudar = False
+            elif msg.clickedButton() is not boton_reanudar: return
+        
+        def progreso(r):
+            self.mostrar_mensaje(f"Importando... {r.inicio + r.leidas} filas "
+                                 "procesadas", caja_texto = False)
+            QtWidgets.QApplication.processEvents()
+        
+        QtWidgets.QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            ret = importar_csv(nfich, reanudar = reanudar,
+                               progreso = progreso)
+        finally:
+            QtWidgets.QApplication.restoreOverrideCursor()
+        
+        if not ret[0]:
+            self.mostrar_mensaje("Fallo al importar personas", \
+                                 caja_texto = False)
+            self.mostrar_mensaje("No se ha podido completar la importación",
+                                 mas_info = "Se puede reanudar desde el " + \
+                                 "último lote guardado.",
+                                 detalle = str(ret[1]),
+                                 icono="critico")
+            return
+        
+        r = ret[1]
+        msg = f"Se han importado {r.insertadas} personas."
+        self.mostrar_mensaje(msg, caja_texto = False)
+        
+        mas_info = None
+        if r.rechazadas:
+            mas_info = f"{r.rechazadas} filas rechazadas. El motivo de " + \
+                f"cada una está en {nfich}{EXT_RECHAZOS}"
+        self.mostrar_mensaje(msg, mas_info = mas_info, icono = "informacion")
+        
+        # Se recargan el índice de búsqueda y el listado.
+        self.poblar_indice_busqueda()
+        self.poblar_personas()
+        
+    def OnExportar(self):
+        """Exporta todas las personas, con sus contactos, a un fichero CSV,
+        JSON Lines o vCard.
+        """
+        
+        nfich, filtro = QFileDialog.getSaveFileName(self, "Exportar personas",
+                                                    "", "CSV (*.csv);;"
+                                                    "JSON Lines (*.jsonl);;"
+                                                    "vCard (*.vcf)")
+        if not nfich: return
+        
+        # Si no se ha escrito la extensión, se toma la del filtro elegido.
+        if formato_de_fichero(nfich) is None:
+            nfich += filtro[filtro.index("*") + 1:-1]
+        
+        dir_fotos = os.path.splitext(nfich)[0] + "_fotos"
+        msg = "¿Desea exportar también las fotos, como ficheros aparte?"
+        if not self.mostrar_mensaje(texto = msg, mas_info = "Se guardarán " + \
+                                    f"en {dir_fotos}", cancel=True):
+            dir_fotos = None
+        
+        def progreso(n):
+            self.mostrar_mensaje(f"Exportando... {n} personas", \
+                                 caja_texto = False)
+            QtWidgets.QApplication.processEvents()
+        
+        QtWidgets.QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            ret = exportar_fichero(nfich, dir_fotos = dir_fotos,
+                                   progreso = progreso)
+        finally:
+            QtWidgets.QApplication.restoreOverrideCursor()
+        
+        if ret[0]:
+            self.mostrar_mensaje(f"Se han exportado {ret[1]} personas a " + \
+                                 f"{nfich}", caja_texto = False)
+        else:
+            self.mostrar_mensaje("Fallo al exportar personas", \
+                                 caja_texto = False)
+            self.mostrar_mensaje("No se ha podido completar la exportación",
+                                 detalle = str(ret[1]),
+                                 icono="critico")
+        
     def OnCrearRelacion(self):
         """Crea la relación de una persona con la persona actual"""
         
@@ -352,75 +569,123 @@ class VentanaPrincipal(QtWidgets.QMainWindow):
                             
     def poblar_personas(self):
         """Puebla todas las personas dadas de alta en el sistema"""
-       
-        bd = DBManager()
-    
-        ret = bd.obtener_todas_personas()
+        
+        # El modelo recupera las personas por páginas, según se van
+        # mostrando, aplicando el filtro de búsqueda actual.
+        
+        self.filtro_personas.aplicar(self.ui.lineEdit_buscar_per.text())
+        
+    def poblar_indice_busqueda(self):
+        """Construye, en segundo plano, el índice de búsqueda con todas las
+        personas.
+        """
+        
+        self.gestor_tareas.ejecutar("indice", "obtener_nombres_personas",
+                                    al_terminar = self.OnIndiceCargado)
+        
+    def OnIndiceCargado(self, ret):
+        """Carga el índice de búsqueda y vuelve a aplicar el filtro"""
         
         if ret[0]:
-            # msg = f"Se han recuperado {len(ret[1])} personas correctamente." 
-            # self.mostrar_mensaje(msg, caja_texto = False)
-    
-            # print(ret[1])
-            
-            self.ui.tableWidget_per.setRowCount(0)
-       
-            self.ui.tableWidget_per.setColumnHidden(0, True)
-            self.ui.tableWidget_per.setColumnWidth(1, 235)
-            self.ui.tableWidget_per.setColumnWidth(2, 64)
-            self.ui.tableWidget_per.setRowCount(len(ret[1]))
-            
-            # Poblamos.
-            fila = -1
-            for persona in ret[1]:
-                
-                fila += 1
-                                
-                id_ = str(persona.id_)
-                nombre = str(persona.nombre)
-                ap1 = str(persona.ap1)
-                ap2 = str(persona.ap2)
-                foto = persona.foto
-                
-                self.ui\
-                    .tableWidget_per\
-                    .setItem(fila, 0, QtWidgets.QTableWidgetItem(id_))
-
-                cadena = f"{nombre} {ap1} {ap2}".strip()
-                self.ui\
-                    .tableWidget_per\
-                    .setItem(fila, 1, QtWidgets.QTableWidgetItem(cadena))
-            
-                if foto is not None:
-                    
-                    if len(foto) == 0: pass
-                    else:     
-                        foto = Image.open(BytesIO(foto))
-                        foto_redim = foto.resize((64, 64), Image.LANCZOS)
-                        pixmap = QPixmap.fromImage(foto_redim.toqimage())
-                        pixmap.detach()
-                        # item = self.ui.tableWidget_per.item(fila, 2)
-                        # if item is not None: item.setIcon(pixmap)                
-                        marco = QLabel()
-                        marco.setScaledContents(True)
-                        marco.setAlignment(Qt.AlignmentFlag.AlignCenter)
-                        marco.setFixedSize(QSize(64, 64))
-                        marco.setPixmap(pixmap)
-    
-                        self.ui.tableWidget_per.setRowHeight(fila, 64)
-                        self.ui.tableWidget_per.setCellWidget(fila, 2, marco)                
-                    
-                
+            self.indice_busqueda.cargar(ret[1])
+            if self.ui.lineEdit_buscar_per.text().strip():
+                self.poblar_personas()
         else:
-            self.mostrar_mensaje(f"Fallo al recuperar todas las personas", \
-                                             caja_texto = False)
-    
-            msg = "No se ha podido recuperar ningún registro de personal"
-    
-            self.mostrar_mensaje("Fallo al buscar personal",
-                                             mas_info=msg,
-                                             detalle = str(ret[1]),
-                                             icono="critico")    
+            self.OnErrorCargaPersonas(str(ret[1]))
+        
+    def OnMiniaturasGeneradas(self, ret):
+        """Recarga el listado si se han generado miniaturas nuevas"""
+        
+        if ret[0] and ret[1] > 0: self.poblar_personas()
+        
+    def informar_perfil_bd(self):
+        """Muestra en la barra de estado el perfil de SQLite aplicado y el
+        valor efectivo de sus PRAGMAs, y avisa si la configuración no es
+        válida o si hay fotos pendientes de pasar al almacén de fotos.
+        """
+        
+        self.gestor_tareas.ejecutar("perfil", "obtener_perfil_sqlite",
+                                    al_terminar = self.OnPerfilBD)
+        
+    def OnPerfilBD(self, ret):
+        """Muestra el perfil de SQLite recuperado"""
+        
+        if not ret[0]:
+            self.mostrar_mensaje("Fallo al leer el perfil de la base de datos",
+                                 caja_texto = False)
+            return
+        
+        pragmas = ", ".join(f"{k}={v}" for k, v in ret[1]['pragmas'].items())
+        self.mostrar_mensaje(f"Perfil de base de datos {ret[1]['perfil']}: "
+                             f"{pragmas}", caja_texto = False)
+        
+        if ret[1]['error'] is not None:
+            self.mostrar_mensaje("Configuración de la base de datos no válida",
+                                 mas_info = "Se usa el perfil "
+                                 f"{ret[1]['perfil']}",
+                                 detalle = ret[1]['error'],
+                                 icono = "peligro")
+        
+        pendientes = DBManager().fotos_pendientes
+        if pendientes:
+            self.mostrar_mensaje(f"Hay {pendientes} fotos pendientes de "
+                                 "migrar",
+                                 mas_info = "Esas personas se muestran sin "
+                                 "foto hasta que se pasen al almacén de "
+                                 "fotos. Ejecute python -m "
+                                 "personal.model.migraciones --vacuum con la "
+                                 "aplicación cerrada.",
+                                 icono = "peligro")
+        
+    def OnMedirSQL(self, activar):
+        """Activa o desactiva la medida de las sentencias SQL"""
+        
+        instrumentacion = DBManager().instrumentacion
+        if activar:
+            instrumentacion.activar()
+        else:
+            instrumentacion.desactivar()
+        
+        estado = "activada" if activar else "desactivada"
+        self.mostrar_mensaje(f"Medida de consultas SQL {estado}",
+                             caja_texto = False)
+        
+    def OnInformeSQL(self):
+        """Muestra las medidas de las sentencias SQL y las estadísticas de
+        la caché de fotos.
+        """
+        
+        bd = DBManager()
+        instrumentacion = bd.instrumentacion
+        resumen = instrumentacion.resumen()
+        
+        mas_info = f"{resumen['ejecuciones']} ejecuciones de " \
+            f"{resumen['sentencias']} sentencias, " \
+            f"{resumen['total_ms']:.1f} ms en total, {resumen['lentas']} " \
+            f"lentas."
+        if not instrumentacion.activa:
+            mas_info += " La medida está desactivada (menú Datos)."
+        
+        detalle = instrumentacion.informe()
+        if bd.detector_n1.activo:
+            detalle += "\n\n" + bd.detector_n1.informe()
+        detalle += "\n\n" + self.cache_fotos.informe()
+        
+        self.mostrar_mensaje("Informe de consultas SQL", mas_info = mas_info,
+                             detalle = detalle, icono = "informacion")
+        
+    def OnErrorCargaPersonas(self, error):
+        """Informa de un fallo al recuperar el listado de personas"""
+        
+        self.mostrar_mensaje(f"Fallo al recuperar todas las personas", \
+                             caja_texto = False)
+
+        msg = "No se ha podido recuperar ningún registro de personal"
+
+        self.mostrar_mensaje("Fallo al buscar personal",
+                             mas_info=msg,
+                             detalle = error,
+                             icono="critico")    
         
     def mostrar_mensaje(self, texto, mas_info = None, detalle = None, \
                         icono = "pregunta", ok = True, cancel = False, \
@@ -504,6 +769,14 @@ class VentanaPrincipal(QtWidgets.QMainWindow):
             self.ui.lineEdit_tipo_relacion_id.setText("")
             self.ui.comboBox_tipo_rel_per.setCurrentIndex(-1)
         
+    def bloquear_operaciones(self, bloquear):
+        """Bloquea (o desbloquea) los botones de operaciones y el listado de
+        personas mientras se guarda en segundo plano.
+        """
+        
+        self.ui.groupBox_operaciones.setEnabled(not bloquear)
+        self.ui.tableView_per.setEnabled(not bloquear)
+        
     def activar_elementos(self, opcion, estado = True):
         """Se activan elementos, a partir de opcion y estado.
         
@@ -537,92 +810,131 @@ class VentanaPrincipal(QtWidgets.QMainWindow):
         # if opcion in ["relacion"]:
         #    self.ui.pushButton_guardar_per.setEnabled(estado)
             
-    def cargar_datos_personales(self, id_):
-        """Carga datos de la persona con identificador id_ en las cajas"""
+    def cargar_datos_personales(self, ficha):
+        """Carga los datos personales de la ficha en las cajas"""
+        
+        # Se activan todas las cajas de texto.
+        for i in ["personal", "contacto", "otros"]:
+            self.activar_elementos(i)
+        
+        # Se rellenan las cajas de datos personales.
+        self.ui.lineEdit_nrp_per.setText(str(ficha.id_))
+        self.ui.lineEdit_dni_per.setText(ficha.nif)
+        self.ui.lineEdit_nombre_per.setText(str(ficha.nombre))
+        self.ui.lineEdit_1ap_per.setText(str(ficha.ap1))
+        self.ui.lineEdit_2ap_per.setText(ficha.ap2 or "")
+        self.ui.comboBox_sexo_per.setCurrentText(ficha.sexo)
+        
+        anyo = int(ficha.fnac[0:4])
+        mes = int(ficha.fnac[5:7])
+        dia = int(ficha.fnac[8:10])
+        self.ui.dateEdit_fnac_per.setDate(QDate(anyo, mes, dia))
+        
+        observ = "" if ficha.observ is None else str(ficha.observ)
+        self.ui.textEdit_observ_per.setText(observ)
+        
+        # Relaciones.
+        relacionado_con = "" if ficha.relacionado_con is None else \
+            str(ficha.relacionado_con)
+        self.ui.lineEdit_relacionado_con_id.setText(relacionado_con)
+        tipo_relacion_id = "" if ficha.tipo_relacion_id is None else \
+            str(ficha.tipo_relacion_id)
+        self.ui.lineEdit_tipo_relacion_id.setText(tipo_relacion_id)
+        
+        # Foto (miniatura precalculada de 180x180), decodificada solo si no
+        # está ya en la caché.
+        pixmap = self.cache_fotos.cargar(ficha.id_, ficha.version_foto,
+                                         ficha.miniatura)
+        if pixmap is not None:
+            
+            self.ui.label_foto_per.setPixmap(pixmap)
+            
+        else:
+            
+            self.OnBorrarFoto()
+        
+        # Valores de partida para detectar los campos modificados. Los campos
+        # de texto opcionales (NULL en la base de datos) se comparan como
+        # cadena vacía, que es lo que muestran sus cajas.
+        self.__originales = {'nif': ficha.nif, 'nombre': ficha.nombre,
+                             'ap1': ficha.ap1, 'ap2': ficha.ap2 or "",
+                             'fnac': ficha.fnac, 'sexo': ficha.sexo,
+                             'observ': ficha.observ or "",
+                             'tipo_relacion_id': ficha.tipo_relacion_id,
+                             'relacionado_con': ficha.relacionado_con}
+        self.__foto_modificada = False
+    
+    def obtener_ficha(self, persona_id, al_recibir):
+        """Recupera en segundo plano la ficha completa de la persona con
+        identificador persona_id, y llama a al_recibir con ella si sigue
+        siendo la persona actual.
+        """
         
-        bd = DBManager()
+        persona_id = persona_id.strip()
+        if len(persona_id) == 0: return
         
-        ret = bd.obtener_persona_por_id(id_)
+        def entregar(ret):
+            if not ret[0]:
+                self.error_ficha(ret[1])
+            elif ret[1] is not None and \
+                 str(ret[1].id_) == self.ui.lineEdit_nrp_per.text().strip():
+                al_recibir(ret[1])
         
-        if ret[0]:
-            
-            # Se activan todas las cajas de texto.
-            for i in ["personal", "contacto", "otros"]:
-                self.activar_elementos(i)
-            
-            # Se rellenan las cajas de datos personales.
-            self.ui.lineEdit_nrp_per.setText(str(ret[1].id_))
-            self.ui.lineEdit_dni_per.setText(ret[1].nif)
-            self.ui.lineEdit_nombre_per.setText(str(ret[1].nombre))
-            self.ui.lineEdit_1ap_per.setText(str(ret[1].ap1))
-            self.ui.lineEdit_2ap_per.setText(str(ret[1].ap2))
-            self.ui.comboBox_sexo_per.setCurrentText(ret[1].sexo)
-            
-            anyo = int(ret[1].fnac[0:4])
-            mes = int(ret[1].fnac[5:7])
-            dia = int(ret[1].fnac[8:10])
-            self.ui.dateEdit_fnac_per.setDate(QDate(anyo, mes, dia))
-            
-            observ = "" if ret[1].observ is None else str(ret[1].observ)
-            self.ui.textEdit_observ_per.setText(observ)
-            
-            # Relaciones.
-            relacionado_con = "" if ret[1].relacionado_con is None else \
-                str(ret[1].relacionado_con)
-            self.ui.lineEdit_relacionado_con_id.setText(relacionado_con)
-            tipo_relacion_id = "" if ret[1].tipo_relacion_id is None else \
-                str(ret[1].tipo_relacion_id)
-            self.ui.lineEdit_tipo_relacion_id.setText(tipo_relacion_id)
-            
-            # Foto
-            if ret[1].foto is not None:
-                
-                try:
-                    
-                    foto = Image.open(BytesIO(ret[1].foto))
-                    foto_redim = foto.resize((180, 180), Image.LANCZOS)
-                    pixmap = QPixmap.fromImage(foto_redim.toqimage())
-                    pixmap.detach()
-                
-                    self.ui.label_foto_per.setPixmap(pixmap)
-                
-                except: # Exception as e:
-                
-                    self.OnBorrarFoto()
-                
-                    # self.mostrar_mensaje("Error", \
-                    #                      mas_info="Error al cargar la imagen",
-                    #                      detalle=str(e),
-                    #                      icono="critico")
-            else:
-                
-                self.OnBorrarFoto()
+        self.gestor_tareas.ejecutar(None, "obtener_ficha_persona",
+                                    int(persona_id), al_terminar = entregar)
+        
+    def error_ficha(self, error):
+        """Informa de un fallo al recuperar la ficha de una persona"""
+        
+        msg = "No se ha podido recuperar la ficha de la persona"
+        self.mostrar_mensaje("Error", \
+                             mas_info=msg,
+                             detalle=str(error),
+                             icono="critico")
                 
     def cargar_persona(self, id_):
-        """Carga como persona actual la asociada a su identificador id_"""
+        """Carga como persona actual la asociada a su identificador id_. La
+        ficha se recupera en segundo plano; si entretanto se pide otra
+        persona, esta petición se descarta.
+        """
         
         if len(id_.strip()) != 0:
+            
+            # Se recupera toda la ficha de la persona de una vez.
+            self.gestor_tareas.ejecutar("ficha", "obtener_ficha_persona",
+                                        int(id_), 
+                                        al_terminar = self.OnFichaCargada)
+            
+    def OnFichaCargada(self, ret):
+        """Muestra la ficha de la persona recuperada"""
+        
+        if not ret[0]:
+            self.error_ficha(ret[1])
+            return
+        
+        ficha = ret[1]
+        if ficha is not None:
+            
             # Datos personales.
-            self.cargar_datos_personales(int(id_))
+            self.cargar_datos_personales(ficha)
             # Correos electrónicos.
-            self.poblar_mails()
+            self.poblar_mails(ficha.mails)
             # Teléfonos.
-            self.poblar_tlfnos()
+            self.poblar_tlfnos(ficha.telefonos)
             # Direcciones postales.
-            self.poblar_direcciones()
+            self.poblar_direcciones(ficha.direcciones)
             # Tipos de relacioón entre personas.
             self.posicionar_tipo_relacion()
             # Persona relacionada.
-            self.persona_relacionada()
+            self.persona_relacionada(ficha.relacionado)
         
     def OnClickPersona(self):
         """Selecciona la persona y lleva sus datos a edición"""
         
-        fila = self.ui.tableWidget_per.currentRow()
+        fila = self.ui.tableView_per.currentIndex().row()
         if fila >= 0:
 
-            id_ = self.ui.tableWidget_per.item(fila, 0).text()
-            nombre = self.ui.tableWidget_per.item(fila, 1).text() 
+            id_, nombre = self.modelo_personas.persona(fila)
             
             if self.__estado == "relacion":
             
@@ -635,27 +947,18 @@ class VentanaPrincipal(QtWidgets.QMainWindow):
                 self.cargar_persona(id_)
                 self.__estado = "en_edicion"
                 
-    def persona_relacionada(self):
+    def persona_relacionada(self, relacionado):
         """Visualiza la persona relacionada con la persona actual"""
         
-        id_ = self.ui.lineEdit_relacionado_con_id.text()
-        if id_ == "" or id_ == None:
+        if relacionado is None:
             self.ui.lineEdit_rel_per.clear()
             self.ui.lineEdit_rel_per.setToolTip("")
         else:
-            bd = DBManager()
-            ret = bd.obtener_persona_por_id(int(id_))
-            if ret[0]:
-                msg = f"{ret[1].nombre} {ret[1].ap1} {ret[1].ap2}"
-                self.ui.lineEdit_rel_per.setText(msg)
-                self.ui.lineEdit_rel_per.setToolTip(f"DNI {ret[1].nif}")
-                self.ui.lineEdit_rel_per.setCursorPosition(0)
-            else:
-                msg = "No encuentro la persona relacionada"
-                self.mostrar_mensaje("Error", \
-                                     mas_info=msg,
-                                     detalle=str(ret[1]),
-                                     icono="critico")
+            msg = f"{relacionado.nombre} {relacionado.ap1} " \
+                f"{relacionado.ap2 or ''}".rstrip()
+            self.ui.lineEdit_rel_per.setText(msg)
+            self.ui.lineEdit_rel_per.setToolTip(f"DNI {relacionado.nif}")
+            self.ui.lineEdit_rel_per.setCursorPosition(0)
                                 
     def OnConfiguracion(self, opcion = "alta"):
         """Abre ventana de configuración"""
@@ -733,156 +1036,130 @@ class VentanaPrincipal(QtWidgets.QMainWindow):
             self.ui.tableWidget_tlfno_per.setColumnWidth(3, 100) # Prefer.
             self.ui.tableWidget_tlfno_per.setColumnWidth(4, 200) # Observ.
             
-    def poblar_direcciones(self):
-        """Puebla las direcciones postales de la persona actual"""
+    def poblar_direcciones(self, direcciones = None):
+        """Puebla las direcciones postales de la persona actual. Si no se
+        indican las direcciones, se recuperan de la ficha de la persona.
+        """
         
-        persona_id = self.ui.lineEdit_nrp_per.text().strip()
-        if len(persona_id) == 0:
-            pass
+        if direcciones is None:
+            self.obtener_ficha(self.ui.lineEdit_nrp_per.text(),
+                               lambda ficha: self.poblar_direcciones(ficha.direcciones))
+            return
+                
+        self.conf_contacto("direccion_postal")                               
+        self.ui.tableWidget_direccion_per.setRowCount(len(direcciones))
         
-        else:
+        # Poblamos.
+        fila = -1
+        for direc in direcciones:
             
-            persona_id = int(persona_id)
-            bd = DBManager()
-            
-            ret = bd.obtener_direcciones_por_persona_id(persona_id)
+            fila += 1
+                            
+            id_ = str(direc.id_)
+            persona_id = str(direc.persona_id)
+            direccion = str(direc.direccion)
+            cp_id = str(direc.cp_id)
+            localidad = str(direc.localidad)
+            provincia = str(direc.provincia)
+            cp = str(direc.cp)
+            preferencia = "X" if str(direc.preferencia) == "1" else ""
+            observ = str(direc.observ)
             
-            if ret[0]:
-                
-                self.conf_contacto("direccion_postal")                               
-                self.ui.tableWidget_direccion_per.setRowCount(len(ret[1]))
-                
-                # Poblamos.
-                fila = -1
-                for direc in ret[1]:
-                    
-                    fila += 1
-                                    
-                    id_ = str(direc.id_)
-                    persona_id = str(direc.persona_id)
-                    direccion = str(direc.direccion)
-                    cp_id = str(direc.cp_id)
-                    localidad = str(direc.dir_cp.localidad)
-                    provincia = str(direc.dir_cp.provincia)
-                    cp = str(direc.dir_cp.cp)
-                    preferencia = "X" if str(direc.preferencia) == "1" else ""
-                    observ = str(direc.observ)
+            col = 0
+            for i in [id_, persona_id, direccion, cp_id, cp, localidad,
+                      provincia, preferencia, observ]:
                     
-                    col = 0
-                    for i in [id_, persona_id, direccion, cp_id, cp, localidad,
-                              provincia, preferencia, observ]:
-                            
-                        self.ui\
-                            .tableWidget_direccion_per\
-                            .setItem(fila, col, QtWidgets.QTableWidgetItem(i))
+                self.ui\
+                    .tableWidget_direccion_per\
+                    .setItem(fila, col, QtWidgets.QTableWidgetItem(i))
 
-                        if col == 7:
-                            # Centramos la preferencia.
-                            item = self.ui.tableWidget_direccion_per.\
-                                item(fila, col)
-                            if item is not None:
-                                item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-                                
-                        col += 1
-                
-                # Cerramos la sesión
-                ret[2].close()
+                if col == 7:
+                    # Centramos la preferencia.
+                    item = self.ui.tableWidget_direccion_per.item(fila, col)
+                    if item is not None:
+                        item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
+                        
+                col += 1
                 
-    def poblar_mails(self):
-        """Puebla los mails de la persona actual"""
+    def poblar_mails(self, mails = None):
+        """Puebla los mails de la persona actual. Si no se indican los mails,
+        se recuperan de la ficha de la persona.
+        """
         
-        persona_id = self.ui.lineEdit_nrp_per.text().strip()
-        if len(persona_id) == 0:
-            pass
+        if mails is None:
+            self.obtener_ficha(self.ui.lineEdit_nrp_per.text(),
+                               lambda ficha: self.poblar_mails(ficha.mails))
+            return
+                        
+        self.conf_contacto("mail")
+        self.ui.tableWidget_mail_per.setRowCount(len(mails))
         
-        else:
-            
-            persona_id = int(persona_id)
-            bd = DBManager()
+        # Poblamos.
+        fila = -1
+        for mail in mails:
             
-            ret = bd.obtener_mails_por_persona_id(persona_id)
+            fila += 1
+                            
+            id_ = str(mail.id_)
+            persona_id = str(mail.persona_id)
+            correo = str(mail.mail)
+            preferencia = "X" if str(mail.preferencia) == "1" else ""
+            observ = str(mail.observ)
             
-            if ret[0]:
-                # msg = f"Recuperados {len(ret[1])} mails." 
-                # self.mostrar_mensaje(msg, caja_texto = False)
-                                
-                self.conf_contacto("mail")
-                self.ui.tableWidget_mail_per.setRowCount(len(ret[1]))
-                
-                # Poblamos.
-                fila = -1
-                for mail in ret[1]:
+            col = 0
+            for i in [id_, persona_id, correo, preferencia, observ]:
                     
-                    fila += 1
-                                    
-                    id_ = str(mail.id_)
-                    persona_id = str(mail.persona_id)
-                    correo = str(mail.mail)
-                    preferencia = "X" if str(mail.preferencia) == "1" else ""
-                    observ = str(mail.observ)
-                    
-                    col = 0
-                    for i in [id_, persona_id, correo, preferencia, observ]:
-                            
-                        self.ui\
-                            .tableWidget_mail_per\
-                            .setItem(fila, col, QtWidgets.QTableWidgetItem(i))
+                self.ui\
+                    .tableWidget_mail_per\
+                    .setItem(fila, col, QtWidgets.QTableWidgetItem(i))
 
-                        if col == 3:
-                            # Centramos la preferencia.
-                            item = self.ui.tableWidget_mail_per.item(fila, col)
-                            if item is not None:
-                                item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-                                
-                        col += 1
+                if col == 3:
+                    # Centramos la preferencia.
+                    item = self.ui.tableWidget_mail_per.item(fila, col)
+                    if item is not None:
+                        item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
                         
-    def poblar_tlfnos(self):
-        """Puebla los teléfonos de la persona actual"""
+                col += 1
+                        
+    def poblar_tlfnos(self, telefonos = None):
+        """Puebla los teléfonos de la persona actual. Si no se indican los
+        teléfonos, se recuperan de la ficha de la persona.
+        """
         
-        persona_id = self.ui.lineEdit_nrp_per.text().strip()
-        if len(persona_id) == 0:
-            pass
+        if telefonos is None:
+            self.obtener_ficha(self.ui.lineEdit_nrp_per.text(),
+                               lambda ficha: self.poblar_tlfnos(ficha.telefonos))
+            return
+                        
+        self.conf_contacto("tlfno")     
+        self.ui.tableWidget_tlfno_per.setRowCount(len(telefonos))
         
-        else:
+        # Poblamos.
+        fila = -1
+        for tlfno in telefonos:
             
-            persona_id = int(persona_id)
-            bd = DBManager()
-            
-            ret = bd.obtener_telefonos_por_persona_id(persona_id)
+            fila += 1
+                            
+            id_ = str(tlfno.id_)
+            persona_id = str(tlfno.persona_id)
+            tel = str(tlfno.numero)
+            preferencia = "X" if str(tlfno.preferencia) == "1" else ""
+            observ = str(tlfno.observ)
             
-            if ret[0]:
-                # msg = f"Recuperados {len(ret[1])} teléfonos." 
-                # self.mostrar_mensaje(msg, caja_texto = False)
-                                
-                self.conf_contacto("tlfno")     
-                self.ui.tableWidget_tlfno_per.setRowCount(len(ret[1]))
-                
-                # Poblamos.
-                fila = -1
-                for tlfno in ret[1]:
-                    
-                    fila += 1
-                                    
-                    id_ = str(tlfno.id_)
-                    persona_id = str(tlfno.persona_id)
-                    tel = str(tlfno.numero)
-                    preferencia = "X" if str(tlfno.preferencia) == "1" else ""
-                    observ = str(tlfno.observ)
+            col = 0
+            for i in [id_, persona_id, tel, preferencia, observ]:
                     
-                    col = 0
-                    for i in [id_, persona_id, tel, preferencia, observ]:
-                            
-                        self.ui\
-                            .tableWidget_tlfno_per\
-                            .setItem(fila, col, QtWidgets.QTableWidgetItem(i))
+                self.ui\
+                    .tableWidget_tlfno_per\
+                    .setItem(fila, col, QtWidgets.QTableWidgetItem(i))
 
-                        if col == 3:
-                            # Centramos la preferencia.
-                            item = self.ui.tableWidget_tlfno_per.item(fila, col)
-                            if item is not None:
-                                item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-                                
-                        col += 1
+                if col == 3:
+                    # Centramos la preferencia.
+                    item = self.ui.tableWidget_tlfno_per.item(fila, col)
+                    if item is not None:
+                        item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
+                        
+                col += 1
                         
     def __conf_mails(self, opcion):
         """Configuración de correos electrónicos"""
@@ -953,12 +1230,15 @@ class VentanaPrincipal(QtWidgets.QMainWindow):
         """Borra la foto de la persona actual"""
         
         self.ui.label_foto_per.clear()
+        self.__foto = None
+        self.__foto_modificada = True
         
     def OnFoto(self):
         """Carga una foto en la persona actual"""
         
         nfich, _ = QFileDialog.getOpenFileName(self, "Seleccionar Foto", "", \
-                                               "Imágenes (*.png)") 
+                                               "Imágenes (*.png *.jpg *.jpeg "
+                                               "*.bmp *.gif *.webp)") 
         if nfich:
             
             try:
@@ -967,12 +1247,14 @@ class VentanaPrincipal(QtWidgets.QMainWindow):
                 
                 image = Image.open(nfich)
                 # tipo_imagen = image.format
+                image.draft("RGB", (180, 180))
                 image_redim = image.resize((180, 180), Image.LANCZOS)
                 pixmap = QPixmap.fromImage(image_redim.toqimage())
                 pixmap.detach()
                 self.ui.label_foto_per.setPixmap(pixmap)
             
                 self.__foto = nfich
+                self.__foto_modificada = True
 
             except Exception as e:
                 
@@ -983,34 +1265,14 @@ class VentanaPrincipal(QtWidgets.QMainWindow):
                 
             return True
         
-    def OnBuscar(self):
+    def OnBuscar(self, texto_a_buscar):
         """Búsqueda de personas"""
         
-        texto_a_buscar = self.ui.lineEdit_buscar_per.text()
+        # Se filtra por el contenido de la caja de búsqueda con el índice de
+        # búsqueda, cuando se deja de escribir. Si no hay nada en la caja, se
+        # muestran todas las personas.
         
-        for fila in range(self.ui.tableWidget_per.rowCount()):
-            # match_found = False
-            #for column in range(self.table_widget.columnCount()):
-            #    item = self.table_widget.item(row, column)
-            #    if text.lower() in item.text().lower():
-            #        match_found = True
-            #        break
-            
-            if len(texto_a_buscar) == 0:
-                # Se muestran todas las personas, si no hay nada dentro de la
-                # caja de texto de búsqueda.
-                self.ui.tableWidget_per.showRow(fila)
-            else:
-                # Se filtra por el contenido de la caja de búsqueda, ocultando
-                # las filas que no contienen el texto.
-                if texto_a_buscar.lower() in \
-                   self.ui.tableWidget_per.item(fila, 1).text().lower():
-                    
-                    self.ui.tableWidget_per.showRow(fila)
-                
-                else:
-                    
-                    self.ui.tableWidget_per.hideRow(fila)
+        self.filtro_personas.programar(texto_a_buscar)
                 
     def OnImpPersona(self):
         """Imprime la persona actual"""
@@ -1030,13 +1292,26 @@ class VentanaPrincipal(QtWidgets.QMainWindow):
             sexo = self.ui.comboBox_sexo_per.currentText()
             observ = self.ui.textEdit_observ_per.toPlainText()
             
-            foto = self.ui.label_foto_per.pixmap().toImage()
-            byte_array = QByteArray()    
-            buffer = QBuffer(byte_array)
-            buffer.open(QIODeviceBase.OpenModeFlag.WriteOnly)
-            foto.save(buffer, "PNG") 
-            buffer.close()
-            foto = byte_array
+            # Si la foto mostrada es la guardada, el informe la lee por
+            # trozos de la base de datos, con su resolución completa. Si no,
+            # se usa la imagen del QLabel.
+            
+            lector = None
+            nrp = self.ui.lineEdit_nrp_per.text().strip()
+            if nrp and not self.__foto_modificada:
+                ret = DBManager().abrir_foto_persona(int(nrp))
+                if ret[0]: lector = ret[1]
+            
+            if lector is not None:
+                foto = lector
+            else:
+                foto = self.ui.label_foto_per.pixmap().toImage()
+                byte_array = QByteArray()    
+                buffer = QBuffer(byte_array)
+                buffer.open(QIODeviceBase.OpenModeFlag.WriteOnly)
+                foto.save(buffer, "PNG") 
+                buffer.close()
+                foto = byte_array
             
             direccion = obs_dir = mail = obs_mail = tlfno = obs_tlfno = ""
             
@@ -1093,7 +1368,10 @@ class VentanaPrincipal(QtWidgets.QMainWindow):
                       'foto' : foto}
                     
             pdf = CrearInforme(ICO_APLICACION, datos)
-            pdf.imprimir_informe()
+            try:
+                pdf.imprimir_informe()
+            finally:
+                if lector is not None: lector.close()
                 
     def OnBorrarPersona(self):
         """Borra la persona actual"""
@@ -1108,20 +1386,29 @@ class VentanaPrincipal(QtWidgets.QMainWindow):
             msg = "¿Eliminar la persona actual?"
             if self.mostrar_mensaje(texto = msg, cancel=True):
                 
-                bd = DBManager()
-                ret = bd.baja_persona(id_)
-            
-                if ret[0]:
-                    msg = f"Se ha eliminado la persona correctamente." 
-                    self.mostrar_mensaje(msg, caja_texto = False)
-                    self.cancelar_persona(False)
-                    self.poblar_personas()
-                else:
-                    msg = "Error al eliminar a la persona actual"
-                    self.mostrar_mensaje("Error", \
-                                         mas_info=msg,
-                                         detalle=str(ret[1]),
-                                         icono="critico")                
+                self.bloquear_operaciones(True)
+                self.gestor_tareas.ejecutar(None, "baja_persona", id_,
+                                            al_terminar = partial(
+                                                self.OnPersonaBorrada, id_))
+                
+    def OnPersonaBorrada(self, id_, ret):
+        """Actualiza la ventana tras eliminar la persona id_"""
+        
+        self.bloquear_operaciones(False)
+        
+        if ret[0]:
+            msg = f"Se ha eliminado la persona correctamente." 
+            self.mostrar_mensaje(msg, caja_texto = False)
+            self.indice_busqueda.eliminar(int(id_))
+            self.cache_fotos.invalidar(int(id_))
+            self.cancelar_persona(False)
+            self.filtro_personas.eliminar_persona(int(id_))
+        else:
+            msg = "Error al eliminar a la persona actual"
+            self.mostrar_mensaje("Error", \
+                                 mas_info=msg,
+                                 detalle=str(ret[1]),
+                                 icono="critico")                
 
     def cancelar_persona(self, recargar_persona = True):
         """Cancela operación"""
@@ -1166,6 +1453,9 @@ class VentanaPrincipal(QtWidgets.QMainWindow):
         
         self.__estado = "alta"
         
+        # Se descarta la ficha que se estuviera recuperando.
+        self.gestor_tareas.cancelar("ficha")
+        
         # Se limpian cajas de texto.
         for i in ["personal", "contacto", "otros"]: self.limpiar_datos(i)
              
@@ -1199,16 +1489,20 @@ class VentanaPrincipal(QtWidgets.QMainWindow):
             sexo = self.ui.comboBox_sexo_per.currentText()
             observ = self.ui.textEdit_observ_per.toPlainText()
             
-            if self.__estado == "alta":
-                
-                # Buscamos la foto.
+            # Buscamos la foto elegida, que se guarda normalizada (ver
+            # imagenes.normalizar_foto) a partir del fichero original. Si se
+            # ha quitado la foto, queda a None.
+            foto = None
+            if self.__foto is not None:
                 try:
                     with open(self.__foto, 'rb') as f:
                         foto = f.read()
-                except:
+                except OSError:
                     foto = None
-
-            else:
+            
+            tipo_rel_id = relacionado_con_id = None
+            
+            if self.__estado != "alta":
                 
                 # Recuperamos el tipo de relación.
                 i = self.ui.comboBox_tipo_rel_per.currentIndex()
@@ -1221,21 +1515,6 @@ class VentanaPrincipal(QtWidgets.QMainWindow):
                 if relacionado_con_id == "": relacionado_con_id = None
                 if relacionado_con_id is not None:
                     relacionado_con_id = int(relacionado_con_id)
-                
-                # Se recupera la imagen del QLabel, para crear un flujo de 
-                # bytes y poder guardarlos en la base de datos.
-                
-                foto = self.ui.label_foto_per.pixmap().toImage()
-                
-                # if len(foto) == 0: foto = None
-                # else:
-                byte_array = QByteArray()    
-                buffer = QBuffer(byte_array)
-                buffer.open(QIODeviceBase.OpenModeFlag.WriteOnly)
-                foto.save(buffer, "PNG") 
-                buffer.close()
-                    
-                foto = byte_array
                     
             # Comprobamos si la fecha es correcta.
             try:
@@ -1248,14 +1527,21 @@ class VentanaPrincipal(QtWidgets.QMainWindow):
                 self.mostrar_mensaje("El formato de fecha no es correcto", 
                                      icono="peligro")
             else:
-            
-                bd = DBManager()
                 
+                valores = {'nif': dni.strip(), 'nombre': nombre.strip(),
+                           'ap1': ap1.strip(), 'ap2': ap2.strip(),
+                           'fnac': fecha_formateada, 'sexo': sexo,
+                           'observ': observ.strip(),
+                           'tipo_relacion_id': tipo_rel_id,
+                           'relacionado_con': relacionado_con_id}
+            
                 if self.__estado == "alta":
                   
-                    ret = bd.alta_persona(dni.strip(), nombre.strip(),
-                                          ap1.strip(), ap2.strip(),
-                                          fecha_formateada, foto, sexo)
+                    # La persona y sus observaciones se guardan en una sola
+                    # transacción.
+                    operacion = "en_transaccion"
+                    args = (_alta_persona_completa, valores, foto)
+                    cambios = dict(valores, foto=foto)
                     aux = "dado de alta"
                     
                     # Se incluye el id_ como NRP.
@@ -1263,50 +1549,79 @@ class VentanaPrincipal(QtWidgets.QMainWindow):
                 
                 if self.__estado == "en_edicion":
                     
-                    # Modificamos.
-                    ret = bd.modificar_persona(int(nrp), dni.strip(),
-                                              nombre.strip(), ap1.strip(),
-                                              ap2.strip(), fecha_formateada,
-                                              foto, sexo, observ.strip(),
-                                              tipo_rel_id, relacionado_con_id)
+                    # Modificamos solo los campos que han cambiado desde que
+                    # se cargó la persona. La foto solo se envía si se ha
+                    # elegido otra o se ha quitado.
+                    cambios = {c: v for c, v in valores.items()
+                               if v != self.__originales.get(c)}
+                    if self.__foto_modificada: cambios['foto'] = foto
                     
-                    aux = "modificado"
-                    
-                if ret[0]:
-                    
-                    if self.__estado == "alta":
-                        self.ui.lineEdit_nrp_per.setText(str(ret[1]))
-                    
-                    msg = f"Se ha {aux} a {nombre} {ap1} correctamente." 
-                    self.mostrar_mensaje(msg, caja_texto = False)
+                    operacion = "modificar_campos_persona"
+                    args = (int(nrp), cambios)
                     
-                    # self.OnCancelarPersona()
+                    aux = "modificado"
                 
-                    self.__foto = None
-                    self.__estado = "en_edicion"
-                    
-                    # Se recargan todas las personas, de nuevo.
-                    
-                    self.poblar_personas()
-                    
-                    # Se activan todos los botones.
-                    
-                    for i in ["personal", "contacto",
-                              "otros", "buscar", "alta"]:
-                        self.activar_elementos(i)
-                    
-                    
-                else:
-                    self.mostrar_mensaje(f"Fallo al crear/modificar a la persona", \
-                                         caja_texto = False)
-                    
-                    msg = "- El DNI debe tener 8 dígitos y una letra, y no debe" + \
-                        " de existir en la base de datos previamente.\n" + \
-                        "- El nombre, primer apellido y fecha de nacimiento" + \
-                        " son obligatorios."
-        
-                    self.mostrar_mensaje("No se ha podido dar de alta/modificar",
-                                         mas_info=msg,
-                                         detalle = str(ret[1]),
-                                         icono="critico")    
+                self.bloquear_operaciones(True)
+                self.gestor_tareas.ejecutar(None, operacion, *args,
+                                            al_terminar = partial(
+                                                self.OnPersonaGuardada, aux,
+                                                valores, cambios))
+                
+    def OnPersonaGuardada(self, aux, valores, cambios, ret):
+        """Actualiza la ventana tras dar de alta o modificar una persona.
+        valores son los de todos los campos del formulario, y cambios los
+        enviados a la base de datos.
+        """
+        
+        self.bloquear_operaciones(False)
+        
+        if ret[0]:
+            
+            if self.__estado == "alta":
+                self.ui.lineEdit_nrp_per.setText(str(ret[1]))
+            
+            nombre, ap1, ap2 = valores['nombre'], valores['ap1'], \
+                valores['ap2']
+            
+            msg = f"Se ha {aux} a {nombre} {ap1} correctamente." 
+            self.mostrar_mensaje(msg, caja_texto = False)
+            
+            # self.OnCancelarPersona()
+        
+            self.__foto = None
+            self.__estado = "en_edicion"
+            self.__originales = valores
+            self.__foto_modificada = False
+            
+            # Solo se actualiza la fila de la persona en el listado, y solo
+            # si ha cambiado algo de lo que se muestra en él.
+            
+            if {'nombre', 'ap1', 'ap2'} & set(cambios):
+                self.indice_busqueda.actualizar(int(ret[1]), nombre, ap1,
+                                                ap2)
+            if 'foto' in cambios:
+                self.cache_fotos.invalidar(int(ret[1]))
+            if {'nombre', 'ap1', 'ap2', 'foto'} & set(cambios):
+                self.filtro_personas.actualizar_persona(int(ret[1]))
+            
+            # Se activan todos los botones.
+            
+            for i in ["personal", "contacto",
+                      "otros", "buscar", "alta"]:
+                self.activar_elementos(i)
+            
+            
+        else:
+            self.mostrar_mensaje(f"Fallo al crear/modificar a la persona", \
+                                 caja_texto = False)
+            
+            msg = "- El DNI debe tener 8 dígitos y una letra, y no debe" + \
+                " de existir en la base de datos previamente.\n" + \
+                "- El nombre, primer apellido y fecha de nacimiento" + \
+                " son obligatorios."
+        
+            self.mostrar_mensaje("No se ha podido dar de alta/modificar",
+                                 mas_info=msg,
+                                 detalle = str(ret[1]),
+                                 icono="critico")    
     
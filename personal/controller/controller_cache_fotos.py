@@ -0,0 +1,152 @@
+"""
+personal, un sistema de gestión de personas
+
+    Copyright (C) 2023 Ángel Luis García García
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Caché de las fotos (ya decodificadas) de la ficha de la persona.
+#
+# Al pulsar en una persona se muestra su foto de 180x180. Decodificar el PNG
+# en un QPixmap cada vez es lo más costoso de mostrar la ficha, así que los
+# QPixmap se guardan en una caché LRU limitada por el tamaño en memoria de
+# las imágenes decodificadas (no por el número de fotos). La clave es el id de
+# la persona y la versión de su foto, de forma que una foto cambiada nunca se
+# confunde con la anterior; aun así, al modificar o eliminar una persona se
+# invalidan sus entradas para liberar la memoria cuanto antes.
+#
+# Solo se usa desde el hilo de la interfaz (los QPixmap no se pueden usar
+# fuera de él).
+
+from collections import OrderedDict
+
+from PyQt6.QtGui import QPixmap
+
+class CacheFotos:
+    """Caché LRU de QPixmap limitada en bytes"""
+
+    MAX_BYTES = 16 * 1024 * 1024
+
+    def __init__(self, max_bytes = MAX_BYTES):
+        """Inicializa la caché vacía, con un máximo de max_bytes"""
+
+        self.max_bytes = max_bytes
+
+        self.__fotos = OrderedDict()    # (id_, versión) -> (pixmap, bytes).
+        self.__bytes = 0
+
+        self.__aciertos = 0
+        self.__fallos = 0
+        self.__descartes = 0
+        self.__invalidaciones = 0
+
+    @staticmethod
+    def tam_pixmap(pixmap):
+        """Devuelve los bytes que ocupa en memoria el pixmap decodificado"""
+
+        return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+    def obtener(self, id_, version):
+        """Devuelve el QPixmap de la foto de la persona id_ en su versión, o
+        None si no está en la caché.
+        """
+
+        entrada = self.__fotos.get((id_, version))
+        if entrada is None:
+            self.__fallos += 1
+            return None
+
+        self.__aciertos += 1
+        self.__fotos.move_to_end((id_, version))
+
+        return entrada[0]
+
+    def guardar(self, id_, version, pixmap):
+        """Guarda el QPixmap de la foto de la persona id_ en su versión,
+        descartando las fotos usadas hace más tiempo si se supera el máximo.
+        Una foto que por sí sola supera el máximo no se guarda.
+        """
+
+        tam = self.tam_pixmap(pixmap)
+        if tam > self.max_bytes: return
+
+        # Las versiones anteriores de la foto ya no se volverán a pedir.
+        self.invalidar(id_, contar = False)
+
+        self.__fotos[(id_, version)] = (pixmap, tam)
+        self.__bytes += tam
+
+        while self.__bytes > self.max_bytes:
+            _, (_, tam) = self.__fotos.popitem(last=False)
+            self.__bytes -= tam
+            self.__descartes += 1
+
+    def cargar(self, id_, version, datos):
+        """Devuelve el QPixmap de la foto de la persona id_ en su versión,
+        tomándolo de la caché o decodificando datos (PNG) y guardándolo en
+        ella. Devuelve None si no hay datos o no se pueden decodificar.
+        """
+
+        if datos is None: return None
+
+        pixmap = self.obtener(id_, version)
+        if pixmap is None:
+            pixmap = QPixmap()
+            if not pixmap.loadFromData(datos, "PNG"): return None
+            self.guardar(id_, version, pixmap)
+
+        return pixmap
+
+    def invalidar(self, id_, contar = True):
+        """Quita de la caché todas las versiones de la foto de la persona"""
+
+        for clave in [c for c in self.__fotos if c[0] == id_]:
+            self.__bytes -= self.__fotos.pop(clave)[1]
+            if contar: self.__invalidaciones += 1
+
+    def vaciar(self):
+        """Vacía la caché (las estadísticas se conservan)"""
+
+        self.__fotos.clear()
+        self.__bytes = 0
+
+    def estadisticas(self):
+        """Devuelve un diccionario con el uso de la caché: entradas, bytes
+        ocupados y máximos, aciertos, fallos, tasa de aciertos (de 0 a 1),
+        descartes por falta de espacio e invalidaciones.
+        """
+
+        consultas = self.__aciertos + self.__fallos
+
+        return {'entradas': len(self.__fotos),
+                'bytes': self.__bytes,
+                'max_bytes': self.max_bytes,
+                'aciertos': self.__aciertos,
+                'fallos': self.__fallos,
+                'tasa_aciertos': self.__aciertos / consultas if consultas \
+                    else 0.0,
+                'descartes': self.__descartes,
+                'invalidaciones': self.__invalidaciones}
+
+    def informe(self):
+        """Devuelve un texto con las estadísticas de la caché"""
+
+        e = self.estadisticas()
+
+        return (f"Caché de fotos: {e['entradas']} entradas, {e['bytes']} de "
+                f"{e['max_bytes']} bytes, {e['tasa_aciertos']:.1%} de "
+                f"aciertos ({e['aciertos']} aciertos, {e['fallos']} "
+                f"fallos), {e['descartes']} descartes, "
+                f"{e['invalidaciones']} invalidaciones")
@@ -170,39 +170,6 @@ class Dialog_DireccionesPostales(QtWidgets.QDialog):
                         
         return ret
     
-    def __gestionar_cp(self, cp_id, cp, localidad, provincia):
-        """Alta / modificación de código postal"""
-        
-        bd = DBManager()
-        
-        if cp_id is None:
-            # Código postal nuevo.
-            r = bd.alta_codigo_postal(cp, localidad, provincia)
-        else:
-            # Se actualiza por defecto el código postal.
-            r = bd.modificar_codigo_postal(int(cp_id), cp, localidad, provincia)
-                        
-            
-        if r[0]:
-            self.ret['cp_id'] = r[1]
-            
-            ret = True
-            
-        else:
-            
-            msg = f"El CP debe de tener 5 dígitos y no existir en el " + \
-                "en el sistema previamente. La localidad y " + \
-                "provincia no pueden estar vacios."
-    
-            self.mostrar_mensaje(f"Fallo al dar de alta CP {cp}",
-                                 mas_info=msg,
-                                 detalle = str(r[1]),
-                                 icono="critico")                
-            
-            ret = False
-                
-        return ret
-        
     def OnTerminar(self, operacion):
         """Devuelve True si todo ha ido correcto y False en caso contrario
         (modifica, borrar o cancelar la operación)
@@ -253,44 +220,30 @@ class Dialog_DireccionesPostales(QtWidgets.QDialog):
                     if self.ui.comboBox_preferencia.currentText() == "Si" else 0
                 observ = self.ui.textEdit_observ.toPlainText().strip()
                 
-                # Es obligatorio que el CP sea correcto.
-                if self.__gestionar_cp(cp_id, cp, localidad, provincia):
+                # El código postal (que se da de alta o se actualiza), la
+                # dirección y la preferencia se guardan en una sola
+                # transacción: si algo falla, no se guarda nada.
                 
-                    if self.ret['id_'] is None:
-                    
-                        # Alta.
-                    
-                        r = bd.alta_direccion(self.ret['persona_id'], direccion,
-                                              self.ret['cp_id'], preferencia,
-                                              observ)
-                        aux = "crear"
-                        
-                    else:
-                        
-                        # Modificación.
-                        
-                        r = bd.modificar_direccion(self.ret['id_'], direccion,
-                                                   self.ret['cp_id'],
-                                                   preferencia, observ)   
-                        aux = "modificar"
-                
-                else:
-                    seguir = False
+                r = bd.guardar_direccion(self.ret['id_'],
+                                         self.ret['persona_id'], direccion,
+                                         cp_id, cp, localidad, provincia,
+                                         preferencia, observ)
+                aux = "crear" if self.ret['id_'] is None else "modificar"
+                if r[0]: self.ret['cp_id'] = r[1][1]
                     
             if seguir:
             
                 if r[0]:
                     
-                    if operacion == "a":
-                        if preferencia == 1:
-                            bd.modificar_preferencia_direccion(r[1],
-                                                               self.ret['persona_id'])
-                    
                     self.ret['operacion'] = True
                 
                 else:
             
                     msg = f"No se ha podido {aux} la dirección postal"
+                    if operacion == "a":
+                        msg += ". El CP debe de tener 5 dígitos y no " + \
+                            "existir en el sistema previamente. La " + \
+                            "localidad y provincia no pueden estar vacíos."
             
                     self.mostrar_mensaje(f"Error en {aux}",
                                          mas_info=msg,
@@ -69,9 +69,12 @@ class InformeReportLab:
        
         story.append(Spacer(0, 20))
         
-        # Agregar la foto (asumiendo que 'foto' es un flujo de bytes)
+        # Agregar la foto ('foto' es un flujo de bytes, o un fichero binario
+        # abierto, como la foto leída por trozos de la base de datos)
         if datos['foto']:
-            foto = Image(BytesIO(datos['foto']), width=180, height=180)
+            origen = datos['foto'] if hasattr(datos['foto'], "read") else \
+                BytesIO(datos['foto'])
+            foto = Image(origen, width=180, height=180)
             story.append(foto)
         
         story.append(Spacer(0, 20))
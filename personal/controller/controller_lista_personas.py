@@ -0,0 +1,480 @@
+"""
+personal, un sistema de gestión de personas
+
+    Copyright (C) 2023 Ángel Luis García García
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from collections import OrderedDict
+from functools import partial
+
+from PyQt6 import QtCore, QtGui, QtWidgets
+from PyQt6.QtCore import Qt
+
+from personal.model.model import DBManager, clave_orden_persona
+from personal.model.imagenes import TAM_MINIATURA_LISTA
+
+class ModeloPersonas(QtCore.QAbstractTableModel):
+    """Modelo del listado de personas. Las filas se recuperan de la base de
+    datos por páginas, a medida que la vista las necesita (canFetchMore /
+    fetchMore), y las miniaturas solo se cargan cuando se pintan. Las
+    páginas se piden con el cursor de la anterior (paginación por clave), de
+    forma que pedir la página mil cuesta lo mismo que pedir la primera.
+    
+    Si se filtra, el modelo muestra solo la lista de identificadores de
+    persona indicada (resultado del índice de búsqueda), también por páginas.
+    
+    Si se indica un GestorTareas, las páginas y las miniaturas se recuperan en
+    segundo plano: la vista se actualiza cuando llegan, y las miniaturas que
+    se piden mientras se pinta se agrupan en una sola consulta.
+    
+    Las filas cargadas son siempre las primeras del listado completo. Al dar
+    de alta, modificar o dar de baja una persona solo se inserta, mueve o
+    quita su fila (actualizar_persona / eliminar_persona), manteniendo esa
+    propiedad, sin recargar el resto.
+    """
+
+    COL_ID = 0
+    COL_NOMBRE = 1
+    COL_FOTO = 2
+
+    CABECERAS = ("NRP", "Personal", "Foto")
+
+    TAM_PAGINA = 200
+    ORDEN = 'nombre'
+    MAX_MINIATURAS = 500
+    
+    CANAL_PAGINA = "pagina_personas"
+
+    # Se emite con la descripción del error si falla la carga de una página.
+    error_carga = QtCore.pyqtSignal(str)
+
+    def __init__(self, parent = None, gestor = None):
+        """Inicializa el modelo, sin filas"""
+
+        super(ModeloPersonas, self).__init__(parent)
+
+        self.__gestor = gestor
+        self.__filas = []
+        self.__hay_mas = True
+        self.__cursor = None
+        self.__cargando = False
+        self.__descendente = False
+        self.__ids = None
+        self.__generacion = 0
+        
+        # Miniaturas cargadas (id_ -> QPixmap, o None si no hay), y las que
+        # están por pedir y pedidas en segundo plano.
+        self.__miniaturas = OrderedDict()
+        self.__por_pedir = set()
+        self.__pedidas = set()
+        
+        self.__temporizador = QtCore.QTimer(self)
+        self.__temporizador.setSingleShot(True)
+        self.__temporizador.setInterval(0)
+        self.__temporizador.timeout.connect(self.__pedir_miniaturas)
+
+    # ###################
+    # INTERFAZ DEL MODELO
+    # ###################
+
+    def rowCount(self, parent = QtCore.QModelIndex()):
+
+        return 0 if parent.isValid() else len(self.__filas)
+
+    def columnCount(self, parent = QtCore.QModelIndex()):
+
+        return 0 if parent.isValid() else len(self.CABECERAS)
+
+    def data(self, index, role = Qt.ItemDataRole.DisplayRole):
+
+        if not index.isValid(): return None
+
+        fila = self.__filas[index.row()]
+
+        if role == Qt.ItemDataRole.DisplayRole:
+            if index.column() == self.COL_ID: return str(fila.id_)
+            if index.column() == self.COL_NOMBRE:
+                return str(fila.nombre_completo)
+
+        if role == Qt.ItemDataRole.DecorationRole and \
+           index.column() == self.COL_FOTO:
+            return self.miniatura(index.row())
+
+        return None
+
+    def headerData(self, seccion, orientacion, \
+                   role = Qt.ItemDataRole.DisplayRole):
+
+        if orientacion != Qt.Orientation.Horizontal: return None
+
+        if role == Qt.ItemDataRole.DisplayRole:
+            return self.CABECERAS[seccion]
+
+        if role == Qt.ItemDataRole.FontRole:
+            fuente = QtGui.QFont()
+            fuente.setPointSize(12)
+            fuente.setBold(True)
+            return fuente
+
+        if role == Qt.ItemDataRole.ToolTipRole and seccion == self.COL_ID:
+            return "Número de Registro de Personal"
+
+        return None
+
+    def canFetchMore(self, parent = QtCore.QModelIndex()):
+
+        if parent.isValid() or self.__cargando: return False
+
+        if self.__ids is None: return self.__hay_mas
+
+        return len(self.__filas) < len(self.__ids)
+
+    def fetchMore(self, parent = QtCore.QModelIndex()):
+
+        # Sin más páginas el cursor es None, que volvería a la primera.
+        if not self.canFetchMore(parent): return
+
+        inicio = len(self.__filas)
+
+        if self.__ids is None:
+            operacion = 'obtener_pagina_personas'
+            args = (self.ORDEN, self.__descendente, None, self.__cursor,
+                    self.TAM_PAGINA)
+        else:
+            operacion = 'obtener_personas_por_ids'
+            args = (self.__ids[inicio:inicio + self.TAM_PAGINA], )
+
+        if self.__gestor is None:
+            self.__pagina_cargada(inicio,
+                                  getattr(DBManager(), operacion)(*args))
+        else:
+            self.__cargando = True
+            self.__gestor.ejecutar(self.CANAL_PAGINA, operacion, *args,
+                                   al_terminar = partial(self.__pagina_cargada,
+                                                         inicio))
+
+    def __pagina_cargada(self, inicio, ret):
+        """Añade al modelo la página de personas recuperada a partir de la
+        fila inicio.
+        """
+
+        self.__cargando = False
+        if inicio != len(self.__filas): return
+
+        if not ret[0]:
+            self.__hay_mas = False
+            self.error_carga.emit(str(ret[1]))
+            return
+
+        if self.__ids is None:
+            filas, self.__cursor = ret[1]
+            self.__hay_mas = self.__cursor is not None
+        else:
+            filas = ret[1]
+
+        if filas:
+            self.beginInsertRows(QtCore.QModelIndex(), inicio,
+                                 inicio + len(filas) - 1)
+            self.__filas.extend(filas)
+            self.endInsertRows()
+
+    def sort(self, columna, orden = Qt.SortOrder.AscendingOrder):
+        """Ordena por nombre completo, en la base de datos o invirtiendo el
+        resultado del filtro.
+        """
+
+        descendente = orden == Qt.SortOrder.DescendingOrder
+        if descendente != self.__descendente:
+            self.__descendente = descendente
+            if self.__ids is not None: self.__ids.reverse()
+            self.recargar()
+
+    # ###################
+    # OPERACIONES PROPIAS
+    # ###################
+
+    @property
+    def descendente(self):
+        """Indica si el listado está ordenado de forma descendente"""
+
+        return self.__descendente
+
+    def filtrar(self, ids):
+        """Muestra solo las personas de la lista ids, en ese orden, o todas si
+        ids es None.
+        """
+
+        self.__ids = None if ids is None else list(ids)
+        self.recargar()
+
+    def recargar(self):
+        """Vacía el modelo y carga de nuevo la primera página de personas"""
+
+        self.beginResetModel()
+        self.__filas = []
+        self.__hay_mas = True
+        self.__cursor = None
+        self.__cargando = False
+        self.__generacion += 1
+        self.__miniaturas.clear()
+        self.endResetModel()
+
+        self.fetchMore()
+
+    def actualizar_persona(self, id_, ids = None):
+        """Refleja el alta o la modificación de la persona id_: recupera su
+        fila y la coloca en su posición, si está entre las filas cargadas.
+        Si hay filtro, ids es el nuevo resultado del índice de búsqueda.
+        """
+
+        generacion = self.__generacion
+        
+        if self.__gestor is None:
+            self.__colocar(generacion, id_, ids,
+                           DBManager().obtener_personas_por_ids([id_]))
+        else:
+            self.__gestor.ejecutar(None, 'obtener_personas_por_ids', [id_],
+                                   al_terminar = partial(self.__colocar,
+                                                         generacion, id_, ids))
+
+    def eliminar_persona(self, id_, ids = None):
+        """Quita la fila de la persona id_, si está cargada. Si hay filtro,
+        ids es el nuevo resultado del índice de búsqueda.
+        """
+
+        self.__quitar(id_)
+        if self.__ids is not None and ids is not None: self.__ids = list(ids)
+
+    def __quitar(self, id_):
+        """Quita la fila de la persona id_ y su miniatura, si están"""
+
+        self.__miniaturas.pop(id_, None)
+
+        for i, fila in enumerate(self.__filas):
+            if fila.id_ == id_:
+                self.beginRemoveRows(QtCore.QModelIndex(), i, i)
+                del self.__filas[i]
+                self.endRemoveRows()
+                break
+
+    def __precede(self, a, b):
+        """Indica si la fila a va antes que la b en el listado sin filtro,
+        con el mismo orden que la consulta.
+        """
+
+        a = clave_orden_persona(a, self.ORDEN)
+        b = clave_orden_persona(b, self.ORDEN)
+
+        return a > b if self.__descendente else a < b
+
+    def __colocar(self, generacion, id_, ids, ret):
+        """Coloca en su posición la fila recuperada de la persona id_"""
+
+        # Si entretanto se ha recargado el modelo, ya está al día.
+        if generacion != self.__generacion: return
+
+        if not ret[0]:
+            self.error_carga.emit(str(ret[1]))
+            return
+
+        self.__quitar(id_)
+        if not ret[1]: return
+        fila = ret[1][0]
+
+        if self.__ids is None:
+            # Búsqueda binaria de su posición entre las filas cargadas.
+            inicio, fin = 0, len(self.__filas)
+            while inicio < fin:
+                medio = (inicio + fin) // 2
+                if self.__precede(self.__filas[medio], fila): inicio = medio + 1
+                else: fin = medio
+            posicion = inicio
+            cargadas_todas = not self.__hay_mas
+        else:
+            if ids is not None: self.__ids = list(ids)
+            if id_ not in self.__ids: return
+            posicion = self.__ids.index(id_)
+            cargadas_todas = len(self.__filas) == len(self.__ids) - 1
+
+        # Si va detrás de las filas cargadas, se cargará con su página.
+        if posicion < len(self.__filas) or cargadas_todas:
+            self.beginInsertRows(QtCore.QModelIndex(), posicion, posicion)
+            self.__filas.insert(posicion, fila)
+            self.endInsertRows()
+
+    def persona(self, fila):
+        """Devuelve la tupla (id_, nombre completo) de la fila indicada"""
+
+        p = self.__filas[fila]
+
+        return str(p.id_), str(p.nombre_completo)
+
+    def miniatura(self, fila):
+        """Devuelve el QPixmap de la miniatura de la fila, o None si la
+        persona no tiene foto (o aún no se ha recuperado). Las miniaturas se
+        cargan de la base de datos al pedirlas y se guardan en una caché
+        acotada.
+        """
+
+        p = self.__filas[fila]
+        if not p.tiene_foto: return None
+
+        if p.id_ in self.__miniaturas:
+            self.__miniaturas.move_to_end(p.id_)
+            return self.__miniaturas[p.id_]
+
+        if self.__gestor is not None:
+            # Se pide en segundo plano, junto con las demás que se pinten.
+            if p.id_ not in self.__pedidas:
+                self.__por_pedir.add(p.id_)
+                self.__temporizador.start()
+            return None
+
+        bd = DBManager()
+        ret = bd.obtener_miniatura(p.id_, TAM_MINIATURA_LISTA)
+        pixmap = QtGui.QPixmap()
+        if not (ret[0] and ret[1] is not None and \
+                pixmap.loadFromData(ret[1], "PNG")):
+            return None
+
+        self.__guardar_miniatura(p.id_, pixmap)
+
+        return pixmap
+
+    def __guardar_miniatura(self, id_, pixmap):
+        """Guarda la miniatura en la caché, descartando la más antigua si
+        se supera el máximo.
+        """
+
+        self.__miniaturas[id_] = pixmap
+        if len(self.__miniaturas) > self.MAX_MINIATURAS:
+            self.__miniaturas.popitem(last=False)
+
+    def __pedir_miniaturas(self):
+        """Pide en segundo plano las miniaturas pendientes"""
+
+        ids = sorted(self.__por_pedir - self.__pedidas)
+        self.__por_pedir.clear()
+        if not ids: return
+
+        self.__pedidas.update(ids)
+        self.__gestor.ejecutar(None, 'obtener_miniaturas', ids,
+                               TAM_MINIATURA_LISTA,
+                               al_terminar = partial(self.__miniaturas_cargadas,
+                                                     ids))
+
+    def __miniaturas_cargadas(self, ids, ret):
+        """Guarda las miniaturas recuperadas y repinta la columna"""
+
+        self.__pedidas.difference_update(ids)
+
+        for id_ in ids:
+            datos = ret[1].get(id_) if ret[0] else None
+            pixmap = QtGui.QPixmap()
+            if datos is None or not pixmap.loadFromData(datos, "PNG"):
+                pixmap = None
+            self.__guardar_miniatura(id_, pixmap)
+
+        if self.__filas:
+            self.dataChanged.emit(self.index(0, self.COL_FOTO),
+                                  self.index(len(self.__filas) - 1,
+                                             self.COL_FOTO),
+                                  [Qt.ItemDataRole.DecorationRole])
+
+class FiltroPersonas(QtCore.QObject):
+    """Filtro con retardo del listado de personas. Cada pulsación reinicia
+    el temporizador, y solo cuando se deja de escribir se consulta el índice
+    de búsqueda y se filtra el modelo.
+    """
+
+    RETARDO_MS = 250
+
+    def __init__(self, indice, modelo, parent = None):
+        """Inicializa el filtro sobre el índice de búsqueda y el modelo"""
+
+        super(FiltroPersonas, self).__init__(parent)
+
+        self.__indice = indice
+        self.__modelo = modelo
+        self.__texto = ""
+
+        self.__temporizador = QtCore.QTimer(self)
+        self.__temporizador.setSingleShot(True)
+        self.__temporizador.setInterval(self.RETARDO_MS)
+        self.__temporizador.timeout.connect(self.aplicar)
+
+    def programar(self, texto):
+        """Programa el filtrado por texto, tras el retardo"""
+
+        self.__texto = texto
+        self.__temporizador.start()
+
+    def aplicar(self, texto = None):
+        """Filtra el modelo, sin esperar, por texto o, si no se indica, por el
+        último texto programado.
+        """
+
+        self.__temporizador.stop()
+        if texto is not None: self.__texto = texto
+        self.__modelo.filtrar(self.__buscar())
+
+    def actualizar_persona(self, id_):
+        """Refleja en el listado el alta o modificación de la persona id_,
+        ya actualizada en el índice de búsqueda.
+        """
+
+        self.__modelo.actualizar_persona(id_, self.__buscar())
+
+    def eliminar_persona(self, id_):
+        """Refleja en el listado la baja de la persona id_, ya eliminada
+        del índice de búsqueda.
+        """
+
+        self.__modelo.eliminar_persona(id_, self.__buscar())
+
+    def __buscar(self):
+        """Resultado del índice de búsqueda para el texto actual"""
+
+        return self.__indice.buscar(self.__texto, self.__modelo.descendente)
+
+class DelegadoMiniatura(QtWidgets.QStyledItemDelegate):
+    """Pinta la miniatura de la persona centrada en la celda"""
+
+    def paint(self, painter, option, index):
+
+        # Fondo de la celda (selección, filas alternas...).
+        opcion = QtWidgets.QStyleOptionViewItem(option)
+        self.initStyleOption(opcion, index)
+        opcion.icon = QtGui.QIcon()
+        opcion.features &= \
+            ~QtWidgets.QStyleOptionViewItem.ViewItemFeature.HasDecoration
+        estilo = opcion.widget.style() if opcion.widget is not None \
+            else QtWidgets.QApplication.style()
+        estilo.drawControl(QtWidgets.QStyle.ControlElement.CE_ItemViewItem,
+                           opcion, painter, opcion.widget)
+
+        pixmap = index.data(Qt.ItemDataRole.DecorationRole)
+        if pixmap is None: return
+
+        lado = min(option.rect.width(), option.rect.height(),
+                   TAM_MINIATURA_LISTA)
+        destino = QtCore.QRect(0, 0, lado, lado)
+        destino.moveCenter(option.rect.center())
+        painter.drawPixmap(destino, pixmap)
+
+    def sizeHint(self, option, index):
+
+        return QtCore.QSize(TAM_MINIATURA_LISTA, TAM_MINIATURA_LISTA)
@@ -150,31 +150,17 @@ class Dialog_Correos(QtWidgets.QDialog):
                     if self.ui.comboBox_preferencia.currentText() == "Si" else 0
                 observ = self.ui.textEdit_observ.toPlainText().strip()
                 
-                if self.ret['id_'] is None:
+                # El correo y la preferencia se guardan en una sola
+                # transacción.
                 
-                    # Alta.
-                
-                    r = bd.alta_mail(self.ret['persona_id'], mail,
-                                     preferencia, observ)
-                    aux = "crear"
-                    
-                else:
-                    
-                    # Modificación.
-                    
-                    r = bd.modificar_mail(self.ret['id_'], mail, preferencia,
-                                          observ)
-                    aux = "modificar"
+                r = bd.guardar_mail(self.ret['id_'], self.ret['persona_id'],
+                                    mail, preferencia, observ)
+                aux = "crear" if self.ret['id_'] is None else "modificar"
                     
             if seguir:
             
                 if r[0]:
                     
-                    if operacion == "a":
-                        if preferencia == 1:
-                            bd.modificar_preferencia_mail(r[1],
-                                                          self.ret['persona_id'])
-                    
                     self.ret['operacion'] = True
                 
                 else:
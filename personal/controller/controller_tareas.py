@@ -0,0 +1,184 @@
+"""
+personal, un sistema de gestión de personas
+
+    Copyright (C) 2023 Ángel Luis García García
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Acceso a la base de datos en segundo plano.
+#
+# Las operaciones de DBManager se ejecutan en los hilos de un QThreadPool, de
+# forma que un disco lento no congela la ventana. Cada hilo tiene su propio
+# DBManager, y las sesiones se crean y cierran dentro de la operación, así que
+# nunca se comparte una sesión entre hilos. El resultado, la tupla (True, x) o
+# (False, error) de siempre, se entrega en el hilo de la interfaz mediante una
+# señal.
+#
+# Las sentencias SQL de la operación cuentan como parte de la acción (el slot
+# de Qt) que la ha encargado, y también las del resultado (ver
+# deteccion_n1.py).
+#
+# Cada petición pertenece a un canal (p.ej. "ficha"). Una petición nueva en un
+# canal deja obsoletas las anteriores del mismo canal: las que aún no han
+# empezado se retiran del pool y el resultado de las que ya están en marcha se
+# descarta. Las peticiones sin canal (escrituras) nunca se descartan.
+
+import threading
+from itertools import count
+
+from PyQt6 import QtCore
+
+from personal.model.model import DBManager
+from personal.model.deteccion_n1 import accion_actual, continuar_accion
+
+_hilo = threading.local()
+
+def _bd_hilo():
+    """Devuelve el DBManager del hilo actual, creándolo la primera vez"""
+
+    bd = getattr(_hilo, 'bd', None)
+    if bd is None:
+        bd = _hilo.bd = DBManager()
+
+    return bd
+
+class _SenalesTarea(QtCore.QObject):
+    """Señales de una tarea (un QRunnable no puede emitir señales)"""
+
+    # Identificador de la petición y resultado de la operación.
+    terminada = QtCore.pyqtSignal(int, object)
+
+class _Tarea(QtCore.QRunnable):
+    """Ejecuta una operación de DBManager en un hilo del pool"""
+
+    def __init__(self, id_, operacion, args, senales):
+
+        super(_Tarea, self).__init__()
+        self.setAutoDelete(False)
+
+        self.id_ = id_
+        self.__operacion = operacion
+        self.__args = args
+        self.__senales = senales
+        # Acción que encarga la operación.
+        self.accion = accion_actual()
+
+    def run(self):
+
+        try:
+            bd = _bd_hilo()
+            with continuar_accion(self.accion):
+                if callable(self.__operacion):
+                    ret = self.__operacion(bd, *self.__args)
+                else:
+                    ret = getattr(bd, self.__operacion)(*self.__args)
+        except Exception as e:
+            ret = False, e
+
+        self.__senales.terminada.emit(self.id_, ret)
+
+class GestorTareas(QtCore.QObject):
+    """Cola de operaciones de base de datos en segundo plano"""
+
+    MAX_HILOS = 4
+
+    # Se emite con True cuando empieza a haber operaciones en curso, y con
+    # False cuando terminan todas.
+    ocupado = QtCore.pyqtSignal(bool)
+
+    def __init__(self, parent = None):
+        """Inicializa el gestor con un pool de hilos propio"""
+
+        super(GestorTareas, self).__init__(parent)
+
+        self.__pool = QtCore.QThreadPool(self)
+        self.__pool.setMaxThreadCount(self.MAX_HILOS)
+
+        self.__senales = _SenalesTarea(self)
+        self.__senales.terminada.connect(self.__al_terminar)
+
+        self.__ids = count(1)
+        self.__pendientes = {}      # Id de petición -> (tarea, canal, función).
+        self.__ultima = {}          # Canal -> id de su última petición.
+
+    @property
+    def en_curso(self):
+        """Número de peticiones pendientes de entregar su resultado"""
+
+        return len(self.__pendientes)
+
+    def ejecutar(self, canal, operacion, *args, al_terminar = None):
+        """Ejecuta en segundo plano la operación, que es el nombre de un
+        método de DBManager o una función que recibe el DBManager como primer
+        argumento, con los argumentos args. Al terminar se llama a
+        al_terminar con el resultado, salvo que la petición haya quedado
+        obsoleta. canal puede ser None. Devuelve el id de la petición.
+        """
+
+        if canal is not None: self.cancelar(canal)
+
+        id_ = next(self.__ids)
+        tarea = _Tarea(id_, operacion, args, self.__senales)
+
+        self.__pendientes[id_] = (tarea, canal, al_terminar)
+        if canal is not None: self.__ultima[canal] = id_
+        if len(self.__pendientes) == 1: self.ocupado.emit(True)
+
+        self.__pool.start(tarea)
+
+        return id_
+
+    def cancelar(self, canal):
+        """Deja obsoletas las peticiones del canal"""
+
+        id_ = self.__ultima.pop(canal, None)
+        if id_ is None or id_ not in self.__pendientes: return
+
+        tarea = self.__pendientes[id_][0]
+        if self.__pool.tryTake(tarea):
+            # No había empezado: no se ejecutará ni entregará resultado.
+            self.__quitar(id_)
+
+    def esperar(self, milisegundos = -1):
+        """Espera a que terminen las operaciones en curso y entrega sus
+        resultados. Devuelve False si se agota el tiempo.
+        """
+
+        ret = self.__pool.waitForDone(milisegundos)
+        QtCore.QCoreApplication.sendPostedEvents(self)
+        QtCore.QCoreApplication.processEvents()
+
+        return ret
+
+    def __quitar(self, id_):
+        """Quita la petición de las pendientes"""
+
+        del self.__pendientes[id_]
+        if not self.__pendientes: self.ocupado.emit(False)
+
+    def __al_terminar(self, id_, ret):
+        """Entrega el resultado de una petición, si no es obsoleta"""
+
+        if id_ not in self.__pendientes: return
+
+        tarea, canal, al_terminar = self.__pendientes[id_]
+        vigente = canal is None or self.__ultima.get(canal) == id_
+        if vigente and canal is not None: del self.__ultima[canal]
+
+        self.__quitar(id_)
+
+        if vigente and al_terminar is not None:
+            with continuar_accion(tarea.accion):
+                al_terminar(ret)
@@ -149,31 +149,18 @@ class Dialog_Telefonos(QtWidgets.QDialog):
                     if self.ui.comboBox_preferencia.currentText() == "Si" else 0
                 observ = self.ui.textEdit_observ.toPlainText().strip()
                 
-                if self.ret['id_'] is None:
+                # El teléfono y la preferencia se guardan en una sola
+                # transacción.
                 
-                    # Alta.
-                
-                    r = bd.alta_telefono(self.ret['persona_id'], tlfno,
-                                         preferencia, observ)
-                    aux = "crear"
-                    
-                else:
-                    
-                    # Modificación.
-                    
-                    r = bd.modificar_telefono(self.ret['id_'], tlfno,
-                                              preferencia, observ)
-                    aux = "modificar"
+                r = bd.guardar_telefono(self.ret['id_'],
+                                        self.ret['persona_id'], tlfno,
+                                        preferencia, observ)
+                aux = "crear" if self.ret['id_'] is None else "modificar"
                     
             if seguir:
             
                 if r[0]:
                     
-                    if operacion == "a":
-                        if preferencia == 1:
-                            bd.modificar_preferencia_tlfno(r[1],
-                                                           self.ret['persona_id'])
-                    
                     self.ret['operacion'] = True
                 
                 else:
@@ -0,0 +1,216 @@
+"""
+personal, un sistema de gestión de personas
+
+    Copyright (C) 2023 Ángel Luis García García
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# E/S incremental de BLOB.
+#
+# SQLite permite leer y escribir un BLOB por trozos, sin cargarlo entero en
+# memoria (sqlite3_blob_open, que Python expone desde la versión 3.11 como
+# Connection.blobopen). abrir_blob devuelve un BLOB abierto así como un
+# fichero binario de Python con buffer, que se puede pasar a PIL o a
+# reportlab, copiar a un fichero con copiar_blob, etc.
+#
+# Un BLOB abierto no puede cambiar de tamaño, así que para escribir uno nuevo
+# antes hay que reservarlo con zeroblob(n). Con versiones de Python sin
+# blobopen, la lectura se hace por trozos con substr() y la escritura se
+# acumula en memoria y se guarda al cerrar.
+
+import io
+
+# Tamaño de los trozos leídos o escritos de cada vez.
+
+TAM_TROZO = 64 * 1024
+
+class _BlobSubstr:
+    """Emulación de sqlite3.Blob con SQL, para Python anterior a 3.11"""
+
+    def __init__(self, conexion_dbapi, tabla, columna, fila, solo_lectura):
+
+        self.__conexion = conexion_dbapi
+        self.__sql = f"FROM {tabla} WHERE rowid = ?"
+        self.__tabla, self.__columna, self.__fila = tabla, columna, fila
+        self.__posicion = 0
+        self.__escritura = None
+        if not solo_lectura: self.__escritura = bytearray(self.read())
+        self.__posicion = 0
+
+    def __len__(self):
+
+        fila = self.__conexion.execute(
+            f"SELECT length({self.__columna}) {self.__sql}",
+            (self.__fila,)).fetchone()
+        if fila is None: raise ValueError("No existe la fila del BLOB")
+
+        return fila[0] or 0
+
+    def read(self, n = -1):
+
+        if self.__escritura is not None:
+            fin = len(self.__escritura) if n < 0 else self.__posicion + n
+            datos = bytes(self.__escritura[self.__posicion:fin])
+        else:
+            n = len(self) - self.__posicion if n < 0 else n
+            datos = self.__conexion.execute(
+                f"SELECT substr({self.__columna}, ?, ?) {self.__sql}",
+                (self.__posicion + 1, n, self.__fila)).fetchone()[0] or b""
+
+        self.__posicion += len(datos)
+
+        return bytes(datos)
+
+    def write(self, datos):
+
+        if self.__escritura is None:
+            raise ValueError("El BLOB está abierto solo para lectura")
+        fin = self.__posicion + len(datos)
+        if fin > len(self.__escritura):
+            raise ValueError("No se puede escribir tras el final del BLOB")
+
+        self.__escritura[self.__posicion:fin] = datos
+        self.__posicion = fin
+
+    def seek(self, desplazamiento, origen = io.SEEK_SET):
+
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.__posicion,
+                io.SEEK_END: len(self)}[origen]
+        self.__posicion = base + desplazamiento
+
+    def tell(self):
+
+        return self.__posicion
+
+    def close(self):
+
+        if self.__escritura is not None:
+            self.__conexion.execute(
+                f"UPDATE {self.__tabla} SET {self.__columna} = ? "
+                f"WHERE rowid = ?", (bytes(self.__escritura), self.__fila))
+            self.__escritura = None
+
+class ArchivoBlob(io.RawIOBase):
+    """BLOB de SQLite abierto como fichero binario sin buffer"""
+
+    def __init__(self, blob, solo_lectura = True, al_cerrar = None):
+        """Envuelve el BLOB abierto (sqlite3.Blob). al_cerrar, si se indica,
+        se llama tras cerrar el BLOB (p.ej. para devolver la conexión al
+        pool).
+        """
+
+        super(ArchivoBlob, self).__init__()
+
+        self.__blob = blob
+        self.__solo_lectura = solo_lectura
+        self.__al_cerrar = al_cerrar
+
+    def __len__(self):
+
+        return len(self.__blob)
+
+    def readable(self):
+
+        return True
+
+    def writable(self):
+
+        return not self.__solo_lectura
+
+    def seekable(self):
+
+        return True
+
+    def readinto(self, b):
+
+        datos = self.__blob.read(len(b))
+        b[:len(datos)] = datos
+
+        return len(datos)
+
+    def write(self, b):
+
+        self.__blob.write(bytes(b))
+
+        return len(b)
+
+    def seek(self, desplazamiento, origen = io.SEEK_SET):
+
+        self.__blob.seek(desplazamiento, origen)
+
+        return self.__blob.tell()
+
+    def tell(self):
+
+        return self.__blob.tell()
+
+    def close(self):
+
+        if self.closed: return
+
+        try:
+            super(ArchivoBlob, self).close()
+            self.__blob.close()
+        finally:
+            if self.__al_cerrar is not None: self.__al_cerrar()
+
+def abrir_blob(conexion_dbapi, tabla, columna, fila, escritura = False,
+               al_cerrar = None, tam_trozo = TAM_TROZO):
+    """Abre el BLOB de la columna de la tabla en la fila con el rowid
+    indicado, con la conexión DBAPI de sqlite3. Devuelve un
+    io.BufferedReader (o io.BufferedRandom si escritura es True) que lee y
+    escribe de tam_trozo en tam_trozo bytes. al_cerrar se llama al cerrarlo.
+    """
+
+    if hasattr(conexion_dbapi, "blobopen"):
+        blob = conexion_dbapi.blobopen(tabla, columna, fila,
+                                       readonly=not escritura)
+    else:
+        blob = _BlobSubstr(conexion_dbapi, tabla, columna, fila,
+                           not escritura)
+
+    archivo = ArchivoBlob(blob, not escritura, al_cerrar)
+
+    return io.BufferedRandom(archivo, tam_trozo) if escritura else \
+        io.BufferedReader(archivo, tam_trozo)
+
+def abrir_blob_motor(motor, tabla, columna, fila):
+    """Abre para lectura el BLOB con una conexión propia del pool del motor,
+    que se devuelve al pool al cerrar el fichero. Devuelve lo mismo que
+    abrir_blob.
+    """
+
+    conexion = motor.raw_connection()
+
+    try:
+        return abrir_blob(conexion.driver_connection, tabla, columna, fila,
+                          al_cerrar=conexion.close)
+    except Exception:
+        conexion.close()
+        raise
+
+def copiar_blob(origen, destino, tam_trozo = TAM_TROZO):
+    """Copia el fichero binario origen en destino por trozos. Devuelve el
+    número de bytes copiados.
+    """
+
+    copiados = 0
+    while True:
+        trozo = origen.read(tam_trozo)
+        if not trozo: break
+        destino.write(trozo)
+        copiados += len(trozo)
+
+    return copiados
@@ -0,0 +1,158 @@
+"""
+personal, un sistema de gestión de personas
+
+    Copyright (C) 2023 Ángel Luis García García
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Búsqueda de texto completo con FTS5 de SQLite.
+#
+# La tabla virtual persona_fts tiene una fila por persona (rowid = id_ de la
+# persona) con sus datos personales y, concatenados, sus correos, teléfonos y
+# direcciones. Los triggers la mantienen sincronizada con las tablas persona,
+# mail, telefono y direccion, de forma que se puede buscar en toda la ficha
+# sin cargarla en Python.
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from personal.model.indice_busqueda import tokenizar
+
+TABLA_FTS = "persona_fts"
+
+# Peso de cada columna en la ordenación por relevancia (bm25), en el orden de
+# las columnas de la tabla virtual.
+
+PESOS_FTS = (10.0, 5.0, 5.0, 5.0, 1.0, 2.0, 2.0, 1.0)
+
+_CREAR_TABLA = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {TABLA_FTS} USING fts5(
+    nif, nombre, ap1, ap2, observ, mails, telefonos, direcciones,
+    tokenize = 'unicode61 remove_diacritics 2')
+"""
+
+def _insertar(condicion = ""):
+    """Sentencia que inserta en la tabla virtual las filas de las personas
+    que cumplen la condición SQL (sobre la persona p).
+    """
+
+    return f"""
+    INSERT INTO {TABLA_FTS}(rowid, nif, nombre, ap1, ap2, observ, mails,
+                            telefonos, direcciones)
+    SELECT p.id_, p.nif, p.nombre, p.ap1, p.ap2, p.observ,
+           (SELECT group_concat(m.mail, ' ') FROM mail m
+             WHERE m.persona_id = p.id_),
+           (SELECT group_concat(t.numero, ' ') FROM telefono t
+             WHERE t.persona_id = p.id_),
+           (SELECT group_concat(d.direccion, ' ') FROM direccion d
+             WHERE d.persona_id = p.id_)
+      FROM persona p {condicion};
+    """
+
+def _reindexar(id_):
+    """Sentencias que regeneran la fila de la persona cuyo id_ es la
+    expresión SQL id_.
+    """
+
+    return f"DELETE FROM {TABLA_FTS} WHERE rowid = {id_};" + \
+        _insertar(f"WHERE p.id_ = {id_}")
+
+def _triggers():
+    """Devuelve las sentencias de creación de los triggers de sincronización"""
+
+    ret = [f"""
+    CREATE TRIGGER IF NOT EXISTS persona_fts_ai AFTER INSERT ON persona
+    BEGIN {_reindexar("NEW.id_")} END
+    """, f"""
+    CREATE TRIGGER IF NOT EXISTS persona_fts_au
+    AFTER UPDATE OF id_, nif, nombre, ap1, ap2, observ ON persona
+    BEGIN
+        DELETE FROM {TABLA_FTS} WHERE rowid = OLD.id_;
+        {_reindexar("NEW.id_")}
+    END
+    """, f"""
+    CREATE TRIGGER IF NOT EXISTS persona_fts_ad AFTER DELETE ON persona
+    BEGIN DELETE FROM {TABLA_FTS} WHERE rowid = OLD.id_; END
+    """]
+
+    for tabla, columnas in (("mail", "persona_id, mail"),
+                            ("telefono", "persona_id, numero"),
+                            ("direccion", "persona_id, direccion")):
+        ret += [f"""
+        CREATE TRIGGER IF NOT EXISTS {tabla}_fts_ai AFTER INSERT ON {tabla}
+        BEGIN {_reindexar("NEW.persona_id")} END
+        """, f"""
+        CREATE TRIGGER IF NOT EXISTS {tabla}_fts_au
+        AFTER UPDATE OF {columnas} ON {tabla}
+        BEGIN
+            {_reindexar("OLD.persona_id")}
+            {_reindexar("NEW.persona_id")}
+        END
+        """, f"""
+        CREATE TRIGGER IF NOT EXISTS {tabla}_fts_ad AFTER DELETE ON {tabla}
+        BEGIN {_reindexar("OLD.persona_id")} END
+        """]
+
+    return ret
+
+def crear_busqueda_texto(motor):
+    """Crea (si no existen) la tabla virtual y sus triggers en la base de
+    datos del motor, y la puebla la primera vez. Devuelve False si la versión
+    de SQLite no dispone de FTS5.
+    """
+
+    with motor.begin() as conexion:
+
+        existe = conexion.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE name = :nombre"),
+            {'nombre': TABLA_FTS}).first() is not None
+
+        if not existe:
+            try:
+                conexion.execute(text(_CREAR_TABLA))
+            except OperationalError:
+                return False
+
+            conexion.execute(text(_insertar()))
+
+        for trigger in _triggers():
+            conexion.execute(text(trigger))
+
+    return True
+
+def consulta_fts(texto):
+    """Convierte el texto introducido por el usuario en una consulta MATCH de
+    FTS5: cada palabra se busca como prefijo y todas deben aparecer. Devuelve
+    None si el texto no tiene palabras.
+    """
+
+    palabras = tokenizar(texto)
+    if not palabras: return None
+
+    return " ".join(f'"{p}"*' for p in palabras)
+
+def sql_buscar():
+    """Sentencia de búsqueda paginada de identificadores de persona,
+    ordenados por relevancia.
+    """
+
+    pesos = ", ".join(str(p) for p in PESOS_FTS)
+
+    return text(f"""
+    SELECT rowid FROM {TABLA_FTS}
+     WHERE {TABLA_FTS} MATCH :consulta
+     ORDER BY bm25({TABLA_FTS}, {pesos}), rowid
+     LIMIT :limite OFFSET :desplazamiento
+    """)
@@ -0,0 +1,266 @@
+"""
+personal, un sistema de gestión de personas
+
+    Copyright (C) 2023 Ángel Luis García García
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Configuración de la aplicación.
+#
+# Se lee de un fichero INI, cuya ruta se toma de la variable de entorno
+# PERSONAL_CONFIG o, si no está definida, de ~/.config/personal/personal.ini.
+# Si el fichero no existe, o no se puede interpretar, se usan los valores por
+# defecto. Ejemplo:
+#
+#   [bd]
+#   fichero = /ruta/a/personal.db
+#
+#   [sqlite]
+#   perfil = rendimiento
+#   cache_size = -131072
+#
+#   [importacion]
+#   tam_lote = 1000
+#
+#   [fotos]
+#   lado_maximo = 1600
+#   calidad = 90
+#
+#   [sql]
+#   instrumentar = true
+#   umbral_lentas_ms = 50
+#   fichero_lentas = ~/.cache/personal/sql_lentas.log
+#   detectar_n1 = true
+#   raiseload = false
+
+import logging
+import os
+from configparser import ConfigParser, Error as ErrorConfiguracion
+
+from personal.model.imagenes import LADO_MAXIMO_FOTO, CALIDAD_FOTO, \
+     TAM_MINIATURA_FICHA
+from personal.model.instrumentacion import UMBRAL_LENTAS_MS
+
+VARIABLE_CONFIG = "PERSONAL_CONFIG"
+FICHERO_CONFIG = os.path.join(os.path.expanduser("~"), ".config", "personal",
+                              "personal.ini")
+
+registro_configuracion = logging.getLogger("personal.configuracion")
+
+def fichero_bd(config = None):
+    """Devuelve la ruta del fichero de base de datos configurada en la
+    sección [bd], o None si se usa la de la aplicación.
+    """
+
+    config = leer_configuracion() if config is None else config
+    fichero = config.get('bd', 'fichero', fallback="").strip()
+
+    return os.path.expanduser(fichero) if fichero else None
+
+# Perfiles de SQLite: PRAGMAs que se aplican a cada conexión nueva.
+#
+#   - seguro: diario de rollback y fsync completo en cada commit.
+#   - equilibrado: WAL (los lectores no bloquean al escritor) y fsync solo en
+#     los checkpoints.
+#   - rendimiento: como equilibrado, con E/S mapeada en memoria y más caché.
+
+PERFILES_SQLITE = {
+    'seguro': {'journal_mode': 'DELETE',
+               'synchronous': 'FULL',
+               'busy_timeout': 5000},
+    'equilibrado': {'journal_mode': 'WAL',
+                    'synchronous': 'NORMAL',
+                    'cache_size': -16000,
+                    'temp_store': 'MEMORY',
+                    'busy_timeout': 5000},
+    'rendimiento': {'journal_mode': 'WAL',
+                    'synchronous': 'NORMAL',
+                    'mmap_size': 268435456,
+                    'cache_size': -65536,
+                    'temp_store': 'MEMORY',
+                    'busy_timeout': 5000},
+}
+
+PERFIL_POR_DEFECTO = 'equilibrado'
+
+# PRAGMAs que se pueden configurar, y valores válidos de cada uno: las
+# palabras (o sus números equivalentes) que admite SQLite o, si es None, un
+# número entero.
+
+_VALORES_PRAGMA = {
+    'journal_mode': ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'),
+    'synchronous': ('OFF', 'NORMAL', 'FULL', 'EXTRA', '0', '1', '2', '3'),
+    'temp_store': ('DEFAULT', 'FILE', 'MEMORY', '0', '1', '2'),
+    'mmap_size': None,
+    'cache_size': None,
+    'busy_timeout': None,
+    'wal_autocheckpoint': None,
+}
+
+PRAGMAS_PERMITIDOS = tuple(_VALORES_PRAGMA)
+
+def _valor_pragma(pragma, valor):
+    """Devuelve el valor del PRAGMA leído de la configuración, convertido a
+    entero o a mayúsculas. Lanza ValueError si no es válido para el PRAGMA.
+    """
+
+    permitidos = _VALORES_PRAGMA[pragma]
+
+    if permitidos is None:
+        try:
+            return int(valor)
+        except ValueError:
+            raise ValueError(f"Valor no válido para {pragma}: {valor} (debe "
+                             f"ser un número entero)") from None
+
+    if valor.upper() not in permitidos:
+        raise ValueError(f"Valor no válido para {pragma}: {valor} (debe ser "
+                         f"{', '.join(permitidos)})")
+
+    return int(valor) if valor.isdigit() else valor.upper()
+
+def ruta_configuracion():
+    """Devuelve la ruta del fichero de configuración"""
+
+    return os.environ.get(VARIABLE_CONFIG, FICHERO_CONFIG)
+
+def leer_configuracion(ruta = None):
+    """Devuelve el ConfigParser con la configuración leída de ruta (o de la
+    ruta por defecto). Si el fichero no existe, o no es un INI válido (p.ej.
+    le falta la cabecera de sección o repite una opción), la configuración
+    está vacía; en el segundo caso se avisa en el logger
+    "personal.configuracion".
+    """
+
+    ruta = ruta or ruta_configuracion()
+    config = ConfigParser()
+
+    try:
+        config.read(ruta, encoding="utf-8")
+    except (ErrorConfiguracion, UnicodeDecodeError) as e:
+        registro_configuracion.warning("Se ignora el fichero de "
+                                       "configuración %s: %s", ruta, e)
+        config = ConfigParser()
+
+    return config
+
+def perfil_sqlite(config = None, avisos = None):
+    """Devuelve la tupla (nombre del perfil, PRAGMAs) configurada en la
+    sección [sqlite]. Los PRAGMAs indicados en la sección sustituyen a los
+    del perfil; si alguno no es válido se ignora (se mantiene el valor del
+    perfil), se avisa en el logger "personal.configuracion" y, si se indica
+    la lista avisos, se añade a ella el aviso. Lanza ValueError si el perfil
+    no es válido.
+    """
+
+    config = leer_configuracion() if config is None else config
+    seccion = config['sqlite'] if config.has_section('sqlite') else {}
+
+    nombre = seccion.get('perfil', PERFIL_POR_DEFECTO).strip()
+    if nombre not in PERFILES_SQLITE:
+        raise ValueError(f"Perfil de SQLite desconocido: {nombre}")
+
+    pragmas = dict(PERFILES_SQLITE[nombre])
+    for pragma in PRAGMAS_PERMITIDOS:
+        if pragma in seccion:
+            valor = seccion[pragma].strip()
+            try:
+                pragmas[pragma] = _valor_pragma(pragma, valor)
+            except ValueError as e:
+                registro_configuracion.warning("%s; se mantiene el valor del "
+                                               "perfil %s", e, nombre)
+                if avisos is not None: avisos.append(str(e))
+
+    return nombre, pragmas
+
+def aplicar_pragmas(conexion_dbapi, pragmas):
+    """Aplica los PRAGMAs a una conexión DBAPI de sqlite3 recién abierta"""
+
+    cursor = conexion_dbapi.cursor()
+    for pragma, valor in pragmas.items():
+        cursor.execute(f"PRAGMA {pragma} = {valor}")
+    cursor.close()
+
+# Importación masiva de personas.
+
+TAM_LOTE_IMPORTACION = 500
+
+def tam_lote_importacion(config = None):
+    """Devuelve el número de filas por lote (y por transacción) de la
+    importación masiva, configurado en la sección [importacion]. Lanza
+    ValueError si no es un entero positivo.
+    """
+
+    config = leer_configuracion() if config is None else config
+
+    tam = config.getint('importacion', 'tam_lote',
+                        fallback=TAM_LOTE_IMPORTACION)
+    if tam < 1:
+        raise ValueError(f"Tamaño de lote no válido: {tam}")
+
+    return tam
+
+# Normalización de las fotos al guardarlas (ver imagenes.normalizar_foto).
+
+def opciones_fotos(config = None):
+    """Devuelve la tupla (lado máximo en píxeles, calidad JPEG de 1 a 95) de
+    las fotos guardadas, configurada en la sección [fotos]. Lanza ValueError
+    si algún valor no es válido.
+    """
+
+    config = leer_configuracion() if config is None else config
+
+    lado = config.getint('fotos', 'lado_maximo', fallback=LADO_MAXIMO_FOTO)
+    if lado < TAM_MINIATURA_FICHA:
+        raise ValueError(f"Lado máximo de las fotos no válido: {lado} (como "
+                         f"mínimo {TAM_MINIATURA_FICHA})")
+
+    calidad = config.getint('fotos', 'calidad', fallback=CALIDAD_FOTO)
+    if not 1 <= calidad <= 95:
+        raise ValueError(f"Calidad de las fotos no válida: {calidad}")
+
+    return lado, calidad
+
+# Instrumentación de las sentencias SQL (ver instrumentacion.py).
+
+def opciones_instrumentacion(config = None):
+    """Devuelve la tupla (instrumentar desde el inicio, umbral en ms del
+    registro de consultas lentas, fichero del registro o None), configurada
+    en la sección [sql]. Lanza ValueError si algún valor no es válido.
+    """
+
+    config = leer_configuracion() if config is None else config
+
+    activa = config.getboolean('sql', 'instrumentar', fallback=False)
+
+    umbral = config.getfloat('sql', 'umbral_lentas_ms',
+                             fallback=UMBRAL_LENTAS_MS)
+    if umbral < 0:
+        raise ValueError(f"Umbral de consultas lentas no válido: {umbral}")
+
+    fichero = config.get('sql', 'fichero_lentas', fallback="").strip()
+
+    return activa, umbral, os.path.expanduser(fichero) if fichero else None
+
+def opciones_deteccion_n1(config = None):
+    """Devuelve la tupla (detectar consultas N+1, modo raiseload) de la
+    sección [sql] (ver deteccion_n1.py). Lanza ValueError si algún valor no
+    es válido.
+    """
+
+    config = leer_configuracion() if config is None else config
+
+    return config.getboolean('sql', 'detectar_n1', fallback=False), \
+        config.getboolean('sql', 'raiseload', fallback=False)
@@ -0,0 +1,346 @@
+"""
+personal, un sistema de gestión de personas
+
+    Copyright (C) 2023 Ángel Luis García García
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Detección de consultas N+1.
+#
+# Una acción es cada invocación de un slot de Qt del controlador (ver
+# instrumentar_slots). En modo depuración se cuentan las sentencias SQL que
+# ejecuta cada acción, incluidas las de las operaciones que encarga a
+# GestorTareas (que se ejecutan en otros hilos, ver continuar_accion), y se
+# avisa cuando una acción repite la carga perezosa de una misma relación: es
+# el patrón N+1, una consulta por fila (p.ej. el código postal de cada
+# dirección) en lugar de una para todas. Los avisos se escriben en el logger
+# "personal.sql.n1".
+#
+# El modo raiseload hace que cualquier carga perezosa que necesite SQL lance
+# una excepción, como si todas las relaciones tuvieran lazy='raise', de forma
+# que una prueba falla en cuanto un cambio introduce una carga perezosa. Con
+# limitar_sentencias una prueba falla también si un bloque ejecuta más
+# sentencias de las previstas. benchmarks/comprobar_n1.py utiliza ambos con
+# las consultas frecuentes (ficha, listado y exportación).
+
+import contextvars
+import inspect
+import logging
+import os
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from functools import wraps
+
+from sqlalchemy import event
+from sqlalchemy.exc import InvalidRequestError
+
+from personal.model.instrumentacion import sitio_llamada
+
+# Cargas perezosas iguales, en una misma acción, a partir de las cuales se
+# avisa de un posible N+1.
+
+UMBRAL_CARGAS_PEREZOSAS = 3
+
+# Número de acciones recientes que se conservan para el informe.
+
+MAX_ACCIONES = 200
+
+registro_n1 = logging.getLogger("personal.sql.n1")
+
+_accion_actual = contextvars.ContextVar("accion_sql", default=None)
+_acciones = deque(maxlen=MAX_ACCIONES)
+_bloqueo = threading.Lock()
+
+class AccionSQL:
+    """Sentencias SQL ejecutadas por una acción (invocación de un slot)"""
+
+    def __init__(self, nombre):
+
+        self.nombre = nombre
+        self.sentencias = 0
+        # Carga perezosa ("Clase.relacion") -> ejecuciones.
+        self.cargas_perezosas = Counter()
+        # Cargas perezosas de las que ya se ha avisado.
+        self.avisos = set()
+
+    def __repr__(self):
+        return f"AccionSQL(nombre='{self.nombre}', " \
+            f"sentencias={self.sentencias})"
+
+def accion_actual():
+    """Devuelve la AccionSQL en curso en este hilo, o None"""
+
+    return _accion_actual.get()
+
+@contextmanager
+def accion(nombre):
+    """Atribuye a la acción nombre las sentencias ejecutadas dentro del
+    bloque, y devuelve su AccionSQL. Una acción dentro de otra (p.ej. un slot
+    que llama a otro) cuenta como parte de la exterior.
+    """
+
+    actual = _accion_actual.get()
+    if actual is not None:
+        yield actual
+        return
+
+    ejecucion = AccionSQL(nombre)
+    with _bloqueo:
+        _acciones.append(ejecucion)
+
+    marca = _accion_actual.set(ejecucion)
+    try:
+        yield ejecucion
+    finally:
+        _accion_actual.reset(marca)
+
+@contextmanager
+def continuar_accion(ejecucion):
+    """Atribuye a la AccionSQL ejecucion (tomada con accion_actual en otro
+    hilo) las sentencias ejecutadas dentro del bloque.
+    """
+
+    if ejecucion is None:
+        yield
+        return
+
+    marca = _accion_actual.set(ejecucion)
+    try:
+        yield
+    finally:
+        _accion_actual.reset(marca)
+
+def acciones_recientes():
+    """Devuelve la lista de las últimas AccionSQL, de la más antigua a la
+    más reciente.
+    """
+
+    with _bloqueo:
+        return list(_acciones)
+
+def _parametros_posicionales(funcion):
+    """Devuelve el número máximo de argumentos posicionales de la función, o
+    None si admite cualquier número.
+    """
+
+    n = 0
+    for parametro in inspect.signature(funcion).parameters.values():
+        if parametro.kind == parametro.VAR_POSITIONAL: return None
+        if parametro.kind in (parametro.POSITIONAL_ONLY,
+                              parametro.POSITIONAL_OR_KEYWORD):
+            n += 1
+
+    return n
+
+def _envolver_slot(nombre, slot):
+    """Devuelve el slot envuelto en una acción de nombre nombre"""
+
+    # Como hace PyQt con los slots, se descartan los argumentos de la señal
+    # que el slot no admite (p.ej. el checked de clicked).
+    n = _parametros_posicionales(slot)
+
+    @wraps(slot)
+    def envoltorio(*args, **kwargs):
+        with accion(nombre):
+            return slot(*args[:n], **kwargs)
+
+    return envoltorio
+
+def instrumentar_slots(objeto, prefijo = "On"):
+    """Envuelve los slots del objeto (los métodos cuyo nombre empieza por
+    prefijo) para que cada invocación sea una acción. Se debe llamar antes de
+    conectarlos a las señales.
+    """
+
+    clase = type(objeto).__name__
+    for nombre in dir(type(objeto)):
+        if nombre.startswith(prefijo) and callable(getattr(objeto, nombre)):
+            setattr(objeto, nombre,
+                    _envolver_slot(f"{clase}.{nombre}",
+                                   getattr(objeto, nombre)))
+
+class DetectorN1:
+    """Cuenta las sentencias de cada acción y detecta las cargas perezosas
+    repetidas de un motor y su fábrica de sesiones.
+    """
+
+    def __init__(self, motor, fabrica_sesiones,
+                 umbral = UMBRAL_CARGAS_PEREZOSAS):
+        """Prepara el detector, desactivado y sin raiseload. Se avisa de
+        un posible N+1 cuando una acción carga de forma perezosa umbral
+        veces la misma relación.
+        """
+
+        self.motor = motor
+        self.fabrica_sesiones = fabrica_sesiones
+        self.umbral = umbral
+
+        self.__activo = False
+        self.__raiseload = False
+        self.__bloqueo = threading.Lock()
+
+    @property
+    def activo(self):
+        """Indica si el detector está activado"""
+
+        return self.__activo
+
+    @property
+    def raiseload(self):
+        """Indica si las cargas perezosas que necesitan SQL lanzan una
+        excepción.
+        """
+
+        return self.__raiseload
+
+    def activar(self):
+        """Empieza a contar las sentencias y cargas perezosas"""
+
+        with self.__bloqueo:
+            if self.__activo: return
+            event.listen(self.motor, "before_cursor_execute",
+                         self.__sentencia)
+            event.listen(self.fabrica_sesiones, "do_orm_execute",
+                         self.__orm)
+            self.__activo = True
+
+    def desactivar(self):
+        """Deja de contar las sentencias y cargas perezosas"""
+
+        with self.__bloqueo:
+            if not self.__activo: return
+            event.remove(self.motor, "before_cursor_execute",
+                         self.__sentencia)
+            event.remove(self.fabrica_sesiones, "do_orm_execute", self.__orm)
+            self.__activo = False
+
+    def activar_raiseload(self, activar = True):
+        """Activa (o desactiva) el modo raiseload: las cargas perezosas que
+        necesitan SQL lanzan InvalidRequestError, como raiseload() en todas
+        las relaciones. Pensado para las pruebas.
+        """
+
+        with self.__bloqueo:
+            if activar == self.__raiseload: return
+            if activar:
+                event.listen(self.fabrica_sesiones, "do_orm_execute",
+                             self.__prohibir_carga_perezosa)
+            else:
+                event.remove(self.fabrica_sesiones, "do_orm_execute",
+                             self.__prohibir_carga_perezosa)
+            self.__raiseload = activar
+
+    # Eventos del motor y de las sesiones.
+
+    def __sentencia(self, conexion, cursor, sentencia, parametros, contexto,
+                    varias):
+
+        ejecucion = _accion_actual.get()
+        if ejecucion is None: return
+
+        with self.__bloqueo:
+            ejecucion.sentencias += 1
+
+    def __orm(self, estado):
+
+        ejecucion = _accion_actual.get()
+        if ejecucion is None or not estado.is_select or \
+           estado.lazy_loaded_from is None:
+            return
+
+        relacion = str(estado.loader_strategy_path[-1])
+
+        with self.__bloqueo:
+            ejecucion.cargas_perezosas[relacion] += 1
+            n = ejecucion.cargas_perezosas[relacion]
+            avisar = n >= self.umbral and relacion not in ejecucion.avisos
+            if avisar: ejecucion.avisos.add(relacion)
+
+        if avisar:
+            registro_n1.warning("Posible N+1 en %s: %d cargas perezosas de "
+                                "%s, desde %s", ejecucion.nombre, n, relacion,
+                                sitio_llamada((os.path.abspath(__file__),)))
+
+    def __prohibir_carga_perezosa(self, estado):
+
+        if estado.is_select and estado.lazy_loaded_from is not None:
+            relacion = estado.loader_strategy_path[-1]
+            raise InvalidRequestError(f"'{relacion}' no se puede cargar de "
+                                      f"forma perezosa (modo raiseload)")
+
+    def resumen(self):
+        """Devuelve una lista de diccionarios, uno por nombre de acción y de
+        mayor a menor número máximo de sentencias, con el nombre, las
+        invocaciones, las sentencias (máximo y media por invocación) y las
+        cargas perezosas repetidas (posibles N+1), con el máximo de cargas de
+        cada relación en una invocación.
+        """
+
+        por_nombre = {}
+        with self.__bloqueo:
+            for ejecucion in acciones_recientes():
+                r = por_nombre.setdefault(ejecucion.nombre,
+                                          {'nombre': ejecucion.nombre,
+                                           'invocaciones': 0,
+                                           'sentencias': [],
+                                           'n1': Counter()})
+                r['invocaciones'] += 1
+                r['sentencias'].append(ejecucion.sentencias)
+                for relacion in ejecucion.avisos:
+                    r['n1'][relacion] = max(
+                        r['n1'][relacion],
+                        ejecucion.cargas_perezosas[relacion])
+
+        return sorted(({'nombre': r['nombre'],
+                        'invocaciones': r['invocaciones'],
+                        'max_sentencias': max(r['sentencias']),
+                        'media_sentencias': sum(r['sentencias']) /
+                            r['invocaciones'],
+                        'n1': r['n1'].most_common()}
+                       for r in por_nombre.values()),
+                      key=lambda r: r['max_sentencias'], reverse=True)
+
+    def informe(self):
+        """Devuelve un texto con las sentencias de cada acción y los
+        posibles N+1.
+        """
+
+        lineas = ["Sentencias SQL por acción (máximo, media, invocaciones):"]
+        for r in self.resumen():
+            lineas.append(f"  {r['nombre']}: {r['max_sentencias']}, "
+                          f"{r['media_sentencias']:.1f}, "
+                          f"{r['invocaciones']}")
+            lineas += [f"    posible N+1: {n} cargas perezosas de {relacion}"
+                       for relacion, n in r['n1']]
+
+        return "\n".join(lineas)
+
+@contextmanager
+def limitar_sentencias(maximo, nombre = "limitar_sentencias"):
+    """Ejecuta el bloque como una acción, y lanza AssertionError si ejecuta
+    más de maximo sentencias SQL o repite una carga perezosa (posible N+1).
+    El detector del motor debe estar activado. Pensado para las pruebas.
+    """
+
+    with accion(nombre) as ejecucion:
+        yield ejecucion
+
+    if ejecucion.sentencias > maximo:
+        raise AssertionError(f"{nombre}: {ejecucion.sentencias} sentencias "
+                             f"SQL (máximo {maximo})")
+    if ejecucion.avisos:
+        raise AssertionError(f"{nombre}: posible N+1 en "
+                             f"{', '.join(sorted(ejecucion.avisos))}")
@@ -0,0 +1,335 @@
+"""
+personal, un sistema de gestión de personas
+
+    Copyright (C) 2023 Ángel Luis García García
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Exportación de todas las personas, con sus contactos, a CSV, JSON Lines o
+# vCard.
+#
+# Las personas se leen por lotes, paginando por clave en el orden pedido (ver
+# DBManager.recorrer_fichas), y cada una se escribe en cuanto se lee, así que
+# la memoria usada no depende del tamaño de la tabla. Si se indica una carpeta
+# de fotos, la foto de cada persona se guarda en ella como fichero aparte
+# (<id_>.png, <id_>.jpg...) y la exportación hace referencia a ese fichero.
+# Las fotos se copian por trozos del BLOB al fichero, sin cargarlas enteras.
+#
+# Desde la línea de órdenes:
+#
+#   python -m personal.model.exportacion salida.csv [--formato csv]
+#                                        [--fotos carpeta] [--bd fichero.db]
+#                                        [--orden apellidos] [--descendente]
+
+import argparse
+import csv
+import json
+import os
+import sys
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from personal.model.model import DBManager, ORDENES_PERSONA
+from personal.model.blobs import copiar_blob
+
+FORMATOS = ('csv', 'jsonl', 'vcf')
+
+# Número de personas leídas por lote (y cada cuántas se informa del
+# progreso).
+
+TAM_LOTE_EXPORTACION = 500
+
+# Columnas del CSV. Las de datos personales coinciden con las que admite la
+# importación, de forma que un CSV exportado se puede volver a importar.
+
+COLUMNAS_CSV = ('id_', 'nif', 'nombre', 'ap1', 'ap2', 'fnac', 'sexo',
+                'observ', 'tipo_relacion', 'relacionado_con', 'telefonos',
+                'mails', 'direcciones', 'foto')
+
+SEPARADOR_CSV = " | "
+
+def _extension(foto):
+    """Devuelve la extensión de fichero que corresponde a la imagen"""
+
+    if foto.startswith(b"\x89PNG"): return ".png"
+    if foto.startswith(b"\xff\xd8"): return ".jpg"
+    if foto.startswith(b"GIF8"): return ".gif"
+
+    return ".bin"
+
+def _guardar_foto(bd, dir_fotos, ficha):
+    """Guarda la foto de la persona en dir_fotos. Devuelve la ruta del
+    fichero, o None si la persona no tiene foto.
+    """
+
+    if ficha.foto_hash is None: return None
+
+    ret = bd.abrir_foto(ficha.foto_hash)
+    if not ret[0]: raise OSError(f"No se puede leer la foto: {ret[1]}")
+    if ret[1] is None: return None
+
+    with ret[1] as foto:
+        extension = _extension(foto.peek(8))
+        ruta = os.path.join(dir_fotos, f"{ficha.id_}{extension}")
+        with open(ruta, "wb") as f:
+            copiar_blob(foto, f)
+
+    return ruta
+
+def _direccion(d):
+    """Devuelve la dirección postal en una sola línea"""
+
+    return f"{d.direccion}, {d.cp} {d.localidad} ({d.provincia})"
+
+# ###
+# CSV
+# ###
+
+def _escribir_csv(f, registros):
+
+    escritor = csv.writer(f)
+    escritor.writerow(COLUMNAS_CSV)
+
+    for ficha, ruta_foto in registros:
+        escritor.writerow([
+            ficha.id_, ficha.nif, ficha.nombre, ficha.ap1, ficha.ap2 or "",
+            ficha.fnac, ficha.sexo, ficha.observ or "",
+            ficha.tipo_relacion or "", ficha.relacionado_con or "",
+            SEPARADOR_CSV.join(t.numero for t in ficha.telefonos),
+            SEPARADOR_CSV.join(m.mail for m in ficha.mails),
+            SEPARADOR_CSV.join(_direccion(d) for d in ficha.direcciones),
+            ruta_foto or ""])
+
+# ##########
+# JSON LINES
+# ##########
+
+def ficha_a_diccionario(ficha, ruta_foto = None):
+    """Devuelve la ficha (FichaPersona) como diccionario serializable a JSON,
+    con la ruta del fichero de su foto (o None).
+    """
+
+    return {
+        'id_': ficha.id_, 'nif': ficha.nif, 'nombre': ficha.nombre,
+        'ap1': ficha.ap1, 'ap2': ficha.ap2, 'fnac': ficha.fnac,
+        'sexo': ficha.sexo, 'observ': ficha.observ,
+        'tipo_relacion': ficha.tipo_relacion,
+        'relacionado_con': ficha.relacionado_con,
+        'telefonos': [{'numero': t.numero,
+                       'preferencia': bool(t.preferencia),
+                       'observ': t.observ} for t in ficha.telefonos],
+        'mails': [{'mail': m.mail,
+                   'preferencia': bool(m.preferencia),
+                   'observ': m.observ} for m in ficha.mails],
+        'direcciones': [{'direccion': d.direccion, 'cp': d.cp,
+                         'localidad': d.localidad,
+                         'provincia': d.provincia,
+                         'preferencia': bool(d.preferencia),
+                         'observ': d.observ} for d in ficha.direcciones],
+        'foto': ruta_foto}
+
+def _escribir_jsonl(f, registros):
+
+    for ficha, ruta_foto in registros:
+        f.write(json.dumps(ficha_a_diccionario(ficha, ruta_foto),
+                           ensure_ascii=False) + "\n")
+
+# #####
+# VCARD
+# #####
+
+def _escapar_vcard(texto):
+    """Escapa un valor de texto de vCard"""
+
+    return (texto or "").replace("\\", "\\\\").replace(",", "\\,").\
+        replace(";", "\\;").replace("\r\n", "\\n").replace("\n", "\\n")
+
+def _linea_vcard(linea):
+    """Devuelve la línea de vCard plegada en trozos de 75 octetos como
+    máximo, terminada en CRLF.
+    """
+
+    datos = linea.encode("utf-8")
+    trozos = []
+    inicio, maximo = 0, 75
+
+    while len(datos) - inicio > maximo:
+        fin = inicio + maximo
+        # No se parte un carácter UTF-8 (los octetos de continuación empiezan
+        # por 10).
+        while datos[fin] & 0xC0 == 0x80: fin -= 1
+        trozos.append(datos[inicio:fin].decode("utf-8"))
+        inicio, maximo = fin, 74
+
+    trozos.append(datos[inicio:].decode("utf-8"))
+
+    return "\r\n ".join(trozos) + "\r\n"
+
+def _escribir_vcf(f, registros):
+
+    for ficha, ruta_foto in registros:
+
+        e = _escapar_vcard
+        nombre = " ".join(p for p in (ficha.nombre, ficha.ap1, ficha.ap2) if p)
+        apellidos = " ".join(p for p in (ficha.ap1, ficha.ap2) if p)
+        pref = lambda c: ",pref" if c.preferencia else ""
+
+        lineas = ["BEGIN:VCARD", "VERSION:3.0",
+                  f"UID:personal-{ficha.id_}",
+                  f"N:{e(apellidos)};{e(ficha.nombre)};;;",
+                  f"FN:{e(nombre)}",
+                  f"BDAY:{ficha.fnac}"]
+        lineas += [f"TEL;TYPE=voice{pref(t)}:{e(t.numero)}"
+                   for t in ficha.telefonos]
+        lineas += [f"EMAIL;TYPE=internet{pref(m)}:{e(m.mail)}"
+                   for m in ficha.mails]
+        lineas += [f"ADR;TYPE=home{pref(d)}:;;{e(d.direccion)};"
+                   f"{e(d.localidad)};{e(d.provincia)};{e(d.cp)};"
+                   for d in ficha.direcciones]
+        if ficha.observ: lineas.append(f"NOTE:{e(ficha.observ)}")
+        if ruta_foto:
+            uri = "file://" + os.path.abspath(ruta_foto).replace(os.sep, "/")
+            lineas.append(f"PHOTO;VALUE=uri:{uri}")
+        lineas.append("END:VCARD")
+
+        f.write("".join(_linea_vcard(l) for l in lineas))
+
+_ESCRITORES = {'csv': _escribir_csv,
+               'jsonl': _escribir_jsonl,
+               'vcf': _escribir_vcf}
+
+def formato_de_fichero(ruta):
+    """Devuelve el formato de exportación que corresponde a la extensión de
+    ruta, o None si no es ninguno de los admitidos.
+    """
+
+    extension = os.path.splitext(ruta)[1].lower().lstrip(".")
+    if extension == "vcard": extension = "vcf"
+
+    return extension if extension in FORMATOS else None
+
+def exportar(f, formato, bd = None, dir_fotos = None,
+             tam_lote = TAM_LOTE_EXPORTACION, progreso = None, orden = 'id_',
+             descendente = False):
+    """Escribe todas las personas en el fichero de texto abierto f, en el
+    formato indicado (csv, jsonl o vcf) y en el orden indicado (uno de
+    ORDENES_PERSONA; por defecto, por id_). Si se indica dir_fotos, las fotos
+    se guardan en esa carpeta, que se crea si no existe. progreso, si se
+    indica, se llama con el número de personas exportadas cada tam_lote
+    personas. Devuelve (True, número de personas exportadas) o
+    (False, error).
+    """
+
+    bd = DBManager() if bd is None else bd
+    exportadas = 0
+
+    def registros():
+        nonlocal exportadas
+        for ficha, _ in bd.recorrer_fichas(False, tam_lote, orden,
+                                          descendente):
+            ruta_foto = None if dir_fotos is None else \
+                _guardar_foto(bd, dir_fotos, ficha)
+            yield ficha, ruta_foto
+            exportadas += 1
+            if progreso is not None and exportadas % tam_lote == 0:
+                progreso(exportadas)
+
+    try:
+
+        if formato not in _ESCRITORES:
+            raise ValueError(f"Formato de exportación desconocido: {formato}")
+        if dir_fotos is not None: os.makedirs(dir_fotos, exist_ok=True)
+
+        _ESCRITORES[formato](f, registros())
+
+        ret = True, exportadas
+
+    except (SQLAlchemyError, OSError, ValueError) as e:
+
+        ret = False, e
+
+    return ret
+
+def exportar_fichero(ruta, formato = None, bd = None, dir_fotos = None,
+                     tam_lote = TAM_LOTE_EXPORTACION, progreso = None,
+                     orden = 'id_', descendente = False):
+    """Exporta todas las personas al fichero ruta. Si no se indica el
+    formato, se deduce de la extensión del fichero. Devuelve lo mismo que
+    exportar.
+    """
+
+    formato = formato or formato_de_fichero(ruta)
+    if formato is None:
+        return False, ValueError(f"No se puede deducir el formato de {ruta}")
+
+    try:
+        # vCard usa CRLF, que ya escribe _linea_vcard.
+        with open(ruta, "w", newline="", encoding="utf-8") as f:
+            return exportar(f, formato, bd, dir_fotos, tam_lote, progreso,
+                           orden, descendente)
+    except OSError as e:
+        return False, e
+
+def main(argv = None, prog = "python -m personal.model.exportacion"):
+    """Exporta las personas desde la línea de órdenes. Devuelve 0 si la
+    exportación termina bien, y 1 en caso contrario.
+    """
+
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description="Exporta todas las personas con sus contactos.")
+    parser.add_argument("fichero", help="fichero de salida ('-' para la "
+                        "salida estándar)")
+    parser.add_argument("--formato", choices=FORMATOS,
+                        help="formato (por defecto, según la extensión)")
+    parser.add_argument("--fotos", metavar="CARPETA",
+                        help="guarda las fotos como ficheros en CARPETA")
+    parser.add_argument("--bd", help="base de datos (por defecto, la de la "
+                        "aplicación)")
+    parser.add_argument("--orden", choices=ORDENES_PERSONA, default='id_',
+                        help="orden de las personas (por defecto, id_)")
+    parser.add_argument("--descendente", action="store_true",
+                        help="en orden descendente")
+    args = parser.parse_args(argv)
+
+    # Una ruta errónea no debe crear una base de datos vacía y exportarla.
+    if args.bd and not os.path.exists(args.bd):
+        parser.error(f"no existe la base de datos {args.bd}")
+
+    bd = DBManager(f"sqlite:///{args.bd}") if args.bd else DBManager()
+
+    if args.fichero == "-":
+        if args.formato is None: parser.error("falta --formato")
+        sys.stdout.reconfigure(newline="")
+        ret = exportar(sys.stdout, args.formato, bd, args.fotos,
+                       orden=args.orden, descendente=args.descendente)
+    else:
+        ret = exportar_fichero(args.fichero, args.formato, bd, args.fotos,
+                               progreso=lambda n: print(
+                                   f"{n} personas exportadas",
+                                   file=sys.stderr),
+                               orden=args.orden,
+                               descendente=args.descendente)
+
+    if not ret[0]:
+        print(f"Error en la exportación: {ret[1]}", file=sys.stderr)
+        return 1
+
+    print(f"Personas exportadas: {ret[1]}", file=sys.stderr)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""
+personal, un sistema de gestión de personas
+
+    Copyright (C) 2023 Ángel Luis García García
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from collections import namedtuple
+from io import BytesIO
+
+# Tamaños (en píxeles, imágenes cuadradas) de las miniaturas precalculadas:
+# la del listado de personas y la de la ficha de la persona.
+
+TAM_MINIATURA_LISTA = 64
+TAM_MINIATURA_FICHA = 180
+
+# Normalización de las fotos al guardarlas: el lado mayor se limita a
+# LADO_MAXIMO_FOTO píxeles, se eliminan los metadatos (EXIF, perfiles de
+# color, XMP, comentarios...) y se recodifican en JPEG con la calidad
+# CALIDAD_FOTO, o en PNG si tienen transparencia.
+
+LADO_MAXIMO_FOTO = 1024
+CALIDAD_FOTO = 85
+
+FotoNormalizada = namedtuple('FotoNormalizada',
+                             ['datos', 'ancho_original', 'alto_original',
+                              'miniaturas'])
+FotoNormalizada.__doc__ = """Foto lista para guardar: datos codificados,
+    dimensiones de la foto original (ya orientada) y miniaturas en PNG.
+    """
+
+# Claves de Image.info que no son metadatos de la foto, sino parámetros de
+# su codificación.
+
+_INFO_CODIFICACION = {'dpi', 'aspect', 'gamma', 'transparency', 'jfif',
+                      'jfif_version', 'jfif_unit', 'jfif_density',
+                      'progressive', 'progression', 'adobe',
+                      'adobe_transform'}
+
+# Valores de la etiqueta EXIF Orientation que giran la foto 90 o 270 grados.
+
+_ORIENTACION_GIRADA = (5, 6, 7, 8)
+_EXIF_ORIENTACION = 0x0112
+
+def _origen(foto):
+    """Devuelve la foto (bytes o fichero binario abierto) como fichero"""
+
+    return foto if hasattr(foto, "read") else BytesIO(bytes(foto))
+
+def _abrir(foto):
+    """Devuelve la imagen de PIL de la foto (bytes o fichero binario
+    abierto) ya decodificada, o None si no se puede decodificar.
+    """
+
+    # Pillow solo se importa cuando realmente hay que procesar imágenes.
+    from PIL import Image
+
+    try:
+
+        imagen = Image.open(_origen(foto))
+        imagen.load()
+
+    except Exception:
+
+        return None
+
+    return imagen
+
+def _miniaturas(imagen):
+    """Devuelve el diccionario {tamaño: PNG} con las miniaturas de la imagen
+    de PIL.
+    """
+
+    from PIL import Image
+
+    if imagen.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+        imagen = imagen.convert("RGBA")
+
+    miniaturas = {}
+    for tam in (TAM_MINIATURA_LISTA, TAM_MINIATURA_FICHA):
+        salida = BytesIO()
+        imagen.resize((tam, tam), Image.LANCZOS).save(salida, "PNG")
+        miniaturas[tam] = salida.getvalue()
+
+    return miniaturas
+
+def generar_miniaturas(foto):
+    """Genera las miniaturas de la foto (bytes, o un fichero binario abierto,
+    p.ej. un BLOB leído por trozos) pasada como parámetro.
+    Devuelve el diccionario {TAM_MINIATURA_LISTA: bytes, TAM_MINIATURA_FICHA:
+    bytes} con las miniaturas en PNG, o None si no hay foto o no se puede
+    decodificar.
+    """
+
+    if not foto:
+        return None
+
+    imagen = _abrir(foto)
+
+    return None if imagen is None else _miniaturas(imagen)
+
+def _tiene_transparencia(imagen):
+    """Indica si la imagen de PIL tiene canal alfa o color transparente"""
+
+    return imagen.mode in ("RGBA", "LA", "PA") or \
+        "transparency" in imagen.info
+
+def normalizar_foto(foto, lado_maximo = LADO_MAXIMO_FOTO,
+                    calidad = CALIDAD_FOTO):
+    """Prepara la foto (bytes) para guardarla: la orienta según su EXIF, la
+    reduce para que su lado mayor no pase de lado_maximo, elimina sus
+    metadatos y la recodifica (JPEG con la calidad indicada, o PNG si tiene
+    transparencia). Una foto PNG o JPEG que ya cumple todo ello se deja tal
+    cual, para no perder calidad al recodificarla en cada guardado. Devuelve
+    la FotoNormalizada, o None si no hay foto o no se puede decodificar.
+    """
+
+    if not foto:
+        return None
+
+    from PIL import Image, ImageOps
+
+    try:
+        imagen = Image.open(BytesIO(bytes(foto)))
+        formato = imagen.format
+        ancho, alto = imagen.size
+        orientacion = imagen.getexif().get(_EXIF_ORIENTACION, 1)
+        if orientacion in _ORIENTACION_GIRADA: ancho, alto = alto, ancho
+
+        # Un JPEG se puede decodificar directamente a 1/2, 1/4 u 1/8 de su
+        # tamaño, mucho más rápido que decodificarlo entero y reducirlo.
+        imagen.draft("RGB", (lado_maximo, lado_maximo))
+        imagen.load()
+    except Exception:
+        return None
+
+    sin_metadatos = set(imagen.info) <= _INFO_CODIFICACION and \
+        orientacion == 1
+
+    if formato in ("JPEG", "PNG") and sin_metadatos and \
+       max(ancho, alto) <= lado_maximo:
+
+        return FotoNormalizada(bytes(foto), ancho, alto, _miniaturas(imagen))
+
+    imagen = ImageOps.exif_transpose(imagen)
+    imagen.thumbnail((lado_maximo, lado_maximo), Image.LANCZOS)
+
+    salida = BytesIO()
+    if _tiene_transparencia(imagen):
+        imagen = imagen.convert("RGBA")
+        imagen.info = {}
+        imagen.save(salida, "PNG", optimize=True)
+    else:
+        imagen = imagen.convert("L" if imagen.mode in ("1", "L") else "RGB")
+        imagen.info = {}
+        imagen.save(salida, "JPEG", quality=calidad, optimize=True)
+
+    return FotoNormalizada(salida.getvalue(), ancho, alto,
+                           _miniaturas(imagen))
@@ -0,0 +1,365 @@
+"""
+personal, un sistema de gestión de personas
+
+    Copyright (C) 2023 Ángel Luis García García
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Importación masiva de personas desde un fichero CSV.
+#
+# El fichero se lee fila a fila, sin cargarlo entero en memoria. Cada fila se
+# valida en Python con las mismas reglas que las restricciones de la tabla
+# persona, y las válidas se insertan por lotes, con un executemany y una
+# transacción por lote. Las filas rechazadas se escriben, con su número de
+# línea y el motivo, en <fichero>.rechazos.csv.
+#
+# Tras confirmar cada lote se anota en <fichero>.progreso cuántas filas se han
+# procesado, de forma que si la importación se interrumpe se reanuda a partir
+# del último lote confirmado. El fichero de progreso se borra al terminar. Si
+# se prefiere empezar de nuevo, se descartan el progreso y las filas
+# rechazadas anotados (ver descartar_progreso).
+#
+# Desde la línea de órdenes:
+#
+#   python -m personal.model.importacion personas.csv [--bd fichero.db]
+#                                        [--lote N] [--desde-cero]
+
+import argparse
+import csv
+import json
+import os
+import sys
+from collections import namedtuple
+from datetime import datetime
+from itertools import islice
+
+from personal.model.model import DBManager
+from personal.model.configuracion import tam_lote_importacion
+from personal.model.indice_busqueda import normalizar
+
+# Columnas que se importan, y las que son obligatorias.
+
+COLUMNAS = ('nif', 'nombre', 'ap1', 'ap2', 'fnac', 'sexo', 'observ')
+OBLIGATORIAS = ('nif', 'nombre', 'ap1', 'fnac', 'sexo')
+
+# Otros nombres admitidos en la cabecera para las columnas.
+
+ALIAS_COLUMNAS = {'dni': 'nif',
+                  'apellido1': 'ap1',
+                  'primer_apellido': 'ap1',
+                  'apellido2': 'ap2',
+                  'segundo_apellido': 'ap2',
+                  'fecha_nacimiento': 'fnac',
+                  'observaciones': 'observ'}
+
+FORMATOS_FECHA = ("%Y-%m-%d", "%d/%m/%Y")
+SEXOS = ('Hombre', 'Mujer')
+
+EXT_PROGRESO = ".progreso"
+EXT_RECHAZOS = ".rechazos.csv"
+
+ResultadoImportacion = namedtuple('ResultadoImportacion',
+                                  ['inicio', 'leidas', 'insertadas',
+                                   'rechazadas', 'lotes'])
+ResultadoImportacion.__doc__ = """Resultado de una importación: filas
+    saltadas por haberse importado en una ejecución anterior (inicio), filas
+    leídas, insertadas y rechazadas en esta ejecución, y lotes confirmados.
+    """
+
+def _fecha(texto):
+    """Devuelve la fecha en formato AAAA-MM-DD, o None si no es válida"""
+
+    for formato in FORMATOS_FECHA:
+        try:
+            return datetime.strptime(texto, formato).strftime("%Y-%m-%d")
+        except ValueError:
+            pass
+
+    return None
+
+def validar_persona(campos, nifs):
+    """Valida los campos (diccionario columna -> texto) de una persona.
+    nifs es el conjunto de NIF (en mayúsculas) ya existentes, al que se añade
+    el de la persona si es válida. Devuelve (True, columnas de la persona) o
+    (False, motivo del rechazo).
+    """
+
+    valores = {c: (campos.get(c) or "").strip() for c in COLUMNAS}
+
+    for columna in OBLIGATORIAS:
+        if not valores[columna]:
+            return False, f"Falta el campo {columna}"
+
+    # check_nif: length(nif) = 9. El NIF es único (sin distinguir mayúsculas).
+    nif = valores['nif'].upper()
+    if len(nif) != 9:
+        return False, "El NIF debe tener 9 caracteres"
+    if nif in nifs:
+        return False, "El NIF ya existe"
+
+    fnac = _fecha(valores['fnac'])
+    if fnac is None:
+        return False, "La fecha de nacimiento no es válida"
+
+    # check_sexo: sexo in ('Hombre', 'Mujer').
+    sexo = valores['sexo'].capitalize()
+    if sexo not in SEXOS:
+        return False, "El sexo debe ser Hombre o Mujer"
+
+    nifs.add(nif)
+
+    return True, {'nif': nif,
+                  'nombre': valores['nombre'],
+                  'ap1': valores['ap1'],
+                  'ap2': valores['ap2'] or None,
+                  'fnac': fnac,
+                  'sexo': sexo,
+                  'observ': valores['observ'] or None}
+
+def _columnas(cabecera):
+    """Devuelve la lista con el nombre de columna de persona (o None si no se
+    importa) de cada columna de la cabecera del CSV. Lanza ValueError si
+    falta alguna columna obligatoria.
+    """
+
+    ret = []
+    for nombre in cabecera:
+        nombre = normalizar(nombre.strip()).replace(" ", "_")
+        ret.append(nombre if nombre in COLUMNAS else \
+                   ALIAS_COLUMNAS.get(nombre))
+
+    faltan = [c for c in OBLIGATORIAS if c not in ret]
+    if faltan:
+        raise ValueError(f"Faltan columnas obligatorias: {', '.join(faltan)}")
+
+    return ret
+
+def _dialecto(fichero):
+    """Detecta el separador del CSV (coma, punto y coma o tabulador)"""
+
+    muestra = fichero.read(4096)
+    fichero.seek(0)
+
+    try:
+        return csv.Sniffer().sniff(muestra, delimiters=",;\t")
+    except csv.Error:
+        return csv.excel
+
+def leer_progreso(ruta):
+    """Devuelve el número de filas del CSV ya importadas en una ejecución
+    anterior interrumpida (0 si no hay progreso anotado).
+    """
+
+    try:
+        with open(ruta + EXT_PROGRESO, encoding="utf-8") as f:
+            return int(json.load(f)['filas'])
+    except FileNotFoundError:
+        return 0
+
+def descartar_progreso(ruta):
+    """Borra el progreso anotado y las filas rechazadas de una importación
+    anterior del CSV de ruta, para empezarla de nuevo.
+    """
+
+    for extension in (EXT_PROGRESO, EXT_PROGRESO + ".tmp", EXT_RECHAZOS):
+        if os.path.exists(ruta + extension): os.remove(ruta + extension)
+
+def _guardar_progreso(ruta, filas):
+    """Anota, de forma atómica, el número de filas del CSV importadas"""
+
+    temporal = ruta + EXT_PROGRESO + ".tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump({'filas': filas}, f)
+    os.replace(temporal, ruta + EXT_PROGRESO)
+
+def importar_csv(ruta, bd = None, tam_lote = None, reanudar = True,
+                 progreso = None):
+    """Importa las personas del CSV de ruta. Si reanudar es True y hay
+    progreso anotado, se saltan las filas ya importadas; si es False, se
+    descarta el progreso anotado (ver descartar_progreso). tam_lote es el
+    número de filas por transacción (por defecto, el configurado), y
+    progreso, si se indica, se llama con el ResultadoImportacion parcial tras
+    cada lote. Devuelve (True, ResultadoImportacion) o (False, error).
+    """
+
+    bd = DBManager() if bd is None else bd
+
+    try:
+
+        tam_lote = tam_lote_importacion() if tam_lote is None else tam_lote
+        if tam_lote < 1:
+            raise ValueError(f"Tamaño de lote no válido: {tam_lote}")
+
+        if not reanudar: descartar_progreso(ruta)
+        inicio = leer_progreso(ruta)
+
+        ret = bd.obtener_nifs()
+        if not ret[0]: return ret
+        nifs = ret[1]
+
+        with open(ruta, newline="", encoding="utf-8-sig") as f:
+
+            lector = csv.reader(f, _dialecto(f))
+            cabecera = next(lector, [])
+            columnas = _columnas(cabecera)
+
+            rechazos = None
+            contador = {'leidas': 0, 'insertadas': 0, 'rechazadas': 0,
+                        'lotes': 0}
+            lote = []           # Tuplas (línea, fila, persona) válidas.
+            pendientes = []     # Tuplas (línea, fila, motivo) rechazadas.
+
+            def confirmar():
+                """Inserta el lote, escribe sus rechazos y anota el
+                progreso. Devuelve (True, None) o (False, error).
+                """
+
+                nonlocal rechazos
+
+                if lote:
+                    ret = bd.alta_personas_lote([p for _, _, p in lote])
+                    if not ret[0]: return ret
+                    for i, error in ret[1]:
+                        pendientes.append((lote[i][0], lote[i][1], error))
+                    contador['insertadas'] += len(lote) - len(ret[1])
+
+                if pendientes:
+                    if rechazos is None:
+                        rechazos = _abrir_rechazos(ruta, cabecera, inicio > 0)
+                    for linea, fila, motivo in sorted(pendientes):
+                        rechazos[1].writerow([linea, motivo] + fila)
+                    rechazos[0].flush()
+                    contador['rechazadas'] += len(pendientes)
+
+                _guardar_progreso(ruta, inicio + contador['leidas'])
+                contador['lotes'] += 1
+                lote.clear()
+                pendientes.clear()
+
+                if progreso is not None:
+                    progreso(ResultadoImportacion(inicio, **contador))
+
+                return True, None
+
+            try:
+
+                en_lote = 0
+                for fila in islice(lector, inicio, None):
+
+                    contador['leidas'] += 1
+                    en_lote += 1
+
+                    if any(c.strip() for c in fila):
+                        valida, valor = validar_persona(
+                            dict(zip(columnas, fila)), nifs)
+                        destino = lote if valida else pendientes
+                        destino.append((lector.line_num, fila, valor))
+
+                    if en_lote == tam_lote:
+                        ret = confirmar()
+                        if not ret[0]: return ret
+                        en_lote = 0
+
+                if en_lote:
+                    ret = confirmar()
+                    if not ret[0]: return ret
+
+            finally:
+                if rechazos is not None: rechazos[0].close()
+
+        # Terminada la importación, ya no hay nada que reanudar.
+        if os.path.exists(ruta + EXT_PROGRESO):
+            os.remove(ruta + EXT_PROGRESO)
+
+        ret = True, ResultadoImportacion(inicio, **contador)
+
+    except (OSError, ValueError, csv.Error) as e:
+
+        ret = False, e
+
+    return ret
+
+def _abrir_rechazos(ruta, cabecera, anyadir):
+    """Abre el CSV de filas rechazadas (añadiendo al existente si se reanuda
+    una importación). Devuelve la tupla (fichero, escritor).
+    """
+
+    nombre = ruta + EXT_RECHAZOS
+    anyadir = anyadir and os.path.exists(nombre)
+
+    f = open(nombre, "a" if anyadir else "w", newline="", encoding="utf-8")
+    escritor = csv.writer(f)
+    if not anyadir: escritor.writerow(["linea", "motivo"] + cabecera)
+
+    return f, escritor
+
+def _entero_positivo(texto):
+    """Tipo de argparse para un número entero mayor que cero"""
+
+    try:
+        n = int(texto)
+    except ValueError:
+        n = 0
+
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"debe ser un número entero "
+                                         f"positivo: {texto}")
+
+    return n
+
+def main(argv = None, prog = "python -m personal.model.importacion"):
+    """Importa un CSV de personas desde la línea de órdenes. Devuelve 0 si
+    la importación termina (aunque haya filas rechazadas) y 1 si falla.
+    """
+
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description="Importa personas desde un fichero CSV.")
+    parser.add_argument("fichero", help="fichero CSV con cabecera")
+    parser.add_argument("--bd", help="base de datos (por defecto, la de la "
+                        "aplicación)")
+    parser.add_argument("--lote", type=_entero_positivo,
+                        help="filas por transacción")
+    parser.add_argument("--desde-cero", action="store_true",
+                        help="empieza de nuevo una importación "
+                        "interrumpida, descartando su progreso y sus filas "
+                        "rechazadas")
+    args = parser.parse_args(argv)
+
+    bd = DBManager(f"sqlite:///{args.bd}") if args.bd else DBManager()
+
+    def mostrar(r):
+        print(f"Lote {r.lotes}: {r.inicio + r.leidas} filas procesadas",
+              file=sys.stderr)
+
+    ret = importar_csv(args.fichero, bd, args.lote, not args.desde_cero,
+                       mostrar)
+
+    if not ret[0]:
+        print(f"Error en la importación: {ret[1]}", file=sys.stderr)
+        return 1
+
+    r = ret[1]
+    if r.inicio:
+        print(f"Reanudada tras {r.inicio} filas ya importadas.")
+    print(f"Leídas: {r.leidas}. Insertadas: {r.insertadas}. "
+          f"Rechazadas: {r.rechazadas}.")
+    if r.rechazadas:
+        print(f"Filas rechazadas en {args.fichero}{EXT_RECHAZOS}")
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
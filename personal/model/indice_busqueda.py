@@ -0,0 +1,152 @@
+"""
+personal, un sistema de gestión de personas
+
+    Copyright (C) 2023 Ángel Luis García García
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import re
+import unicodedata
+from bisect import bisect_left, insort
+
+_SEPARADORES = re.compile(r"[^0-9a-z]+")
+
+def normalizar(texto):
+    """Devuelve el texto en minúsculas, sin acentos ni tildes (ñ -> n)"""
+
+    if not texto: return ""
+
+    texto = unicodedata.normalize("NFKD", texto.lower())
+
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+def tokenizar(texto):
+    """Devuelve la lista de palabras normalizadas del texto"""
+
+    return [t for t in _SEPARADORES.split(normalizar(texto)) if t]
+
+def _palabras_y_clave(nombre, ap1, ap2):
+    """Devuelve las palabras a indexar de una persona y su clave de
+    ordenación (el nombre completo normalizado).
+    """
+
+    palabras = tokenizar(f"{nombre} {ap1} {ap2 or ''}")
+
+    return set(palabras), " ".join(palabras)
+
+class IndiceBusqueda:
+    """Índice en memoria de los nombres y apellidos de las personas.
+
+    Cada persona se indexa por las palabras normalizadas (minúsculas, sin
+    acentos) de su nombre y apellidos. Las palabras distintas se mantienen
+    ordenadas, de forma que la búsqueda por prefijo es una búsqueda binaria,
+    y el índice se actualiza persona a persona al dar de alta, modificar o
+    dar de baja, sin reconstruirlo.
+    """
+
+    def __init__(self):
+        """Inicializa un índice vacío"""
+
+        self.__palabras = []        # Palabras distintas, ordenadas.
+        self.__ids_palabra = {}     # Palabra -> conjunto de ids de persona.
+        self.__palabras_id = {}     # Id de persona -> palabras.
+        self.__claves = {}          # Id de persona -> clave de ordenación.
+
+    def __len__(self):
+
+        return len(self.__palabras_id)
+
+    def cargar(self, personas):
+        """Construye el índice a partir de un iterable de tuplas
+        (id_, nombre, ap1, ap2), descartando el contenido anterior.
+        """
+
+        self.__init__()
+
+        for id_, nombre, ap1, ap2 in personas:
+            palabras, clave = _palabras_y_clave(nombre, ap1, ap2)
+            self.__palabras_id[id_] = palabras
+            self.__claves[id_] = clave
+            for palabra in palabras:
+                self.__ids_palabra.setdefault(palabra, set()).add(id_)
+
+        self.__palabras = sorted(self.__ids_palabra)
+
+    def actualizar(self, id_, nombre, ap1, ap2):
+        """Indexa (o reindexa, si ya existía) la persona id_"""
+
+        self.eliminar(id_)
+
+        palabras, clave = _palabras_y_clave(nombre, ap1, ap2)
+        self.__palabras_id[id_] = palabras
+        self.__claves[id_] = clave
+
+        for palabra in palabras:
+            ids = self.__ids_palabra.get(palabra)
+            if ids is None:
+                self.__ids_palabra[palabra] = {id_}
+                insort(self.__palabras, palabra)
+            else:
+                ids.add(id_)
+
+    def eliminar(self, id_):
+        """Quita la persona id_ del índice, si estaba"""
+
+        palabras = self.__palabras_id.pop(id_, None)
+        self.__claves.pop(id_, None)
+        if palabras is None: return
+
+        for palabra in palabras:
+            ids = self.__ids_palabra[palabra]
+            ids.discard(id_)
+            if not ids:
+                del self.__ids_palabra[palabra]
+                i = bisect_left(self.__palabras, palabra)
+                del self.__palabras[i]
+
+    def __por_prefijo(self, prefijo):
+        """Devuelve el conjunto de ids con alguna palabra que empieza por
+        prefijo.
+        """
+
+        ret = set()
+        i = bisect_left(self.__palabras, prefijo)
+        while i < len(self.__palabras) and \
+              self.__palabras[i].startswith(prefijo):
+            ret |= self.__ids_palabra[self.__palabras[i]]
+            i += 1
+
+        return ret
+
+    def buscar(self, texto, descendente = False):
+        """Devuelve la lista de ids de las personas en las que cada palabra de
+        texto es prefijo de alguna palabra de su nombre o apellidos, ordenada
+        por nombre completo. Si texto no tiene palabras devuelve None (sin
+        filtro).
+        """
+
+        prefijos = tokenizar(texto)
+        if not prefijos: return None
+
+        # Se empieza por el prefijo más largo, que suele ser el más selectivo.
+        prefijos.sort(key=len, reverse=True)
+
+        ids = self.__por_prefijo(prefijos[0])
+        for prefijo in prefijos[1:]:
+            if not ids: break
+            ids &= self.__por_prefijo(prefijo)
+
+        return sorted(ids, key=lambda i: (self.__claves[i], i),
+                      reverse=descendente)
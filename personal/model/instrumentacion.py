@@ -0,0 +1,341 @@
+"""
+personal, un sistema de gestión de personas
+
+    Copyright (C) 2023 Ángel Luis García García
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Instrumentación de las sentencias SQL.
+#
+# Sustituye a echo=True, que escribía cada sentencia en la salida estándar
+# sin medir nada y ralentizando las operaciones más frecuentes. Se engancha a
+# los eventos before_cursor_execute y after_cursor_execute del motor y, por
+# cada sentencia distinta, acumula el número de ejecuciones, su latencia
+# (total, máxima e histograma), las filas afectadas y los sitios del código
+# desde los que se ejecuta. Las sentencias que superan el umbral se escriben
+# en el registro de consultas lentas (el logger "personal.sql.lentas").
+#
+# Se puede activar y desactivar en cualquier momento. Desactivada, los
+# eventos se quitan del motor, así que no tiene ningún coste.
+
+import bisect
+import contextlib
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+import sqlalchemy
+from sqlalchemy import event
+
+# Umbral por defecto (ms) del registro de consultas lentas.
+
+UMBRAL_LENTAS_MS = 100.0
+
+# Límites superiores (ms) de los intervalos del histograma de latencias. El
+# último intervalo recoge las sentencias que superan el último límite.
+
+LIMITES_HISTOGRAMA_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000)
+
+registro_lentas = logging.getLogger("personal.sql.lentas")
+
+_BLANCOS = re.compile(r"\s+")
+_LISTA_IN = re.compile(r"\bIN \(\?(\s*,\s*\?)*\)", re.I)
+
+# El sitio de llamada es el primer marco de la pila que no es de SQLAlchemy
+# (ni código generado por ella, con nombres de fichero como "<...>"), de este
+# módulo ni de contextlib (p.ej. el commit al salir de
+# DBManager.transaccion).
+
+_EXCLUIDOS = (os.path.dirname(os.path.abspath(sqlalchemy.__file__)) + os.sep,
+              os.path.abspath(__file__),
+              os.path.abspath(contextlib.__file__))
+
+def normalizar_sentencia(sentencia):
+    """Devuelve la sentencia SQL en una línea y con las listas de parámetros
+    de IN abreviadas, de forma que las ejecuciones de una misma consulta se
+    agrupen aunque varíe el número de parámetros.
+    """
+
+    sentencia = _BLANCOS.sub(" ", sentencia).strip()
+
+    return _LISTA_IN.sub("IN (?, ...)", sentencia)
+
+def sitio_llamada(excluidos = ()):
+    """Devuelve el sitio del código ("fichero:línea (función)") que ha
+    ejecutado la sentencia, o "?" si no se encuentra. excluidos son las
+    rutas absolutas de otros ficheros que no cuentan como sitio de llamada.
+    """
+
+    excluidos = _EXCLUIDOS + tuple(excluidos)
+    marco = sys._getframe(1)
+    while marco is not None:
+        fichero = marco.f_code.co_filename
+        if not fichero.startswith("<") and \
+           not os.path.abspath(fichero).startswith(excluidos):
+            return f"{os.path.basename(fichero)}:{marco.f_lineno} " \
+                f"({marco.f_code.co_name})"
+        marco = marco.f_back
+
+    return "?"
+
+class _EstadisticaSentencia:
+    """Medidas acumuladas de una sentencia"""
+
+    def __init__(self):
+
+        self.ejecuciones = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.histograma = [0] * (len(LIMITES_HISTOGRAMA_MS) + 1)
+        self.filas = 0
+        self.sitios = Counter()
+
+    def anotar(self, ms, filas, sitio):
+
+        self.ejecuciones += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.histograma[bisect.bisect_left(LIMITES_HISTOGRAMA_MS, ms)] += 1
+        if filas > 0: self.filas += filas
+        self.sitios[sitio] += 1
+
+class InstrumentacionSQL:
+    """Mide las sentencias SQL ejecutadas por un motor"""
+
+    def __init__(self, motor, umbral_lentas_ms = UMBRAL_LENTAS_MS):
+        """Prepara la instrumentación del motor, desactivada. Las sentencias
+        que tarden umbral_lentas_ms o más se escriben en el registro de
+        consultas lentas.
+        """
+
+        self.motor = motor
+        self.umbral_lentas_ms = umbral_lentas_ms
+
+        self.__activa = False
+        self.__bloqueo = threading.Lock()
+        # Medidas por texto exacto de la sentencia, que se agrupan con
+        # normalizar_sentencia solo al consultarlas.
+        self.__sentencias = {}
+        self.__lentas = 0
+
+    @property
+    def activa(self):
+        """Indica si la instrumentación está activada"""
+
+        return self.__activa
+
+    def activar(self):
+        """Empieza a medir las sentencias del motor"""
+
+        with self.__bloqueo:
+            if self.__activa: return
+            event.listen(self.motor, "before_cursor_execute", self.__antes)
+            event.listen(self.motor, "after_cursor_execute", self.__despues)
+            event.listen(self.motor, "handle_error", self.__error)
+            self.__activa = True
+
+    def desactivar(self):
+        """Deja de medir las sentencias. Las medidas se conservan."""
+
+        with self.__bloqueo:
+            if not self.__activa: return
+            event.remove(self.motor, "before_cursor_execute", self.__antes)
+            event.remove(self.motor, "after_cursor_execute", self.__despues)
+            event.remove(self.motor, "handle_error", self.__error)
+            self.__activa = False
+
+    def alternar(self):
+        """Activa la instrumentación si está desactivada, y al revés.
+        Devuelve si queda activada.
+        """
+
+        if self.__activa:
+            self.desactivar()
+        else:
+            self.activar()
+
+        return self.__activa
+
+    def reiniciar(self):
+        """Borra las medidas acumuladas"""
+
+        with self.__bloqueo:
+            self.__sentencias.clear()
+            self.__lentas = 0
+
+    # Eventos del motor. El instante de inicio se apila en la conexión, que
+    # solo usa un hilo a la vez.
+
+    def __antes(self, conexion, cursor, sentencia, parametros, contexto,
+                varias):
+
+        conexion.info.setdefault('instrumentacion', []).\
+            append(time.perf_counter())
+
+    def __despues(self, conexion, cursor, sentencia, parametros, contexto,
+                  varias):
+
+        inicios = conexion.info.get('instrumentacion')
+        if not inicios: return
+
+        ms = (time.perf_counter() - inicios.pop()) * 1000
+        # sqlite3 solo informa de las filas afectadas por INSERT, UPDATE y
+        # DELETE (-1 en las consultas, cuyas filas aún no se han leído).
+        filas = cursor.rowcount
+        sitio = sitio_llamada()
+
+        with self.__bloqueo:
+            estadistica = self.__sentencias.get(sentencia)
+            if estadistica is None:
+                estadistica = self.__sentencias[sentencia] = \
+                    _EstadisticaSentencia()
+            estadistica.anotar(ms, filas, sitio)
+            if ms >= self.umbral_lentas_ms: self.__lentas += 1
+
+        if ms >= self.umbral_lentas_ms:
+            registro_lentas.warning(
+                "%.1f ms%s en %s: %s %s", ms,
+                f", {filas} filas" if filas >= 0 else "", sitio,
+                normalizar_sentencia(sentencia),
+                _recortar(parametros))
+
+    def __error(self, contexto):
+
+        inicios = contexto.connection.info.get('instrumentacion') \
+            if contexto.connection is not None else None
+        if inicios: inicios.pop()
+
+    def estadisticas(self):
+        """Devuelve una lista de diccionarios, uno por sentencia (agrupadas
+        con normalizar_sentencia) y de mayor a menor tiempo total, con la
+        sentencia, ejecuciones, tiempo total, medio y máximo (ms), histograma
+        (lista de (límite superior en ms o None, ejecuciones)), filas
+        afectadas y sitios (lista de (sitio, ejecuciones), de más a menos).
+        """
+
+        with self.__bloqueo:
+            agrupadas = {}
+            for sentencia, e in self.__sentencias.items():
+                clave = normalizar_sentencia(sentencia)
+                g = agrupadas.get(clave)
+                if g is None:
+                    g = agrupadas[clave] = _EstadisticaSentencia()
+                g.ejecuciones += e.ejecuciones
+                g.total_ms += e.total_ms
+                g.max_ms = max(g.max_ms, e.max_ms)
+                g.histograma = [a + b for a, b in zip(g.histograma,
+                                                      e.histograma)]
+                g.filas += e.filas
+                g.sitios.update(e.sitios)
+
+        limites = LIMITES_HISTOGRAMA_MS + (None,)
+
+        return sorted(({'sentencia': sentencia,
+                        'ejecuciones': g.ejecuciones,
+                        'total_ms': g.total_ms,
+                        'media_ms': g.total_ms / g.ejecuciones,
+                        'max_ms': g.max_ms,
+                        'histograma': list(zip(limites, g.histograma)),
+                        'filas': g.filas,
+                        'sitios': g.sitios.most_common()}
+                       for sentencia, g in agrupadas.items()),
+                      key=lambda e: e['total_ms'], reverse=True)
+
+    def resumen(self):
+        """Devuelve un diccionario con los totales: sentencias distintas,
+        ejecuciones, tiempo total (ms) y ejecuciones lentas.
+        """
+
+        estadisticas = self.estadisticas()
+
+        return {'sentencias': len(estadisticas),
+                'ejecuciones': sum(e['ejecuciones'] for e in estadisticas),
+                'total_ms': sum(e['total_ms'] for e in estadisticas),
+                'lentas': self.__lentas}
+
+    def informe(self, n = 20):
+        """Devuelve un texto con las n sentencias que más tiempo suman, sus
+        medidas, su histograma y sus sitios de llamada.
+        """
+
+        resumen = self.resumen()
+        lineas = [f"{resumen['ejecuciones']} ejecuciones de "
+                  f"{resumen['sentencias']} sentencias en "
+                  f"{resumen['total_ms']:.1f} ms ({resumen['lentas']} por "
+                  f"encima de {self.umbral_lentas_ms:g} ms)"]
+
+        etiquetas = [f"<{limite:g}" for limite in LIMITES_HISTOGRAMA_MS] + \
+            [f">={LIMITES_HISTOGRAMA_MS[-1]:g}"]
+
+        for e in self.estadisticas()[:n]:
+            histograma = " ".join(
+                f"{etiqueta}:{ejecuciones}" for etiqueta, (_, ejecuciones)
+                in zip(etiquetas, e['histograma']) if ejecuciones)
+            lineas += ["",
+                       e['sentencia'],
+                       f"  {e['ejecuciones']} ejecuciones, "
+                       f"{e['total_ms']:.1f} ms en total, "
+                       f"{e['media_ms']:.2f} ms de media, "
+                       f"{e['max_ms']:.2f} ms como máximo, "
+                       f"{e['filas']} filas afectadas",
+                       f"  histograma (ms): {histograma}"]
+            lineas += [f"  {ejecuciones} desde {sitio}"
+                       for sitio, ejecuciones in e['sitios'][:5]]
+
+        return "\n".join(lineas)
+
+def _recortar(parametros, max_caracteres = 200):
+    """Devuelve los parámetros de la sentencia como texto, recortado. Los
+    BLOB se muestran solo con su tamaño.
+    """
+
+    def valor(v):
+        return f"<{len(v)} bytes>" if isinstance(v, (bytes, bytearray,
+                                                     memoryview)) else repr(v)
+
+    if isinstance(parametros, (list, tuple)) and parametros and \
+       isinstance(parametros[0], (list, tuple, dict)):
+        texto = f"[{len(parametros)} filas]"
+    elif isinstance(parametros, dict):
+        texto = "{" + ", ".join(f"{k}: {valor(v)}"
+                                for k, v in parametros.items()) + "}"
+    elif parametros:
+        texto = "(" + ", ".join(valor(v) for v in parametros) + ")"
+    else:
+        texto = ""
+
+    return texto if len(texto) <= max_caracteres else \
+        texto[:max_caracteres] + "..."
+
+def configurar_registro_lentas(fichero):
+    """Escribe el registro de consultas lentas en fichero, en lugar de en la
+    salida de error (el manejador por defecto de logging). Devuelve el
+    manejador añadido, o None si ya se escribía en ese fichero.
+    """
+
+    fichero = os.path.abspath(fichero)
+    for manejador in registro_lentas.handlers:
+        if getattr(manejador, 'baseFilename', None) == fichero: return None
+
+    manejador = logging.FileHandler(fichero, encoding="utf-8")
+    manejador.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    registro_lentas.addHandler(manejador)
+    registro_lentas.setLevel(logging.WARNING)
+
+    return manejador
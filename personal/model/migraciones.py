@@ -0,0 +1,485 @@
+"""
+personal, un sistema de gestión de personas
+
+    Copyright (C) 2023 Ángel Luis García García
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Migración de columnas, índices, claves ajenas y fotos de la base de datos.
+#
+# create_all solo crea las columnas e índices de las tablas que crea, por lo
+# que una base de datos existente (como personal.db) no recibe los que se
+# añaden después al modelo. migrar_columnas y migrar_indices los crean en el
+# sitio, y comprobar_plan_consultas verifica con EXPLAIN QUERY PLAN que las
+# consultas más frecuentes utilizan los índices.
+#
+# migrar_fotos pasa las fotos guardadas en la columna persona.foto (bases de
+# datos anteriores al almacén de fotos) a la tabla foto, guardando una sola
+# vez las fotos repetidas. Las fotos se copian por trozos (ver blobs.py).
+# Copiar las fotos de una base de datos grande lleva tiempo, así que no se
+# hace al crear el motor (que solo avisa con fotos_pendientes) sino de forma
+# explícita, ejecutando este módulo:
+#
+#   python -m personal.model.migraciones [fichero] [--vacuum]
+#
+# que muestra el progreso y, con --vacuum, compacta después la base de datos
+# para devolver al sistema de ficheros el espacio que ocupaban las fotos.
+#
+# migrar_claves_ajenas añade a las claves ajenas de las tablas existentes las
+# acciones ON DELETE del modelo. SQLite no permite modificar las restricciones
+# de una tabla, así que la tabla se reconstruye con el procedimiento que
+# recomienda su documentación: se crea una tabla nueva con la definición
+# original (conservando sus CHECK) en la que solo se cambian las claves
+# ajenas, se copian las filas, se borra la antigua, se renombra la nueva y se
+# vuelven a crear sus índices y triggers.
+
+import argparse
+import hashlib
+import logging
+import re
+import sys
+from collections import namedtuple
+
+from sqlalchemy import create_engine, text, inspect
+from sqlalchemy.schema import CreateColumn
+
+from personal.model.blobs import abrir_blob, copiar_blob, TAM_TROZO
+
+registro_migraciones = logging.getLogger("personal.migraciones")
+
+# Consultas frecuentes y el índice que debe utilizar cada una.
+
+CONSULTAS_FRECUENTES = (
+    ("Teléfonos de una persona",
+     "SELECT * FROM telefono WHERE persona_id = 1",
+     "ix_telefono_persona_id"),
+    ("Correos de una persona",
+     "SELECT * FROM mail WHERE persona_id = 1",
+     "ix_mail_persona_id"),
+    ("Direcciones de una persona",
+     "SELECT * FROM direccion WHERE persona_id = 1",
+     "ix_direccion_persona_id"),
+    ("Direcciones de un código postal",
+     "SELECT * FROM direccion WHERE cp_id = 1",
+     "ix_direccion_cp_id"),
+    ("Personas relacionadas con una persona",
+     "SELECT * FROM persona WHERE relacionado_con = 1",
+     "ix_persona_relacionado_con"),
+    ("Página de personas por apellidos",
+     "SELECT * FROM persona WHERE (ap1, coalesce(ap2, '') COLLATE NOCASE, "
+     "nombre, id_) > ('a', '', '', 0) ORDER BY ap1, "
+     "coalesce(ap2, '') COLLATE NOCASE, nombre, id_ LIMIT 200",
+     "ix_persona_apellidos"),
+    ("Página de personas por nombre",
+     "SELECT * FROM persona WHERE (nombre, ap1, coalesce(ap2, '') COLLATE "
+     "NOCASE, id_) < ('z', '', '', 0) ORDER BY nombre DESC, ap1 DESC, "
+     "coalesce(ap2, '') COLLATE NOCASE DESC, id_ DESC LIMIT 200",
+     "ix_persona_nombre"),
+    ("Página de personas por fecha de nacimiento",
+     "SELECT * FROM persona WHERE (fnac, id_) > ('1980-01-01', 0) "
+     "ORDER BY fnac, id_ LIMIT 200",
+     "ix_persona_fnac"),
+)
+
+def migrar_columnas(motor, metadata):
+    """Añade a las tablas existentes de la base de datos del motor las
+    columnas definidas en metadata que aún no existan. SQLite solo permite
+    añadir columnas que admitan nulos (o tengan valor por defecto), sin
+    clave primaria ni restricción de unicidad. Devuelve la lista de columnas
+    añadidas, como "tabla.columna".
+    """
+
+    anyadidas = []
+
+    with motor.begin() as conexion:
+
+        inspector = inspect(conexion)
+        tablas = set(inspector.get_table_names())
+
+        for tabla in metadata.sorted_tables:
+
+            if tabla.name not in tablas: continue
+
+            existentes = {c['name'] for c in inspector.get_columns(tabla.name)}
+            for columna in tabla.columns:
+                if columna.name not in existentes:
+                    ddl = CreateColumn(columna).compile(dialect=motor.dialect)
+                    conexion.execute(text(f"ALTER TABLE {tabla.name} "
+                                          f"ADD COLUMN {ddl}"))
+                    anyadidas.append(f"{tabla.name}.{columna.name}")
+
+    return anyadidas
+
+InformeFotos = namedtuple('InformeFotos',
+                          ['personas', 'fotos', 'bytes_referenciados',
+                           'bytes_almacenados'])
+InformeFotos.__doc__ = """Uso del almacén de fotos: personas con foto,
+    fotos distintas guardadas, bytes que ocuparían las fotos guardando una
+    copia por persona y bytes que ocupan realmente.
+    """
+
+def informe_fotos(conexion):
+    """Devuelve el InformeFotos del almacén de fotos"""
+
+    personas, referenciados = conexion.execute(text(
+        "SELECT count(*), coalesce(sum(f.tamanyo), 0) FROM persona p "
+        "JOIN foto f ON f.hash = p.foto_hash")).one()
+    fotos, almacenados = conexion.execute(text(
+        "SELECT count(*), coalesce(sum(tamanyo), 0) FROM foto")).one()
+
+    return InformeFotos(personas, fotos, referenciados, almacenados)
+
+def _hash_blob(origen):
+    """Devuelve el SHA-256 del fichero binario origen, leído por trozos"""
+
+    hash_ = hashlib.sha256()
+    for trozo in iter(lambda: origen.read(TAM_TROZO), b""):
+        hash_.update(trozo)
+
+    return hash_.hexdigest()
+
+def fotos_pendientes(conexion):
+    """Devuelve el número de personas con la foto aún en la columna
+    persona.foto, pendientes de pasar al almacén de fotos.
+    """
+
+    columnas = {c['name'] for c in inspect(conexion).get_columns('persona')}
+    if 'foto' not in columnas: return 0
+
+    return conexion.execute(text(
+        "SELECT count(*) FROM persona WHERE foto IS NOT NULL")).scalar()
+
+def migrar_fotos(motor, tam_lote = 100, progreso = None):
+    """Pasa al almacén de fotos (tabla foto) las fotos que aún estén en la
+    columna persona.foto, de tam_lote en tam_lote personas y con una
+    transacción por lote, y vacía esa columna. Las fotos se leen y copian
+    por trozos, sin cargarlas enteras en memoria. Las fotos vacías se
+    eliminan. Tras cada lote se llama a progreso(migradas, total), si se
+    indica. Devuelve el número de personas migradas.
+    """
+
+    with motor.connect() as conexion:
+        total = fotos_pendientes(conexion)
+    if not total: return 0
+
+    migradas = 0
+
+    while True:
+
+        with motor.begin() as conexion:
+
+            lote = conexion.execute(text(
+                "SELECT id_, length(foto) FROM persona WHERE foto IS NOT NULL "
+                "LIMIT :limite"), {'limite': tam_lote}).all()
+            if not lote: break
+
+            dbapi = conexion.connection.driver_connection
+            fotos = []
+
+            for id_, tamanyo in lote:
+
+                hash_ = None
+
+                if tamanyo:
+
+                    # El rowid de persona es su id_.
+                    with abrir_blob(dbapi, 'persona', 'foto', id_) as origen:
+                        hash_ = _hash_blob(origen)
+
+                    existe = conexion.execute(text(
+                        "UPDATE foto SET referencias = referencias + 1 "
+                        "WHERE hash = :hash"), {'hash': hash_}).rowcount
+
+                    if not existe:
+                        # Se reserva el BLOB y se copia en él por trozos.
+                        fila = conexion.execute(text(
+                            "INSERT INTO foto (hash, datos, tamanyo, "
+                            "referencias) VALUES (:hash, zeroblob(:tamanyo), "
+                            ":tamanyo, 1)"),
+                            {'hash': hash_, 'tamanyo': tamanyo}).lastrowid
+                        with abrir_blob(dbapi, 'persona', 'foto', id_) as \
+                             origen, abrir_blob(dbapi, 'foto', 'datos', fila,
+                                                escritura=True) as destino:
+                            copiar_blob(origen, destino)
+
+                fotos.append({'id_': id_, 'hash': hash_})
+
+            conexion.execute(text(
+                "UPDATE persona SET foto_hash = :hash, foto = NULL "
+                "WHERE id_ = :id_"), fotos)
+
+            migradas += len(lote)
+
+        if progreso is not None: progreso(migradas, total)
+
+    return migradas
+
+def compactar(motor):
+    """Compacta la base de datos del motor con VACUUM, devolviendo al
+    sistema de ficheros las páginas libres (p.ej. las de las fotos pasadas
+    al almacén). Devuelve el tamaño en bytes antes y después, en una tupla.
+    """
+
+    # VACUUM no se puede ejecutar dentro de una transacción.
+    with motor.connect().execution_options(
+        isolation_level="AUTOCOMMIT") as conexion:
+        tamanyo = lambda: conexion.exec_driver_sql(
+            "SELECT page_count * page_size FROM pragma_page_count(), "
+            "pragma_page_size()").scalar()
+        antes = tamanyo()
+        conexion.exec_driver_sql("VACUUM")
+        despues = tamanyo()
+
+    return antes, despues
+
+def _acciones_pendientes(conexion, tabla):
+    """Devuelve un diccionario {columna: acción ON DELETE del modelo} con las
+    claves ajenas de la tabla (de metadata) cuya acción en la base de datos
+    es distinta.
+    """
+
+    existentes = {f[3]: f[6].upper() for f in conexion.exec_driver_sql(
+        f"PRAGMA foreign_key_list({tabla.name})")}
+
+    ret = {}
+    for clave in tabla.foreign_keys:
+        accion = (clave.ondelete or "NO ACTION").upper()
+        columna = clave.parent.name
+        if columna in existentes and existentes[columna] != accion:
+            ret[columna] = accion
+
+    return ret
+
+def _cambiar_claves_ajenas(sql, tabla, acciones):
+    """Devuelve la sentencia CREATE TABLE sql de la tabla con el nombre
+    tabla_nueva y las acciones ON DELETE indicadas en sus claves ajenas.
+    Lanza ValueError si no encuentra alguna de las claves ajenas.
+    """
+
+    sql, n = re.subn(rf'^\s*CREATE\s+TABLE\s+"?{tabla}"?(?=[\s(])',
+                     f"CREATE TABLE {tabla}_nueva", sql, count=1, flags=re.I)
+    if not n:
+        raise ValueError(f"No se reconoce la definición de la tabla {tabla}")
+
+    for columna, accion in acciones.items():
+        sql, n = re.subn(
+            rf'(FOREIGN\s+KEY\s*\(\s*"?{columna}"?\s*\)\s*REFERENCES\s+'
+            rf'"?\w+"?\s*\([^)]*\))(\s+ON\s+DELETE\s+(SET\s+NULL|'
+            rf'SET\s+DEFAULT|CASCADE|RESTRICT|NO\s+ACTION))?',
+            lambda m: m.group(1) + ("" if accion == "NO ACTION" else
+                                    f" ON DELETE {accion}"),
+            sql, count=1, flags=re.I)
+        if not n:
+            raise ValueError(f"No se reconoce la clave ajena "
+                             f"{tabla}.{columna}")
+
+    return sql
+
+def _reconstruir_tabla(conexion, tabla, acciones):
+    """Reconstruye la tabla con las acciones ON DELETE indicadas, dentro de
+    la transacción en curso y con las claves ajenas desactivadas.
+    """
+
+    sql = conexion.execute(text(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' "
+        "AND name = :tabla"), {'tabla': tabla}).scalar()
+    dependientes = conexion.execute(text(
+        "SELECT sql FROM sqlite_master WHERE type IN ('index', 'trigger') "
+        "AND tbl_name = :tabla AND sql IS NOT NULL"),
+        {'tabla': tabla}).scalars().all()
+    secuencia = None
+    if conexion.execute(text("SELECT 1 FROM sqlite_master "
+                             "WHERE name = 'sqlite_sequence'")).first():
+        secuencia = conexion.execute(text(
+            "SELECT seq FROM sqlite_sequence WHERE name = :tabla"),
+            {'tabla': tabla}).scalar()
+
+    conexion.exec_driver_sql(_cambiar_claves_ajenas(sql, tabla, acciones))
+    conexion.exec_driver_sql(f"INSERT INTO {tabla}_nueva "
+                             f"SELECT * FROM {tabla}")
+    conexion.exec_driver_sql(f"DROP TABLE {tabla}")
+    conexion.exec_driver_sql(f"ALTER TABLE {tabla}_nueva RENAME TO {tabla}")
+
+    for sql in dependientes:
+        conexion.exec_driver_sql(sql)
+
+    # Se conserva el último id_ asignado por AUTOINCREMENT.
+    if secuencia is not None:
+        conexion.execute(text("DELETE FROM sqlite_sequence "
+                              "WHERE name = :tabla"), {'tabla': tabla})
+        conexion.execute(text("INSERT INTO sqlite_sequence (name, seq) "
+                              "VALUES (:tabla, :seq)"),
+                         {'tabla': tabla, 'seq': secuencia})
+
+def migrar_claves_ajenas(motor, metadata):
+    """Reconstruye las tablas existentes de la base de datos del motor cuyas
+    claves ajenas no tienen las acciones ON DELETE definidas en metadata,
+    todas en una transacción. Las filas se copian tal cual. Devuelve la lista
+    de tablas reconstruidas.
+    """
+
+    with motor.connect() as conexion:
+
+        tablas = set(inspect(conexion).get_table_names())
+        pendientes = [(tabla.name, acciones) for tabla, acciones in
+                      ((t, _acciones_pendientes(conexion, t))
+                       for t in metadata.sorted_tables if t.name in tablas)
+                      if acciones]
+        conexion.commit()
+
+        if not pendientes: return []
+
+        # Las claves ajenas solo se pueden desactivar fuera de una
+        # transacción. Con legacy_alter_table, RENAME no comprueba los
+        # triggers de otras tablas que usan la tabla borrada.
+        activas = conexion.exec_driver_sql("PRAGMA foreign_keys").scalar()
+        conexion.exec_driver_sql("PRAGMA foreign_keys = OFF")
+        conexion.exec_driver_sql("PRAGMA legacy_alter_table = ON")
+
+        try:
+            conexion.exec_driver_sql("BEGIN IMMEDIATE")
+            for tabla, acciones in pendientes:
+                _reconstruir_tabla(conexion, tabla, acciones)
+            conexion.exec_driver_sql("ANALYZE")
+            conexion.commit()
+        except BaseException:
+            conexion.rollback()
+            raise
+        finally:
+            conexion.exec_driver_sql("PRAGMA legacy_alter_table = OFF")
+            conexion.exec_driver_sql(f"PRAGMA foreign_keys = {int(activas)}")
+            conexion.commit()
+
+    return [tabla for tabla, _ in pendientes]
+
+def migrar_indices(motor, metadata):
+    """Crea en la base de datos del motor los índices definidos en metadata
+    que aún no existan. Devuelve la lista de nombres de índices creados.
+    """
+
+    creados = []
+
+    with motor.begin() as conexion:
+
+        inspector = inspect(conexion)
+        tablas = set(inspector.get_table_names())
+
+        for tabla in metadata.sorted_tables:
+
+            if tabla.name not in tablas: continue
+
+            # Se consulta sqlite_master porque la reflexión de SQLAlchemy no
+            # devuelve los índices sobre expresiones.
+            existentes = set(conexion.execute(text(
+                "SELECT name FROM sqlite_master WHERE type = 'index' "
+                "AND tbl_name = :tabla"), {'tabla': tabla.name}).scalars())
+            for indice in sorted(tabla.indexes, key=lambda i: i.name):
+                if indice.name not in existentes:
+                    indice.create(conexion)
+                    creados.append(indice.name)
+
+        if creados:
+            # Se actualizan las estadísticas para que el planificador de
+            # SQLite tenga en cuenta los índices nuevos.
+            conexion.execute(text("ANALYZE"))
+
+    return creados
+
+def comprobar_plan_consultas(motor):
+    """Ejecuta EXPLAIN QUERY PLAN sobre las consultas frecuentes. Devuelve una
+    lista de tuplas (descripción, índice esperado, plan, correcto), donde
+    correcto indica si el plan utiliza el índice esperado.
+    """
+
+    ret = []
+
+    with motor.connect() as conexion:
+
+        for descripcion, sql, indice in CONSULTAS_FRECUENTES:
+            filas = conexion.execute(text(f"EXPLAIN QUERY PLAN {sql}")).all()
+            plan = " | ".join(str(f[-1]) for f in filas)
+            ret.append((descripcion, indice, plan, indice in plan))
+
+    return ret
+
+def _mostrar_progreso(migradas, total):
+    """Muestra en una sola línea el progreso de migrar_fotos"""
+
+    print(f"\rFotos pasadas al almacén de fotos: {migradas} de {total}",
+          end="" if migradas < total else "\n", flush=True)
+
+def main(argv = None):
+    """Migra las columnas, índices, claves ajenas y fotos de la base de datos
+    (por defecto la de la aplicación), mostrando el progreso de las fotos,
+    informa del espacio ahorrado por el almacén de fotos, compacta la base
+    de datos si se pide con --vacuum y muestra el plan de las consultas
+    frecuentes. Devuelve 0 si todas utilizan su índice, y 1 en caso
+    contrario.
+    """
+
+    from personal.model.model import Base, uri_bd
+
+    parser = argparse.ArgumentParser(prog="python -m personal.model."
+                                     "migraciones", description="Migra la "
+                                     "base de datos al modelo actual")
+    parser.add_argument("fichero", nargs="?",
+                        help="base de datos (por defecto, la configurada)")
+    parser.add_argument("--vacuum", action="store_true",
+                        help="compacta la base de datos tras la migración")
+    args = parser.parse_args(argv)
+
+    db_uri = f"sqlite:///{args.fichero}" if args.fichero else uri_bd()
+
+    motor = create_engine(db_uri)
+
+    # Tablas nuevas del modelo (p.ej. la del almacén de fotos).
+    Base.metadata.create_all(motor)
+
+    for nombre in migrar_columnas(motor, Base.metadata):
+        print(f"Columna añadida: {nombre}")
+
+    for nombre in migrar_indices(motor, Base.metadata):
+        print(f"Índice creado: {nombre}")
+
+    for nombre in migrar_claves_ajenas(motor, Base.metadata):
+        print(f"Tabla reconstruida (claves ajenas): {nombre}")
+
+    migrar_fotos(motor, progreso = _mostrar_progreso)
+
+    with motor.connect() as conexion:
+        informe = informe_fotos(conexion)
+    print(f"Almacén de fotos: {informe.personas} personas con foto, "
+          f"{informe.fotos} fotos distintas, {informe.bytes_almacenados} "
+          f"bytes guardados de {informe.bytes_referenciados} "
+          f"({informe.bytes_referenciados - informe.bytes_almacenados} "
+          f"bytes ahorrados)")
+
+    if args.vacuum:
+        antes, despues = compactar(motor)
+        print(f"Base de datos compactada: {antes} bytes antes, {despues} "
+              f"bytes después")
+
+    ret = 0
+    for descripcion, indice, plan, correcto in \
+        comprobar_plan_consultas(motor):
+        print(f"[{'OK' if correcto else 'FALLO'}] {descripcion}: {plan}")
+        if not correcto: ret = 1
+
+    motor.dispose()
+
+    return ret
+
+if __name__ == '__main__':
+    sys.exit(main())
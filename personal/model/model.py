@@ -17,17 +17,65 @@ personal, un sistema de gestión de personas
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import base64
+import hashlib
+import json
 import os
+import sqlite3
+import threading
+import zlib
+from collections import namedtuple
+from contextlib import contextmanager
 
 from sqlalchemy import Column, Integer, Text, ForeignKey, \
-     CheckConstraint, create_engine, BLOB, and_
-from sqlalchemy.orm import relationship, sessionmaker, declarative_base
-from sqlalchemy.exc import SQLAlchemyError
+     CheckConstraint, Index, create_engine, BLOB, and_, func, event, text, \
+     insert, update, delete, tuple_, bindparam, select
+from sqlalchemy.dialects.sqlite import insert as insert_sqlite
+from sqlalchemy.orm import relationship, sessionmaker, declarative_base, \
+     deferred, undefer_group, joinedload, selectinload, noload, undefer
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from sqlalchemy.pool import QueuePool, StaticPool
+
+from personal.model.busqueda import crear_busqueda_texto, consulta_fts, \
+     sql_buscar
+from personal.model.migraciones import migrar_columnas, migrar_indices, \
+     migrar_claves_ajenas, fotos_pendientes, informe_fotos, \
+     registro_migraciones
+from personal.model.blobs import abrir_blob_motor
+from personal.model.configuracion import perfil_sqlite, aplicar_pragmas, \
+     fichero_bd, opciones_fotos, opciones_instrumentacion, \
+     opciones_deteccion_n1, PERFILES_SQLITE, PERFIL_POR_DEFECTO, \
+     PRAGMAS_PERMITIDOS
+from personal.model.instrumentacion import InstrumentacionSQL, \
+     configurar_registro_lentas, UMBRAL_LENTAS_MS
+from personal.model.deteccion_n1 import DetectorN1
+from personal.model.imagenes import generar_miniaturas, normalizar_foto, \
+     TAM_MINIATURA_LISTA, TAM_MINIATURA_FICHA, LADO_MAXIMO_FOTO, CALIDAD_FOTO
 
 NOMBRE_BD = "personal.db"
 dir_actual = os.path.dirname(os.path.abspath(__file__))
 RUTA_BD = os.path.join(*[dir_actual])
-FICHERO_BD = f'sqlite:///{os.path.join(*[RUTA_BD, NOMBRE_BD])}'
+# Se usa la base de datos de la aplicación, salvo que se configure otra (ver
+# uri_bd).
+FICHERO_BD = 'sqlite:///' + os.path.join(*[RUTA_BD, NOMBRE_BD])
+
+_uri_bd = None
+
+def uri_bd():
+    """Devuelve la URI de la base de datos configurada en la sección [bd] o,
+    si no se configura ninguna, la de la aplicación (FICHERO_BD). La
+    configuración se lee la primera vez que se llama, y no al importar el
+    módulo, de forma que un fichero de configuración erróneo no impide
+    arrancar.
+    """
+    
+    global _uri_bd
+    
+    if _uri_bd is None:
+        fichero = fichero_bd()
+        _uri_bd = FICHERO_BD if fichero is None else f"sqlite:///{fichero}"
+        
+    return _uri_bd
 
 # Se define el modelo que representa la estructura de tus tablas en la base de
 # datos. Para ello se utiliza la funcionalidad de declarative_base de 
@@ -45,34 +93,65 @@ class Persona(Base):
     ap1 = Column(Text(collation='NOCASE'), nullable=False)
     ap2 = Column(Text(collation='NOCASE'))
     fnac = Column(Text, nullable=False)
-    relacionado_con = Column(Integer, ForeignKey('persona.id_'), nullable=True)
-    tipo_relacion_id = Column(Integer, ForeignKey('tipo_relacion.id_'),\
-                              nullable=True)
-    observ = Column(Text(collation='NOCASE'))
-    foto = Column(BLOB)
+    relacionado_con = Column(Integer,
+                             ForeignKey('persona.id_', ondelete='SET NULL'),
+                             nullable=True, index=True)
+    tipo_relacion_id = Column(Integer,
+                              ForeignKey('tipo_relacion.id_',
+                                         ondelete='SET NULL'), nullable=True)
+    # Las observaciones se cargan de forma diferida. La foto se guarda aparte,
+    # en la tabla foto, y la persona solo tiene su hash.
+    observ = deferred(Column(Text(collation='NOCASE')), group='detalle')
+    foto_hash = Column(Text, ForeignKey('foto.hash'), nullable=True,
+                       index=True)
     sexo = Column(Text, nullable=False)
+    # Dimensiones de la foto tal y como se recibió, antes de normalizarla.
+    foto_ancho_original = Column(Integer)
+    foto_alto_original = Column(Integer)
     
-    # Restricciones de columnas.
+    # Restricciones de columnas, e índices de los órdenes del listado
+    # paginado (ver DBManager.obtener_pagina_personas). El segundo apellido
+    # se ordena como cadena vacía si no tiene, para que la paginación no
+    # tenga que tratar los nulos aparte.
     
     __table_args__ = (CheckConstraint("length(nif) = 9", name="check_nif"), \
                       CheckConstraint("sexo in ('Hombre', 'Mujer')", \
-                                      name="check_sexo"))
+                                      name="check_sexo"),
+                      Index('ix_persona_apellidos', ap1,
+                            func.coalesce(ap2, '').collate('NOCASE'),
+                            nombre),
+                      Index('ix_persona_nombre', nombre, ap1,
+                            func.coalesce(ap2, '').collate('NOCASE')),
+                      Index('ix_persona_fnac', fnac))
     
-    # Relaciones.
+    # Relaciones. Al eliminar una persona, la base de datos elimina sus
+    # contactos y miniaturas y deja sin relación a las personas relacionadas
+    # con ella (ON DELETE de las claves ajenas), por lo que con
+    # passive_deletes el ORM no los carga para borrarlos uno a uno.
     
     per_relaciones = relationship("Persona", remote_side=[id_], 
                                   back_populates="per_relacionado_con")
     per_relacionado_con = relationship("Persona", 
                                        remote_side=[relacionado_con], 
-                                       back_populates="per_relaciones") 
+                                       back_populates="per_relaciones",
+                                       passive_deletes=True) 
     per_telefonos = relationship("Telefono", back_populates="tel_persona",
-                                 cascade='all, delete-orphan')
+                                 cascade='all, delete-orphan',
+                                 passive_deletes=True)
     per_mails = relationship("Mail", back_populates="mails_persona",
-                             cascade='all, delete-orphan')
+                             cascade='all, delete-orphan',
+                             passive_deletes=True)
     per_direcciones = relationship("Direccion", back_populates="dir_persona",
-                                   cascade='all, delete-orphan')
+                                   cascade='all, delete-orphan',
+                                   passive_deletes=True)
     per_tipo_relacion = relationship("TipoRelacion", \
                                      back_populates="t_rel_persona")    
+    per_miniatura = relationship("Miniatura", back_populates="mini_persona",
+                                 uselist=False, cascade='all, delete-orphan',
+                                 passive_deletes=True)
+    # Solo lectura: la foto se asigna con foto_hash (ver _asignar_foto), que
+    # es lo que mantiene las referencias.
+    per_foto = relationship("Foto", viewonly=True)
     
     # Representación del objeto.
     
@@ -85,7 +164,9 @@ class Telefono(Base):
     __tablename__ = 'telefono'
     
     id_ = Column(Integer, primary_key=True, autoincrement=True)
-    persona_id = Column(Integer, ForeignKey('persona.id_'), nullable=False)
+    persona_id = Column(Integer,
+                        ForeignKey('persona.id_', ondelete='CASCADE'),
+                        nullable=False, index=True)
     numero = Column(Text(collation='NOCASE'), nullable=False)
     preferencia = Column(Integer, nullable=False)
     observ = Column(Text(collation='NOCASE'))
@@ -111,7 +192,9 @@ class Mail(Base):
     __tablename__ = 'mail'
     
     id_ = Column(Integer, primary_key=True, autoincrement=True)
-    persona_id = Column(Integer, ForeignKey('persona.id_'), nullable=False)
+    persona_id = Column(Integer,
+                        ForeignKey('persona.id_', ondelete='CASCADE'),
+                        nullable=False, index=True)
     mail = Column(Text(collation='NOCASE'), nullable=False)
     preferencia = Column(Integer, nullable=False)
     observ = Column(Text(collation='NOCASE'))
@@ -137,9 +220,12 @@ class Direccion(Base):
     __tablename__ = 'direccion'
 
     id_ = Column(Integer, primary_key=True, autoincrement=True)
-    persona_id = Column(Integer, ForeignKey('persona.id_'), nullable=False)
+    persona_id = Column(Integer,
+                        ForeignKey('persona.id_', ondelete='CASCADE'),
+                        nullable=False, index=True)
     direccion = Column(Text(collation='NOCASE'), nullable=False)
-    cp_id = Column(Integer, ForeignKey('codigo_postal.id_'), nullable=False)
+    cp_id = Column(Integer, ForeignKey('codigo_postal.id_'), nullable=False,
+                   index=True)
     preferencia = Column(Integer, nullable=False)
     observ = Column(Text(collation='NOCASE'))
 
@@ -192,13 +278,598 @@ class TipoRelacion(Base):
 
     # Relaciones
     
-    t_rel_persona = relationship("Persona", back_populates="per_tipo_relacion")
+    t_rel_persona = relationship("Persona", back_populates="per_tipo_relacion",
+                                 passive_deletes=True)
     
     # Representación del objeto.
 
     def __repr__(self):
         return f"TipoRelacion(id_={self.id_}, relacion='{self.relacion}')"
 
+class Foto(Base):
+    
+    __tablename__ = 'foto'
+    
+    # Almacén de fotos direccionado por contenido: cada foto distinta se
+    # guarda una sola vez, con el SHA-256 de sus datos como clave, y
+    # referencias cuenta las personas que la usan. Cuando deja de usarla la
+    # última, se borra.
+    
+    hash = Column(Text, primary_key=True)
+    datos = deferred(Column(BLOB, nullable=False))
+    tamanyo = Column(Integer, nullable=False)
+    referencias = Column(Integer, nullable=False, default=0,
+                         server_default='0')
+    # 1 si la foto se puede decodificar, 0 si no (se guarda tal cual, sin
+    # miniaturas) y None si aún no se ha comprobado.
+    decodificable = Column(Integer)
+    
+    # Representación del objeto.
+
+    def __repr__(self):
+        return f"Foto(hash='{self.hash}', tamanyo={self.tamanyo}, \
+        referencias={self.referencias})"
+
+class Miniatura(Base):
+    
+    __tablename__ = 'miniatura'
+    
+    # Miniaturas precalculadas de la foto de la persona, en PNG, para no tener
+    # que decodificar y redimensionar la foto original cada vez que se muestra.
+    
+    persona_id = Column(Integer,
+                        ForeignKey('persona.id_', ondelete='CASCADE'),
+                        primary_key=True)
+    mini_lista = Column(BLOB, nullable=False)
+    mini_ficha = Column(BLOB, nullable=False)
+    
+    # Relaciones
+    
+    mini_persona = relationship("Persona", back_populates="per_miniatura")
+    
+    # Representación del objeto.
+
+    def __repr__(self):
+        return f"Miniatura(persona_id={self.persona_id})"
+
+# Ficha completa de una persona, tal y como la necesita el controlador:
+# objetos inmutables, sin sesión ni carga perezosa, que se pueden usar
+# libremente una vez cerrada la sesión. version_foto identifica el contenido
+# de la miniatura (cambia cuando cambia la foto), y sirve de clave para
+# cachear la imagen ya decodificada. foto_hash permite leer la foto original
+# por trozos (ver DBManager.abrir_foto).
+
+FichaPersona = namedtuple('FichaPersona',
+                          ['id_', 'nif', 'nombre', 'ap1', 'ap2', 'fnac',
+                           'sexo', 'observ', 'tipo_relacion_id',
+                           'tipo_relacion', 'relacionado_con', 'relacionado',
+                           'miniatura', 'version_foto', 'foto_hash',
+                           'telefonos', 'mails', 'direcciones'])
+# Columnas de una persona que se pueden modificar con
+# DBManager.modificar_campos_persona.
+
+CAMPOS_PERSONA = ('nif', 'nombre', 'ap1', 'ap2', 'fnac', 'sexo', 'observ',
+                  'tipo_relacion_id', 'relacionado_con', 'foto')
+
+PersonaRelacionada = namedtuple('PersonaRelacionada',
+                                ['id_', 'nif', 'nombre', 'ap1', 'ap2'])
+TelefonoFicha = namedtuple('TelefonoFicha',
+                           ['id_', 'persona_id', 'numero', 'preferencia',
+                            'observ'])
+MailFicha = namedtuple('MailFicha',
+                       ['id_', 'persona_id', 'mail', 'preferencia', 'observ'])
+DireccionFicha = namedtuple('DireccionFicha',
+                            ['id_', 'persona_id', 'direccion', 'cp_id', 'cp',
+                             'localidad', 'provincia', 'preferencia',
+                             'observ'])
+
+def _crear_ficha(persona):
+    """Crea la ficha inmutable de la persona, con todas sus relaciones ya
+    cargadas.
+    """
+    
+    rel = persona.per_relaciones
+    relacionado = None if rel is None else \
+        PersonaRelacionada(rel.id_, rel.nif, rel.nombre, rel.ap1, rel.ap2)
+    tipo = persona.per_tipo_relacion
+    miniatura = persona.per_miniatura
+    miniatura = None if miniatura is None else miniatura.mini_ficha
+    
+    return FichaPersona(
+        id_=persona.id_, nif=persona.nif, nombre=persona.nombre,
+        ap1=persona.ap1, ap2=persona.ap2, fnac=persona.fnac,
+        sexo=persona.sexo, observ=persona.observ,
+        tipo_relacion_id=persona.tipo_relacion_id,
+        tipo_relacion=None if tipo is None else tipo.relacion,
+        relacionado_con=persona.relacionado_con, relacionado=relacionado,
+        miniatura=miniatura,
+        version_foto=None if miniatura is None else zlib.crc32(miniatura),
+        foto_hash=persona.foto_hash,
+        telefonos=tuple(TelefonoFicha(t.id_, t.persona_id, t.numero,
+                                      t.preferencia, t.observ)
+                        for t in sorted(persona.per_telefonos,
+                                        key=lambda t: t.id_)),
+        mails=tuple(MailFicha(m.id_, m.persona_id, m.mail, m.preferencia,
+                              m.observ)
+                    for m in sorted(persona.per_mails, key=lambda m: m.id_)),
+        direcciones=tuple(DireccionFicha(d.id_, d.persona_id, d.direccion,
+                                         d.cp_id, d.dir_cp.cp,
+                                         d.dir_cp.localidad,
+                                         d.dir_cp.provincia, d.preferencia,
+                                         d.observ)
+                          for d in sorted(persona.per_direcciones,
+                                          key=lambda d: d.id_)))
+
+def _nombre_completo():
+    """Expresión SQL con el nombre completo de la persona"""
+    
+    return func.trim(Persona.nombre + ' ' + Persona.ap1 + ' ' + \
+                     func.coalesce(Persona.ap2, ''))
+
+def _tiene_foto():
+    """Expresión SQL que indica si la persona tiene foto"""
+    
+    return Persona.foto_hash.isnot(None)
+
+def _columnas_lista():
+    """Columnas del listado ligero de personas (sin foto ni observaciones)"""
+    
+    return (Persona.id_, Persona.nif, Persona.nombre, Persona.ap1,
+            Persona.ap2, Persona.fnac, Persona.sexo,
+            _nombre_completo().label('nombre_completo'),
+            _tiene_foto().label('tiene_foto'))
+
+# Órdenes del listado paginado de personas, y columnas de cada uno. Todos
+# terminan en una columna única (id_ o nif), de forma que la última fila de
+# una página identifica sin ambigüedad dónde empieza la siguiente.
+
+ORDENES_PERSONA = ('apellidos', 'nombre', 'fnac', 'nif', 'id_')
+
+_CLAVES_ORDEN = {'apellidos': ('ap1', 'ap2', 'nombre', 'id_'),
+                 'nombre': ('nombre', 'ap1', 'ap2', 'id_'),
+                 'fnac': ('fnac', 'id_'),
+                 'nif': ('nif', 'id_'),
+                 'id_': ('id_', )}
+
+# Columnas de texto que SQLite compara sin distinguir mayúsculas (NOCASE,
+# que solo convierte las letras ASCII).
+
+_CLAVES_NOCASE = ('nif', 'nombre', 'ap1', 'ap2')
+_NOCASE = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ",
+                        "abcdefghijklmnopqrstuvwxyz")
+
+PaginaPersonas = namedtuple('PaginaPersonas', ['filas', 'cursor'])
+
+def _claves_orden(orden):
+    """Devuelve las columnas del orden, o lanza ValueError si no existe"""
+    
+    if orden not in _CLAVES_ORDEN:
+        raise ValueError(f"Orden de personas desconocido: {orden}")
+    
+    return _CLAVES_ORDEN[orden]
+
+def _expresion_orden(clave):
+    """Expresión SQL de una columna de orden, la misma de los índices"""
+    
+    if clave == 'ap2':
+        return func.coalesce(Persona.ap2, '').collate('NOCASE')
+    
+    return getattr(Persona, clave)
+
+def _valores_orden(fila, orden):
+    """Valores de las columnas del orden en la fila (o persona)"""
+    
+    return tuple("" if clave == 'ap2' and getattr(fila, clave) is None \
+                 else getattr(fila, clave) for clave in _claves_orden(orden))
+
+def clave_orden_persona(fila, orden):
+    """Devuelve la clave de ordenación en Python de una fila del listado
+    ligero (o persona), que ordena igual que la base de datos por orden.
+    """
+    
+    return tuple(v.translate(_NOCASE) if clave in _CLAVES_NOCASE else v
+                 for clave, v in zip(_claves_orden(orden),
+                                     _valores_orden(fila, orden)))
+
+def _codificar_cursor(orden, descendente, valores):
+    """Cursor opaco que apunta tras la fila con los valores de orden"""
+    
+    datos = json.dumps([orden, descendente, list(valores)])
+    
+    return base64.urlsafe_b64encode(datos.encode("utf-8")).decode("ascii")
+
+def _decodificar_cursor(cursor, orden, descendente):
+    """Devuelve los valores de orden del cursor, o lanza ValueError si no es
+    válido o es de otro orden.
+    """
+    
+    try:
+        orden_c, descendente_c, valores = json.loads(
+            base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError, AttributeError):
+        raise ValueError(f"Cursor no válido: {cursor!r}") from None
+    
+    if orden_c != orden or descendente_c != descendente or \
+       len(valores) != len(_claves_orden(orden)):
+        raise ValueError("El cursor es de otro orden del listado")
+    
+    return tuple(valores)
+
+def _paginar(consulta, orden, descendente, valores, limite):
+    """Añade a la consulta de personas el orden y la condición de la
+    paginación por clave: solo las filas posteriores a los valores de orden
+    (si no son None), y como mucho limite filas.
+    """
+    
+    columnas = [_expresion_orden(c) for c in _claves_orden(orden)]
+    
+    if valores is not None:
+        posteriores = tuple_(*columnas) < tuple_(*valores) if descendente \
+            else tuple_(*columnas) > tuple_(*valores)
+        consulta = consulta.filter(posteriores)
+    
+    if descendente: columnas = [c.desc() for c in columnas]
+    
+    return consulta.order_by(*columnas).limit(limite)
+
+def _opciones_fotos():
+    """Devuelve el lado máximo y la calidad configurados para las fotos, o
+    los valores por defecto si la configuración no es válida.
+    """
+    
+    try:
+        return opciones_fotos()
+    except ValueError:
+        return LADO_MAXIMO_FOTO, CALIDAD_FOTO
+
+def _opciones_instrumentacion():
+    """Devuelve las opciones configuradas de la instrumentación SQL, o las
+    de por defecto (desactivada) si la configuración no es válida.
+    """
+    
+    try:
+        return opciones_instrumentacion()
+    except ValueError:
+        return False, UMBRAL_LENTAS_MS, None
+
+def _opciones_deteccion_n1():
+    """Devuelve las opciones configuradas de la detección de consultas
+    N+1, o las de por defecto (desactivada) si la configuración no es válida.
+    """
+    
+    try:
+        return opciones_deteccion_n1()
+    except ValueError:
+        return False, False
+
+def hash_foto(datos):
+    """Devuelve la clave de la foto (bytes) en el almacén de fotos"""
+    
+    return hashlib.sha256(datos).hexdigest()
+
+def _referenciar_foto(sesion, datos, decodificable = None):
+    """Guarda la foto en el almacén si no estaba, y suma una referencia.
+    Devuelve su hash.
+    """
+    
+    hash_ = hash_foto(datos)
+    sesion.execute(insert_sqlite(Foto).\
+                   values(hash=hash_, datos=datos, tamanyo=len(datos),
+                          referencias=1, decodificable=decodificable).\
+                   on_conflict_do_update(
+                       index_elements=[Foto.hash],
+                       set_={'referencias': Foto.referencias + 1}))
+    
+    return hash_
+
+def _liberar_foto(sesion, hash_):
+    """Resta una referencia a la foto, y la borra si ya no tiene ninguna"""
+    
+    _liberar_fotos(sesion, {hash_: 1})
+
+def _liberar_fotos(sesion, referencias):
+    """Resta a cada foto del diccionario {hash: n} sus n referencias, y
+    borra las que ya no tienen ninguna.
+    """
+    
+    if not referencias: return
+    
+    foto = Foto.__table__
+    sesion.connection().execute(
+        update(foto).where(foto.c.hash == bindparam('h')).\
+        values(referencias=foto.c.referencias - bindparam('n')),
+        [{'h': h, 'n': n} for h, n in referencias.items()])
+    sesion.execute(delete(Foto).\
+                   where(Foto.hash.in_(list(referencias)),
+                         Foto.referencias <= 0).\
+                   execution_options(synchronize_session=False))
+
+def _asignar_foto(sesion, persona, foto):
+    """Normaliza la foto y la asigna a la persona, que debe estar en la
+    sesión, con sus dimensiones originales y sus miniaturas. La foto se
+    guarda en el almacén de fotos, y se libera la que tuviera antes. Una
+    foto que no se puede decodificar se guarda tal cual, sin miniaturas.
+    """
+    
+    normalizada = normalizar_foto(foto, *_opciones_fotos())
+    
+    if normalizada is None:
+        datos = bytes(foto) if foto else None
+        ancho = alto = miniaturas = None
+    else:
+        datos = normalizada.datos
+        ancho, alto = normalizada.ancho_original, normalizada.alto_original
+        miniaturas = normalizada.miniaturas
+    
+    anterior = persona.foto_hash
+    
+    persona.foto_hash = None if datos is None else \
+        _referenciar_foto(sesion, datos, int(normalizada is not None))
+    persona.foto_ancho_original = ancho
+    persona.foto_alto_original = alto
+    _asignar_miniaturas(persona, miniaturas)
+    
+    if anterior is not None:
+        # La persona deja de apuntar a la foto anterior antes de liberarla.
+        sesion.flush()
+        _liberar_foto(sesion, anterior)
+
+def _asignar_miniaturas(persona, miniaturas):
+    """Asigna (o elimina, si son None) las miniaturas de la persona"""
+    
+    if miniaturas is None:
+        persona.per_miniatura = None
+    else:
+        if persona.per_miniatura is None:
+            persona.per_miniatura = Miniatura()
+        persona.per_miniatura.mini_lista = miniaturas[TAM_MINIATURA_LISTA]
+        persona.per_miniatura.mini_ficha = miniaturas[TAM_MINIATURA_FICHA]
+
+def _quitar_preferencia(sesion, clase, persona_id, id_):
+    """Quita la preferencia a los contactos de la clase (Telefono, Mail o
+    Direccion) de la persona, excepto al contacto id_.
+    """
+    
+    sesion.execute(update(clase).\
+                   where(clase.persona_id == persona_id, clase.id_ != id_,
+                         clase.preferencia != 0).\
+                   values(preferencia=0).\
+                   execution_options(synchronize_session=False))
+
+def _guardar_contacto(sesion, clase, id_, persona_id, preferencia, **campos):
+    """Da de alta (si id_ es None) o modifica en la sesión el contacto de
+    la clase (Telefono, Mail o Direccion) con los campos indicados. Si es el
+    preferido, se quita la preferencia a los demás contactos de la misma
+    clase de la persona. Devuelve el id_ del contacto.
+    """
+    
+    if id_ is None:
+        contacto = clase(persona_id=persona_id, preferencia=preferencia,
+                         **campos)
+        sesion.add(contacto)
+    else:
+        contacto = sesion.get(clase, id_)
+        if contacto is None:
+            raise SQLAlchemyError(f"No existe el contacto {id_}")
+        contacto.preferencia = preferencia
+        for campo, valor in campos.items(): setattr(contacto, campo, valor)
+    
+    sesion.flush()
+    
+    if preferencia:
+        _quitar_preferencia(sesion, clase, contacto.persona_id, contacto.id_)
+    
+    return contacto.id_
+
+# Unidades de trabajo: varias operaciones de DBManager en una sola
+# transacción (ver DBManager.transaccion). Mientras dura, todas las
+# operaciones del DBManager usan la misma sesión, en la que commit() solo
+# envía los cambios a la base de datos (flush) y close() no hace nada; la
+# transacción se confirma una sola vez al terminar, o se deshace entera.
+
+class _SesionTransaccion:
+    """Sesión compartida por las operaciones de una transacción"""
+    
+    def __init__(self, sesion):
+        
+        self.__sesion = sesion
+    
+    def commit(self):
+        
+        self.__sesion.flush()
+    
+    def close(self):
+        
+        pass
+    
+    def __getattr__(self, nombre):
+        
+        return getattr(self.__sesion, nombre)
+
+class Transaccion:
+    """Ámbito de una transacción de DBManager.transaccion. Da acceso a los
+    métodos del DBManager, que se ejecutan dentro de la transacción y
+    devuelven lo mismo que fuera de ella, salvo que si alguno devuelve
+    (False, error) se lanza el error, de forma que la transacción se deshace.
+    """
+    
+    def __init__(self, bd):
+        
+        self.__bd = bd
+    
+    def __getattr__(self, nombre):
+        
+        metodo = getattr(self.__bd, nombre)
+        if not callable(metodo): return metodo
+        
+        def ejecutar(*args, **kwargs):
+            ret = metodo(*args, **kwargs)
+            if isinstance(ret, tuple) and ret and ret[0] is False:
+                error = ret[1]
+                raise error if isinstance(error, Exception) else \
+                    SQLAlchemyError(str(error))
+            return ret
+        
+        return ejecutar
+
+# Registro de motores compartido por todo el proceso. Crear un motor de
+# SQLAlchemy es costoso (dialecto, pool, inspección de la URI), así que se crea
+# uno solo por URI y todos los DBManager que apunten a la misma base de datos
+# reutilizan su motor, su pool de conexiones y su fábrica de sesiones.
+
+TAM_POOL = 5
+MAX_DESBORDAMIENTO = 10
+
+_motores = {}
+_bloqueo_motores = threading.Lock()
+
+def _es_bd_en_memoria(db_uri):
+    """Indica si la URI apunta a una base de datos SQLite en memoria"""
+    
+    return db_uri in ("sqlite://", "sqlite:///:memory:") or \
+        "mode=memory" in db_uri
+
+def _crear_motor(db_uri):
+    """Crea el motor y la fábrica de sesiones asociados a db_uri"""
+    
+    if _es_bd_en_memoria(db_uri):
+        # Una base de datos en memoria solo existe mientras vive su conexión,
+        # por lo que se comparte una única conexión entre todos los hilos.
+        motor = create_engine(db_uri, poolclass=StaticPool,
+                              connect_args={'check_same_thread': False})
+    else:
+        motor = create_engine(db_uri, poolclass=QueuePool,
+                              pool_size=TAM_POOL,
+                              max_overflow=MAX_DESBORDAMIENTO)
+    
+    # Perfil de rendimiento de SQLite: sus PRAGMAs se aplican a cada conexión
+    # que abre el pool. Si el perfil no es válido se usa el perfil por
+    # defecto, y si lo es algún PRAGMA se mantiene el valor del perfil. En
+    # ambos casos se guarda el error para informar de él.
+    try:
+        avisos = []
+        perfil, pragmas = perfil_sqlite(avisos = avisos)
+        error_perfil = "\n".join(avisos) or None
+    except ValueError as e:
+        perfil = PERFIL_POR_DEFECTO
+        pragmas = dict(PERFILES_SQLITE[perfil])
+        error_perfil = str(e)
+    
+    # Las claves ajenas (y sus acciones ON DELETE) se activan siempre, sea
+    # cual sea el perfil.
+    @event.listens_for(motor, "connect")
+    def configurar_conexion(conexion_dbapi, registro_conexion):
+        aplicar_pragmas(conexion_dbapi, dict(pragmas, foreign_keys='ON'))
+    
+    # Se crean las tablas que falten (p.ej. las de miniaturas en bases de
+    # datos anteriores a su existencia). Las tablas existentes no se tocan.
+    Base.metadata.create_all(motor)
+    
+    # Se crean las columnas e índices que falten en las tablas existentes y
+    # se añaden las acciones ON DELETE a sus claves ajenas.
+    migrar_columnas(motor, Base.metadata)
+    migrar_indices(motor, Base.metadata)
+    migrar_claves_ajenas(motor, Base.metadata)
+    
+    # Las fotos que aún estén en la tabla persona no se pasan aquí al almacén
+    # de fotos, porque en una base de datos grande tardaría mucho y el motor
+    # se crea con el registro bloqueado: solo se avisa de la migración
+    # pendiente (ver migraciones.py).
+    with motor.connect() as conexion:
+        pendientes = fotos_pendientes(conexion)
+    if pendientes:
+        registro_migraciones.warning("%s: %d fotos pendientes de pasar al "
+                                     "almacén de fotos; ejecute python -m "
+                                     "personal.model.migraciones", db_uri,
+                                     pendientes)
+    
+    # Búsqueda de texto completo (tabla virtual FTS5 y triggers).
+    fts = crear_busqueda_texto(motor)
+    
+    # Instrumentación de las sentencias SQL, que se puede activar y
+    # desactivar en cualquier momento (ver instrumentacion.py).
+    activa, umbral, fichero = _opciones_instrumentacion()
+    instrumentacion = InstrumentacionSQL(motor, umbral)
+    if fichero:
+        try:
+            configurar_registro_lentas(fichero)
+        except OSError:
+            # Las consultas lentas se escriben en la salida de error.
+            pass
+    if activa: instrumentacion.activar()
+    
+    # Detección de consultas N+1 por acción del controlador (modo
+    # depuración), y modo raiseload para las pruebas (ver deteccion_n1.py).
+    fabrica_sesiones = sessionmaker(bind=motor)
+    detectar, raiseload = _opciones_deteccion_n1()
+    detector_n1 = DetectorN1(motor, fabrica_sesiones)
+    if detectar: detector_n1.activar()
+    if raiseload: detector_n1.activar_raiseload()
+        
+    return {'motor': motor,
+            'sesion': fabrica_sesiones,
+            'usos': 0,
+            'fts': fts,
+            'instrumentacion': instrumentacion,
+            'detector_n1': detector_n1,
+            'perfil': perfil,
+            'error_perfil': error_perfil,
+            'fotos_pendientes': pendientes}
+
+def obtener_motor(db_uri = None):
+    """Devuelve la entrada del registro (motor, fábrica de sesiones y número
+    de usos) para db_uri (por defecto, uri_bd()), creándola la primera vez
+    que se solicita.
+    """
+    
+    db_uri = uri_bd() if db_uri is None else db_uri
+    
+    with _bloqueo_motores:
+        entrada = _motores.get(db_uri)
+        if entrada is None:
+            entrada = _crear_motor(db_uri)
+            _motores[db_uri] = entrada
+        entrada['usos'] += 1
+        
+    return entrada
+
+def liberar_motores():
+    """Cierra todas las conexiones de los pools y vacía el registro"""
+    
+    with _bloqueo_motores:
+        for entrada in _motores.values():
+            entrada['motor'].dispose()
+        _motores.clear()
+
+def estadisticas_motores():
+    """Devuelve las estadísticas del pool de cada motor registrado, en un
+    diccionario indexado por la URI de la base de datos.
+    """
+    
+    with _bloqueo_motores:
+        entradas = list(_motores.items())
+        
+    ret = {}
+    for db_uri, entrada in entradas:
+        pool = entrada['motor'].pool
+        estadistica = {'pool': type(pool).__name__,
+                       'perfil': entrada['perfil'],
+                       'usos': entrada['usos'],
+                       'estado': pool.status()}
+        if isinstance(pool, QueuePool):
+            estadistica.update({'tamanyo': pool.size(),
+                                'en_uso': pool.checkedout(),
+                                'disponibles': pool.checkedin(),
+                                'desbordamiento': pool.overflow()})
+        ret[db_uri] = estadistica
+        
+    return ret
+
+# Número máximo de identificadores por sentencia en las bajas de varias
+# personas (SQLite limita el número de parámetros de una sentencia).
+
+TAM_LOTE_BAJAS = 500
+
 # Se crea una clase dedicada a la gestión de la base de datos, como un gestor 
 # de conexiones. Esto te permitirá encapsular la configuración de la base de 
 # datos y la creación de la sesión en una sola clase y utilizarla fácilmente 
@@ -206,13 +877,142 @@ class TipoRelacion(Base):
 
 class DBManager:
 
-    def __init__(self, db_uri = FICHERO_BD):
-        self.engine = create_engine(db_uri, echo=True)
-        self.sesion = sessionmaker(bind=self.engine)
+    def __init__(self, db_uri = None):
+        db_uri = uri_bd() if db_uri is None else db_uri
+        entrada = obtener_motor(db_uri)
+        self.db_uri = db_uri
+        self.engine = entrada['motor']
+        self.sesion = entrada['sesion']
+        self.fts = entrada['fts']
+        self.instrumentacion = entrada['instrumentacion']
+        self.detector_n1 = entrada['detector_n1']
+        self.perfil = entrada['perfil']
+        self.error_perfil = entrada['error_perfil']
+        self.fotos_pendientes = entrada['fotos_pendientes']
+        self.__transaccion = None
 
     def obtener_sesion(self):
+        """Devuelve una sesión nueva o, dentro de una transacción, la sesión
+        de la transacción.
+        """
+        
+        if self.__transaccion is not None: return self.__transaccion
+        
         return self.sesion()
 
+    @contextmanager
+    def transaccion(self):
+        """Gestor de contexto que agrupa varias operaciones en una sola
+        transacción, con un solo commit al terminar:
+        
+            with bd.transaccion() as t:
+                id_ = t.alta_persona(...)[1]
+                t.guardar_telefono(None, id_, ...)
+        
+        Devuelve un objeto Transaccion, con los mismos métodos que el
+        DBManager. Si una operación falla (o se lanza cualquier excepción
+        dentro del bloque), se deshace todo lo hecho y la excepción se
+        propaga. Una transacción dentro de otra se une a la de fuera. La
+        transacción empieza con BEGIN IMMEDIATE, que reserva la escritura
+        desde el principio, así que conviene que sea corta.
+        """
+        
+        if self.__transaccion is not None:
+            yield Transaccion(self)
+            return
+        
+        sesion = self.sesion()
+        
+        try:
+            sesion.connection().exec_driver_sql("BEGIN IMMEDIATE")
+            self.__transaccion = _SesionTransaccion(sesion)
+            yield Transaccion(self)
+            sesion.commit()
+        except BaseException:
+            sesion.rollback()
+            raise
+        finally:
+            self.__transaccion = None
+            sesion.close()
+
+    def en_transaccion(self, funcion, *args):
+        """Ejecuta funcion(transacción, *args) dentro de una transacción (ver
+        transaccion). Devuelve (True, lo que devuelve funcion) si no hay
+        errores, y (False, error) en caso contrario, sin haber guardado nada.
+        """
+        
+        try:
+            
+            with self.transaccion() as t:
+                ret = True, funcion(t, *args)
+        
+        except (SQLAlchemyError, ValueError) as e:
+            
+            ret = False, e
+        
+        return ret
+
+    @contextmanager
+    def __conexion_escritura(self):
+        """Conexión para escribir con SQLAlchemy Core en su propia
+        transacción o, dentro de una transacción, en un SAVEPOINT de esta.
+        """
+        
+        if self.__transaccion is None:
+            with self.engine.begin() as conexion:
+                yield conexion
+        else:
+            with self.__transaccion.begin_nested():
+                yield self.__transaccion.connection()
+    
+    def estadisticas_pool(self):
+        """Devuelve las estadísticas del pool de conexiones de la base de
+        datos de este gestor.
+        """
+        
+        return estadisticas_motores().get(self.db_uri)
+    
+    def obtener_perfil_sqlite(self):
+        """Devuelve el nombre del perfil de SQLite aplicado y el valor
+        efectivo de sus PRAGMAs, leído de una conexión, en un diccionario
+        {'perfil', 'error', 'pragmas'}.
+        """
+        
+        try:
+            with self.engine.connect() as conexion:
+                pragmas = {p: conexion.execute(text(f"PRAGMA {p}")).scalar()
+                           for p in PRAGMAS_PERMITIDOS}
+            ret = True, {'perfil': self.perfil,
+                         'error': self.error_perfil,
+                         'pragmas': pragmas}
+        except SQLAlchemyError as e:
+            ret = False, e
+            
+        return ret
+
+    def __guardar_contacto(self, clase, id_, persona_id, preferencia,
+                           **campos):
+        """Guarda el contacto con _guardar_contacto en su propia transacción.
+        Devuelve (True, id_ del contacto) o (False, error).
+        """
+        
+        try:
+            
+            sesion = self.obtener_sesion()
+            id_ = _guardar_contacto(sesion, clase, id_, persona_id,
+                                    preferencia, **campos)
+            sesion.commit()
+            sesion.close()
+            
+            ret = True, id_
+            
+        except SQLAlchemyError as e:
+            
+            sesion.close()
+            ret = False, e
+            
+        return ret
+
     # ################
     # TIPO DE RELACIÓN
     # ################
@@ -376,6 +1176,19 @@ class DBManager:
 
         return ret
 
+    def guardar_telefono(self, telefono_id, persona_id, numero, preferencia,
+                         observ=None):
+        """Da de alta (si telefono_id es None) o modifica el teléfono de la
+        persona y, si es el preferido, quita la preferencia a los demás
+        teléfonos de la persona, todo en una sola transacción. Devuelve
+        (True, id_ del teléfono) si no hay errores, y (False, error) en caso
+        contrario (y entonces no se ha guardado nada).
+        """
+        
+        return self.__guardar_contacto(Telefono, telefono_id, persona_id,
+                                       preferencia, numero=numero,
+                                       observ=observ)
+
     def obtener_telefonos_por_persona_id(self, persona_id):
         
         try:
@@ -480,6 +1293,17 @@ class DBManager:
 
         return ret
 
+    def guardar_mail(self, mail_id, persona_id, mail, preferencia,
+                     observ=None):
+        """Da de alta (si mail_id es None) o modifica el correo de la persona
+        y, si es el preferido, quita la preferencia a los demás correos de la
+        persona, todo en una sola transacción. Devuelve (True, id_ del
+        correo) o (False, error).
+        """
+        
+        return self.__guardar_contacto(Mail, mail_id, persona_id,
+                                       preferencia, mail=mail, observ=observ)
+
     def obtener_mails_por_persona_id(self, persona_id):
         try:
             sesion = self.obtener_sesion()
@@ -563,6 +1387,52 @@ class DBManager:
             
         return ret
 
+    def guardar_direccion(self, direccion_id, persona_id, direccion, cp_id,
+                          cp, localidad, provincia, preferencia,
+                          observ=None):
+        """Guarda en una sola transacción la dirección de la persona y su
+        código postal: da de alta el código postal si cp_id es None (y si
+        no, lo modifica con cp, localidad y provincia), da de alta (si
+        direccion_id es None) o modifica la dirección y, si es la preferida,
+        quita la preferencia a las demás direcciones de la persona. Devuelve
+        (True, (id_ de la dirección, id_ del código postal)) o
+        (False, error), y en ese caso no se ha guardado nada.
+        """
+        
+        try:
+            
+            sesion = self.obtener_sesion()
+            
+            if cp_id is None:
+                codigo_postal = CodigoPostal(cp=cp, localidad=localidad,
+                                             provincia=provincia)
+                sesion.add(codigo_postal)
+            else:
+                codigo_postal = sesion.get(CodigoPostal, int(cp_id))
+                if codigo_postal is None:
+                    raise SQLAlchemyError(f"No existe el código postal "
+                                          f"{cp_id}")
+                codigo_postal.cp = cp
+                codigo_postal.localidad = localidad
+                codigo_postal.provincia = provincia
+            sesion.flush()
+            
+            id_ = _guardar_contacto(sesion, Direccion, direccion_id,
+                                    persona_id, preferencia,
+                                    direccion=direccion,
+                                    cp_id=codigo_postal.id_, observ=observ)
+            ret = True, (id_, codigo_postal.id_)
+            
+            sesion.commit()
+            sesion.close()
+            
+        except SQLAlchemyError as e:
+            
+            sesion.close()
+            ret = False, e
+            
+        return ret
+
     def obtener_direcciones_por_persona_id(self, persona_id):
         
         try:
@@ -694,9 +1564,10 @@ class DBManager:
         try:
  
             nueva_persona = Persona(nif=nif, nombre=nombre, ap1=ap1, ap2=ap2,\
-                                    fnac=fnac, foto=foto, sexo=sexo)
+                                    fnac=fnac, sexo=sexo)
             sesion = self.obtener_sesion()
             sesion.add(nueva_persona)
+            _asignar_foto(sesion, nueva_persona, foto)
             sesion.commit()
             id_ = nueva_persona.id_ 
             sesion.close()
@@ -709,21 +1580,112 @@ class DBManager:
 
         return ret
 
+    def alta_personas_lote(self, personas):
+        """Da de alta la lista de personas (diccionarios con las columnas de
+        Persona) con una única sentencia executemany y en una sola
+        transacción. Si el lote falla por una restricción, se repite fila a
+        fila, también en una sola transacción, para descartar solo las que
+        fallan. Devuelve (True, lista de tuplas (índice, error) de las filas
+        rechazadas) o (False, error).
+        """
+        
+        try:
+            
+            try:
+                with self.__conexion_escritura() as conexion:
+                    conexion.execute(insert(Persona.__table__), personas)
+                rechazos = []
+                
+            except IntegrityError:
+                
+                # En SQLite una restricción violada solo deshace la sentencia
+                # que la viola, así que la transacción del lote continúa.
+                rechazos = []
+                with self.__conexion_escritura() as conexion:
+                    for i, persona in enumerate(personas):
+                        try:
+                            conexion.execute(insert(Persona.__table__),
+                                             persona)
+                        except IntegrityError as e:
+                            rechazos.append((i, str(e.orig)))
+            
+            ret = True, rechazos
+        
+        except SQLAlchemyError as e:
+            
+            ret = False, e
+            
+        return ret
+    
+    def obtener_nifs(self):
+        """Devuelve (True, conjunto de NIF en mayúsculas de todas las
+        personas) o (False, error).
+        """
+        
+        try:
+            
+            sesion = self.obtener_sesion()
+            nifs = {n.upper() for (n,) in sesion.query(Persona.nif)}
+            sesion.close()
+            
+            ret = True, nifs
+            
+        except SQLAlchemyError as e:
+            
+            ret = False, e
+            
+        return ret
+
     def baja_persona(self, persona_id):
         """Elimina la persona con identificador persona_id"""
         
+        ret = self.baja_personas([persona_id])
+        
+        return (True, None) if ret[0] else ret
+
+    def baja_personas(self, persona_ids):
+        """Elimina las personas cuyos identificadores están en persona_ids,
+        en una transacción. Sus teléfonos, correos, direcciones y miniaturas
+        los elimina la base de datos (ON DELETE CASCADE), así como la relación
+        de otras personas con ellas (ON DELETE SET NULL), de forma que el
+        número de sentencias no depende del número de contactos. Devuelve
+        (True, número de personas eliminadas) o (False, error).
+        """
+        
+        ids = list(dict.fromkeys(int(i) for i in persona_ids))
+        
         try:
             
             sesion = self.obtener_sesion()
-            persona = sesion.query(Persona).filter_by(id_=persona_id).first()
-            sesion.delete(persona)
+            
+            eliminadas = 0
+            referencias = {}
+            
+            for i in range(0, len(ids), TAM_LOTE_BAJAS):
+                
+                lote = ids[i:i + TAM_LOTE_BAJAS]
+                
+                for hash_, n in sesion.query(Persona.foto_hash, func.count()).\
+                    filter(Persona.id_.in_(lote),
+                           Persona.foto_hash.isnot(None)).\
+                    group_by(Persona.foto_hash):
+                    referencias[hash_] = referencias.get(hash_, 0) + n
+                
+                eliminadas += sesion.execute(
+                    delete(Persona).where(Persona.id_.in_(lote)).\
+                    execution_options(synchronize_session=False)).rowcount
+            
+            # Las personas eliminadas ya no apuntan a sus fotos.
+            _liberar_fotos(sesion, referencias)
+            
             sesion.commit()
             sesion.close()
             
-            ret = True, None
+            ret = True, eliminadas
         
         except SQLAlchemyError as e:
             
+            sesion.close()
             ret = False, e
 
         return ret
@@ -745,8 +1707,8 @@ class DBManager:
             persona.relacionado_con = relacionado_con_id
             persona.tipo_relacion_id = tipo_relacion_id
             persona.observ = nueva_observ
-            persona.foto = nueva_foto
             persona.sexo = nuevo_sexo
+            _asignar_foto(sesion, persona, nueva_foto)
             sesion.commit()
             id_ = persona.id_
             sesion.close()
@@ -759,9 +1721,396 @@ class DBManager:
 
         return ret
 
+    def modificar_campos_persona(self, persona_id, campos):
+        """Modifica solo las columnas de la persona indicadas en campos
+        (diccionario columna -> valor nuevo, ver CAMPOS_PERSONA), con un
+        UPDATE que incluye únicamente esas columnas. Si campos incluye la
+        foto, se normaliza y se regeneran sus miniaturas; si no, la foto ni
+        se lee ni se reescribe. Devuelve (True, persona_id) si no hay
+        errores, y (False, error) en caso contrario.
+        """
+        
+        desconocidos = set(campos) - set(CAMPOS_PERSONA)
+        if desconocidos:
+            return False, ValueError("Columnas no modificables: " + \
+                                     ", ".join(sorted(desconocidos)))
+        
+        if not campos: return True, persona_id
+        
+        try:
+            
+            sesion = self.obtener_sesion()
+            
+            if 'foto' in campos:
+                
+                # La foto necesita el objeto para sus miniaturas. El UPDATE
+                # del ORM también incluye solo las columnas cambiadas.
+                persona = sesion.get(Persona, persona_id)
+                if persona is None:
+                    raise SQLAlchemyError(f"No existe la persona {persona_id}")
+                for columna, valor in campos.items():
+                    if columna != 'foto': setattr(persona, columna, valor)
+                _asignar_foto(sesion, persona, campos['foto'])
+                
+            else:
+                
+                resultado = sesion.execute(
+                    update(Persona).where(Persona.id_ == persona_id).\
+                    values(**campos).\
+                    execution_options(synchronize_session=False))
+                if resultado.rowcount == 0:
+                    raise SQLAlchemyError(f"No existe la persona {persona_id}")
+            
+            sesion.commit()
+            sesion.close()
+            
+            ret = True, persona_id
+        
+        except SQLAlchemyError as e:
+            
+            ret = False, e
+        
+        return ret
+
+    def obtener_pagina_personas(self, orden = 'nombre', descendente = False,
+                                filtro = None, cursor = None, limite = 200):
+        """Devuelve una página del listado ligero de personas en la tupla
+        (True, PaginaPersonas) o (False, error). Cada fila tiene los
+        atributos id_, nif, nombre, ap1, ap2, fnac, sexo, nombre_completo y
+        tiene_foto. orden es uno de ORDENES_PERSONA (apellidos, nombre,
+        fnac, nif o id_). Si se indica filtro, solo se devuelven las personas
+        cuyo nombre completo lo contiene.
+        
+        La primera página se pide sin cursor, y cada una de las siguientes
+        con el cursor de la anterior, que es None cuando ya no hay más. La
+        paginación es por clave: cada página empieza justo tras la última
+        fila de la anterior recorriendo el índice del orden, así que cuesta
+        lo mismo sea cual sea su posición, y las altas y bajas entre una
+        página y otra no hacen que se repitan ni se salten filas.
+        """
+        
+        try:
+            
+            valores = None if cursor is None else \
+                _decodificar_cursor(cursor, orden, descendente)
+            
+            sesion = self.obtener_sesion()
+            consulta = sesion.query(*_columnas_lista())
+            if filtro:
+                consulta = consulta.filter(_nombre_completo().contains(
+                    filtro, autoescape=True))
+            # Se pide una fila de más para saber si hay página siguiente.
+            filas = _paginar(consulta, orden, descendente, valores,
+                             limite + 1).all()
+            sesion.close()
+            
+            siguiente = None
+            if len(filas) > limite:
+                filas = filas[:limite]
+                siguiente = _codificar_cursor(orden, descendente,
+                                              _valores_orden(filas[-1],
+                                                             orden))
+            
+            ret = True, PaginaPersonas(filas, siguiente)
+            
+        except (SQLAlchemyError, ValueError) as e:
+            
+            ret = False, e
+            
+        return ret
+    
+    def obtener_personas_por_ids(self, ids):
+        """Devuelve el listado ligero (las mismas filas que
+        obtener_pagina_personas) de las personas cuyos identificadores están
+        en ids, en el mismo orden, en la tupla (True, filas) o
+        (False, error).
+        """
+        
+        try:
+            
+            sesion = self.obtener_sesion()
+            filas = sesion.query(*_columnas_lista()).\
+                filter(Persona.id_.in_(ids)).all()
+            sesion.close()
+            
+            posicion = {id_: i for i, id_ in enumerate(ids)}
+            filas.sort(key=lambda f: posicion[f.id_])
+            
+            ret = True, filas
+            
+        except SQLAlchemyError as e:
+            
+            ret = False, e
+            
+        return ret
+    
+    def obtener_nombres_personas(self):
+        """Devuelve (True, filas) con la tupla (id_, nombre, ap1, ap2) de
+        todas las personas, para construir el índice de búsqueda, o
+        (False, error).
+        """
+        
+        try:
+            
+            sesion = self.obtener_sesion()
+            filas = sesion.query(Persona.id_, Persona.nombre, Persona.ap1,
+                                 Persona.ap2).all()
+            sesion.close()
+            
+            ret = True, filas
+            
+        except SQLAlchemyError as e:
+            
+            ret = False, e
+            
+        return ret
+    
+    def buscar_personas(self, texto, desplazamiento = 0, limite = 50):
+        """Busca texto en toda la ficha de las personas (NIF, nombre,
+        apellidos, observaciones, correos, teléfonos y direcciones) con la
+        búsqueda de texto completo. Cada palabra se busca como prefijo.
+        Devuelve (True, ids) con una página de identificadores de persona
+        ordenados por relevancia, o (False, error).
+        """
+        
+        if not self.fts:
+            return False, "La base de datos no dispone de búsqueda FTS5"
+        
+        consulta = consulta_fts(texto)
+        if consulta is None: return True, []
+        
+        try:
+            
+            sesion = self.obtener_sesion()
+            ids = sesion.execute(sql_buscar(),
+                                 {'consulta': consulta, 'limite': limite,
+                                  'desplazamiento': desplazamiento}).\
+                scalars().all()
+            sesion.close()
+            
+            ret = True, ids
+            
+        except SQLAlchemyError as e:
+            
+            ret = False, e
+            
+        return ret
+    
+    def obtener_foto_persona(self, persona_id):
+        """Devuelve (True, foto) con los bytes de la foto de la persona, o
+        None si no tiene foto, y (False, error) si ha habido un error.
+        """
+        
+        try:
+            
+            sesion = self.obtener_sesion()
+            foto = sesion.query(Foto.datos).\
+                join(Persona, Persona.foto_hash == Foto.hash).\
+                filter(Persona.id_ == persona_id).scalar()
+            sesion.close()
+            
+            ret = True, foto
+            
+        except SQLAlchemyError as e:
+            
+            ret = False, e
+            
+        return ret
+
+    def abrir_foto(self, foto_hash):
+        """Abre para lectura por trozos la foto del almacén de fotos con el
+        hash indicado, sin cargarla entera en memoria. Devuelve
+        (True, fichero binario) o (True, None) si no existe, y (False, error)
+        si ha habido un error. El fichero ocupa una conexión del pool hasta
+        que se cierra, así que debe cerrarse (p.ej. usándolo con with).
+        """
+        
+        try:
+            
+            with self.engine.connect() as conexion:
+                fila = conexion.execute(
+                    text("SELECT rowid FROM foto WHERE hash = :hash"),
+                    {'hash': foto_hash}).scalar()
+            
+            ret = True, None if fila is None else \
+                abrir_blob_motor(self.engine, 'foto', 'datos', fila)
+            
+        except (SQLAlchemyError, sqlite3.Error) as e:
+            
+            ret = False, e
+            
+        return ret
+    
+    def abrir_foto_persona(self, persona_id):
+        """Abre para lectura por trozos la foto de la persona. Devuelve lo
+        mismo que abrir_foto (None si la persona no tiene foto).
+        """
+        
+        try:
+            
+            sesion = self.obtener_sesion()
+            foto_hash = sesion.query(Persona.foto_hash).\
+                filter(Persona.id_ == persona_id).scalar()
+            sesion.close()
+            
+            ret = (True, None) if foto_hash is None else \
+                self.abrir_foto(foto_hash)
+            
+        except SQLAlchemyError as e:
+            
+            ret = False, e
+            
+        return ret
+
+    def obtener_informe_fotos(self):
+        """Devuelve (True, InformeFotos) con el uso del almacén de fotos y
+        el espacio que ahorra, o (False, error).
+        """
+        
+        try:
+            
+            with self.engine.connect() as conexion:
+                informe = informe_fotos(conexion)
+            
+            ret = True, informe
+            
+        except SQLAlchemyError as e:
+            
+            ret = False, e
+            
+        return ret
+
+    def obtener_estadisticas(self):
+        """Devuelve (True, recuentos) con el número de filas de cada tabla, en
+        un diccionario indexado por el nombre de la tabla, o (False, error).
+        Todos los recuentos se obtienen con una sola consulta.
+        """
+        
+        try:
+            
+            tablas = [clase.__table__ for clase in
+                      (Persona, Telefono, Mail, Direccion, CodigoPostal,
+                       TipoRelacion, Foto, Miniatura)]
+            consulta = select(*(select(func.count()).select_from(t).\
+                                scalar_subquery().label(t.name)
+                                for t in tablas))
+            
+            with self.engine.connect() as conexion:
+                recuentos = conexion.execute(consulta).one()._asdict()
+            
+            ret = True, recuentos
+            
+        except SQLAlchemyError as e:
+            
+            ret = False, e
+            
+        return ret
+
+    def obtener_miniatura(self, persona_id, tam = TAM_MINIATURA_FICHA):
+        """Devuelve (True, miniatura) con el PNG precalculado de tamaño tam
+        (TAM_MINIATURA_LISTA o TAM_MINIATURA_FICHA) de la foto de la persona,
+        o None si no lo tiene, y (False, error) si ha habido un error.
+        """
+        
+        try:
+            
+            columna = Miniatura.mini_lista if tam == TAM_MINIATURA_LISTA \
+                else Miniatura.mini_ficha
+            
+            sesion = self.obtener_sesion()
+            miniatura = sesion.query(columna).\
+                filter(Miniatura.persona_id == persona_id).scalar()
+            sesion.close()
+            
+            ret = True, miniatura
+            
+        except SQLAlchemyError as e:
+            
+            ret = False, e
+            
+        return ret
+    
+    def obtener_miniaturas(self, persona_ids, tam = TAM_MINIATURA_LISTA):
+        """Devuelve (True, diccionario id_ -> PNG) con las miniaturas de
+        tamaño tam de las personas de persona_ids que las tienen, en una sola
+        consulta, o (False, error).
+        """
+        
+        try:
+            
+            columna = Miniatura.mini_lista if tam == TAM_MINIATURA_LISTA \
+                else Miniatura.mini_ficha
+            
+            sesion = self.obtener_sesion()
+            miniaturas = dict(sesion.query(Miniatura.persona_id, columna).\
+                filter(Miniatura.persona_id.in_(persona_ids)).all())
+            sesion.close()
+            
+            ret = True, miniaturas
+            
+        except SQLAlchemyError as e:
+            
+            ret = False, e
+            
+        return ret
+    
+    def generar_miniaturas_pendientes(self, tam_lote = 50):
+        """Genera las miniaturas de todas las personas con foto que aún no las
+        tienen, confirmando cada lote de tam_lote personas. Las fotos que no
+        se pueden decodificar se marcan en el almacén para no volver a
+        intentarlo. Devuelve (True, número de miniaturas generadas) o
+        (False, error).
+        """
+        
+        try:
+            
+            sesion = self.obtener_sesion()
+            ids = [i for (i,) in sesion.query(Persona.id_).\
+                   join(Foto, Foto.hash == Persona.foto_hash).\
+                   outerjoin(Miniatura, Miniatura.persona_id == Persona.id_).\
+                   filter(Miniatura.persona_id.is_(None),
+                          Foto.decodificable.isnot(0)).\
+                   all()]
+            generadas = 0
+            
+            for i in range(0, len(ids), tam_lote):
+                lote = sesion.query(Persona.id_, Persona.foto_hash).\
+                    filter(Persona.id_.in_(ids[i:i + tam_lote])).all()
+                for persona_id, foto_hash in lote:
+                    # PIL lee la foto por trozos directamente del BLOB.
+                    ret = self.abrir_foto(foto_hash)
+                    if not ret[0]:
+                        sesion.close()
+                        return ret
+                    if ret[1] is None: continue
+                    with ret[1] as foto:
+                        miniaturas = generar_miniaturas(foto)
+                    sesion.execute(update(Foto).\
+                                   where(Foto.hash == foto_hash).\
+                                   values(decodificable=int(miniaturas is
+                                                            not None)))
+                    if miniaturas is not None:
+                        sesion.add(Miniatura(
+                            persona_id=persona_id,
+                            mini_lista=miniaturas[TAM_MINIATURA_LISTA],
+                            mini_ficha=miniaturas[TAM_MINIATURA_FICHA]))
+                        generadas += 1
+                sesion.commit()
+                
+            sesion.close()
+            
+            ret = True, generadas
+            
+        except SQLAlchemyError as e:
+            
+            ret = False, e
+            
+        return ret
+
     def obtener_todas_personas(self):
         """Devuelve todas las personas del sistema, en la tupla (True, personas)
-        si no hay problemas, y (False, error) si ha habido un error.
+        si no hay problemas, y (False, error) si ha habido un error. La foto
+        (en el almacén de fotos) y las observaciones no se cargan.
         """
 
         try:
@@ -778,11 +2127,104 @@ class DBManager:
 
         return ret
 
-    def obtener_persona_por_id(self, persona_id):
+    def obtener_ficha_persona(self, persona_id):
+        """Devuelve (True, ficha) con la ficha completa (FichaPersona) de la
+        persona: datos personales, miniatura de la foto, tipo de relación,
+        persona relacionada, teléfonos, correos y direcciones con su código
+        postal, o (True, None) si no existe, y (False, error) si ha habido un
+        error. Todo se recupera en una sola consulta; la foto original no se
+        carga.
+        """
         
         try:
+            
+            # Los contactos de una persona son pocos, por lo que se cargan
+            # todos con JOIN en la misma consulta en lugar de con consultas
+            # adicionales.
+            
             sesion = self.obtener_sesion()
-            persona = sesion.query(Persona).filter_by(id_=persona_id).first()
+            persona = sesion.query(Persona).\
+                options(undefer_group('detalle'),
+                        joinedload(Persona.per_tipo_relacion),
+                        joinedload(Persona.per_relaciones),
+                        joinedload(Persona.per_miniatura),
+                        joinedload(Persona.per_telefonos),
+                        joinedload(Persona.per_mails),
+                        joinedload(Persona.per_direcciones).\
+                            joinedload(Direccion.dir_cp)).\
+                filter(Persona.id_ == persona_id).first()
+            ficha = None if persona is None else _crear_ficha(persona)
+            sesion.close()
+            
+            ret = True, ficha
+            
+        except SQLAlchemyError as e:
+            
+            ret = False, e
+            
+        return ret
+
+    def recorrer_fichas(self, con_foto = False, tam_lote = 500,
+                        orden = 'id_', descendente = False):
+        """Generador que recorre todas las personas, en el orden indicado (uno
+        de ORDENES_PERSONA), y devuelve para cada una la tupla (ficha, foto),
+        donde foto es None si con_foto es False. Las personas se leen de
+        tam_lote en tam_lote, paginando por clave como
+        obtener_pagina_personas y con una sesión corta por lote, y los
+        contactos de cada lote con una consulta por relación, de modo que la
+        memoria usada no depende del número de personas. La ficha no incluye
+        la miniatura. Los errores de base de datos se propagan como
+        SQLAlchemyError, y un orden desconocido como ValueError.
+        """
+        
+        _claves_orden(orden)
+        
+        opciones = [undefer_group('detalle'),
+                    noload(Persona.per_miniatura),
+                    selectinload(Persona.per_tipo_relacion),
+                    selectinload(Persona.per_relaciones),
+                    selectinload(Persona.per_telefonos),
+                    selectinload(Persona.per_mails),
+                    selectinload(Persona.per_direcciones).\
+                        joinedload(Direccion.dir_cp)]
+        if con_foto:
+            opciones.append(selectinload(Persona.per_foto).\
+                            undefer(Foto.datos))
+        
+        valores = None
+        
+        while True:
+            
+            sesion = self.obtener_sesion()
+            try:
+                personas = _paginar(sesion.query(Persona).options(*opciones),
+                                    orden, descendente, valores,
+                                    tam_lote).all()
+                lote = [(_crear_ficha(p), None if not con_foto or \
+                         p.per_foto is None else p.per_foto.datos)
+                        for p in personas]
+                if personas: valores = _valores_orden(personas[-1], orden)
+            finally:
+                sesion.close()
+            
+            yield from lote
+            
+            if len(lote) < tam_lote: break
+    
+    def obtener_persona_por_id(self, persona_id, con_foto = True):
+        """Devuelve (True, persona) con todos sus datos, o (False, error). La
+        foto está en persona.per_foto.datos; si con_foto es False, no se
+        carga.
+        """
+        
+        try:
+            sesion = self.obtener_sesion()
+            opciones = [undefer_group('detalle')]
+            if con_foto:
+                opciones.append(joinedload(Persona.per_foto).\
+                                undefer(Foto.datos))
+            persona = sesion.query(Persona).options(*opciones).\
+                filter_by(id_=persona_id).first()
             sesion.close()
 
             ret = True, persona
@@ -181,46 +181,14 @@ class Ui_MainWindow(object):
         self.groupBox_buscar = QtWidgets.QGroupBox(parent=self.centralwidget)
         self.groupBox_buscar.setGeometry(QtCore.QRect(20, 10, 321, 741))
         self.groupBox_buscar.setObjectName("groupBox_buscar")
-        self.tableWidget_per = QtWidgets.QTableWidget(parent=self.groupBox_buscar)
-        self.tableWidget_per.setGeometry(QtCore.QRect(10, 60, 301, 661))
-        self.tableWidget_per.setEditTriggers(QtWidgets.QAbstractItemView.EditTrigger.NoEditTriggers)
-        self.tableWidget_per.setAlternatingRowColors(True)
-        self.tableWidget_per.setSelectionMode(QtWidgets.QAbstractItemView.SelectionMode.SingleSelection)
-        self.tableWidget_per.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectionBehavior.SelectRows)
-        self.tableWidget_per.setObjectName("tableWidget_per")
-        self.tableWidget_per.setColumnCount(3)
-        self.tableWidget_per.setRowCount(0)
-        item = QtWidgets.QTableWidgetItem()
-        font = QtGui.QFont()
-        font.setPointSize(12)
-        font.setBold(True)
-        item.setFont(font)
-        item.setBackground(QtGui.QColor(0, 170, 255))
-        brush = QtGui.QBrush(QtGui.QColor(255, 255, 255))
-        brush.setStyle(QtCore.Qt.BrushStyle.NoBrush)
-        item.setForeground(brush)
-        self.tableWidget_per.setHorizontalHeaderItem(0, item)
-        item = QtWidgets.QTableWidgetItem()
-        font = QtGui.QFont()
-        font.setPointSize(12)
-        font.setBold(True)
-        item.setFont(font)
-        item.setBackground(QtGui.QColor(0, 170, 255))
-        brush = QtGui.QBrush(QtGui.QColor(255, 255, 255))
-        brush.setStyle(QtCore.Qt.BrushStyle.NoBrush)
-        item.setForeground(brush)
-        self.tableWidget_per.setHorizontalHeaderItem(1, item)
-        item = QtWidgets.QTableWidgetItem()
-        font = QtGui.QFont()
-        font.setPointSize(12)
-        font.setBold(True)
-        item.setFont(font)
-        item.setBackground(QtGui.QColor(0, 170, 255))
-        brush = QtGui.QBrush(QtGui.QColor(255, 255, 255))
-        brush.setStyle(QtCore.Qt.BrushStyle.NoBrush)
-        item.setForeground(brush)
-        self.tableWidget_per.setHorizontalHeaderItem(2, item)
-        self.tableWidget_per.verticalHeader().setVisible(False)
+        self.tableView_per = QtWidgets.QTableView(parent=self.groupBox_buscar)
+        self.tableView_per.setGeometry(QtCore.QRect(10, 60, 301, 661))
+        self.tableView_per.setEditTriggers(QtWidgets.QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.tableView_per.setAlternatingRowColors(True)
+        self.tableView_per.setSelectionMode(QtWidgets.QAbstractItemView.SelectionMode.SingleSelection)
+        self.tableView_per.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectionBehavior.SelectRows)
+        self.tableView_per.setObjectName("tableView_per")
+        self.tableView_per.verticalHeader().setVisible(False)
         self.lineEdit_buscar_per = QtWidgets.QLineEdit(parent=self.groupBox_buscar)
         self.lineEdit_buscar_per.setGeometry(QtCore.QRect(10, 30, 301, 25))
         self.lineEdit_buscar_per.setAutoFillBackground(True)
@@ -711,8 +679,8 @@ class Ui_MainWindow(object):
         self.tabWidget_contacto_per.setCurrentIndex(0)
         self.stackedWidget_tipo_rel.setCurrentIndex(0)
         QtCore.QMetaObject.connectSlotsByName(MainWindow)
-        MainWindow.setTabOrder(self.lineEdit_buscar_per, self.tableWidget_per)
-        MainWindow.setTabOrder(self.tableWidget_per, self.pushButton_alta_per)
+        MainWindow.setTabOrder(self.lineEdit_buscar_per, self.tableView_per)
+        MainWindow.setTabOrder(self.tableView_per, self.pushButton_alta_per)
         MainWindow.setTabOrder(self.pushButton_alta_per, self.pushButton_baja_per)
         MainWindow.setTabOrder(self.pushButton_baja_per, self.lineEdit_dni_per)
         MainWindow.setTabOrder(self.lineEdit_dni_per, self.comboBox_sexo_per)
@@ -733,15 +701,8 @@ class Ui_MainWindow(object):
         _translate = QtCore.QCoreApplication.translate
         MainWindow.setWindowTitle(_translate("MainWindow", "Personal"))
         self.groupBox_buscar.setTitle(_translate("MainWindow", "Personal"))
-        self.tableWidget_per.setToolTip(_translate("MainWindow", "<html><head/><body><p>Personas dadas de alta en el sistema</p></body></html>"))
-        self.tableWidget_per.setSortingEnabled(True)
-        item = self.tableWidget_per.horizontalHeaderItem(0)
-        item.setText(_translate("MainWindow", "NRP"))
-        item.setToolTip(_translate("MainWindow", "<html><head/><body><p><span style=\" font-weight:700;\">N</span>úmero de <span style=\" font-weight:700;\">R</span>egistro de <span style=\" font-weight:700;\">P</span>ersonal</p></body></html>"))
-        item = self.tableWidget_per.horizontalHeaderItem(1)
-        item.setText(_translate("MainWindow", "Personal"))
-        item = self.tableWidget_per.horizontalHeaderItem(2)
-        item.setText(_translate("MainWindow", "Foto"))
+        self.tableView_per.setToolTip(_translate("MainWindow", "<html><head/><body><p>Personas dadas de alta en el sistema</p></body></html>"))
+        self.tableView_per.setSortingEnabled(True)
         self.lineEdit_buscar_per.setToolTip(_translate("MainWindow", "<html><head/><body><p>Introduzca el texto a buscar en las fichas de personal</p></body></html>"))
         self.lineEdit_buscar_per.setPlaceholderText(_translate("MainWindow", "Introduce texto a buscar"))
         self.groupBox_personal.setTitle(_translate("MainWindow", "Datos Personales"))
@@ -29,6 +29,7 @@ setup(
     entry_points={
         'console_scripts': [
         'personal = personal.__main__:main',
+        'personal-cli = personal.cli:main',
         ],
     },
     classifiers=[